@@ -0,0 +1,201 @@
+"""Admission control: per-user rate limits and a global cap on DB work.
+
+Both limits are per worker process. Rate limits answer 429 and the DB
+limiter answers 503, each with a Retry-After header, so a saturated
+database sheds load quickly instead of piling up blocked workers.
+"""
+import logging
+import threading
+import time
+from functools import wraps
+
+from flask import request, session
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Requests allowed to hold a DB connection at once, below the pool size so
+# admitted requests never fall back to unpooled connections. Set by configure()
+DB_CONCURRENCY = Config.DB_CONCURRENCY
+# Requests allowed to wait for a slot; past this they are rejected at once
+DB_QUEUE_DEPTH = Config.DB_QUEUE_DEPTH
+# Longest a queued request waits for a slot, in seconds
+DB_QUEUE_TIMEOUT = Config.DB_QUEUE_TIMEOUT
+RETRY_AFTER = 1
+
+# route name -> (tokens per second, burst size) for each user
+RATE_LIMITS = {
+    'catalog': (2.0, 10),
+    'checkout': (1.0, 5),
+    'process_payment': (0.2, 3),
+    'add_review': (0.1, 3),
+}
+# Idle buckets are dropped once a limiter tracks more users than this
+MAX_BUCKETS = 10000
+
+
+class RateLimiter:
+    """Token buckets keyed by user."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.rejected = 0
+        self._buckets = {}  # key -> [tokens, last refill time]
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """Take one token for key. Returns 0 if allowed, else seconds until a token is free."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= MAX_BUCKETS:
+                    self._prune(now)
+                bucket = self._buckets[key] = [self.burst, now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            self.rejected += 1
+            return (1 - bucket[0]) / self.rate
+
+    def _prune(self, now):
+        # A bucket idle long enough to have refilled is the same as no bucket
+        full_after = self.burst / self.rate
+        for key in [k for k, (_, updated) in self._buckets.items() if now - updated >= full_after]:
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class ConcurrencyLimiter:
+    """Semaphore with a bounded wait queue and wait timeout."""
+
+    def __init__(self, limit, max_queue, timeout):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.inflight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Take a slot, waiting in the queue if there is room. Returns False when shed."""
+        with self._cond:
+            if self.inflight < self.limit:
+                self.inflight += 1
+                self.admitted += 1
+                return True
+
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                return False
+
+            deadline = time.monotonic() + self.timeout
+            self.waiting += 1
+            try:
+                while self.inflight >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        return False
+                    self._cond.wait(remaining)
+                self.inflight += 1
+                self.admitted += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.inflight -= 1
+            self._cond.notify()
+
+
+db_limiter = ConcurrencyLimiter(DB_CONCURRENCY, DB_QUEUE_DEPTH, DB_QUEUE_TIMEOUT)
+rate_limiters = {name: RateLimiter(rate, burst) for name, (rate, burst) in RATE_LIMITS.items()}
+
+
+def concurrency_for_pool(concurrency, pool_size):
+    """DB concurrency clamped below the pool size, leaving a connection for unadmitted work."""
+    return max(min(concurrency, pool_size - 1), 1)
+
+
+def configure(config):
+    """Apply the DB limiter settings from a Flask config mapping."""
+    global DB_CONCURRENCY, DB_QUEUE_DEPTH, DB_QUEUE_TIMEOUT, db_limiter
+    DB_CONCURRENCY = concurrency_for_pool(config['DB_CONCURRENCY'], config['DB_POOL_SIZE'])
+    if DB_CONCURRENCY != config['DB_CONCURRENCY']:
+        logger.warning('DB_CONCURRENCY=%s needs DB_POOL_SIZE above it (DB_POOL_SIZE=%s); using %s',
+                       config['DB_CONCURRENCY'], config['DB_POOL_SIZE'], DB_CONCURRENCY)
+    DB_QUEUE_DEPTH = config['DB_QUEUE_DEPTH']
+    DB_QUEUE_TIMEOUT = config['DB_QUEUE_TIMEOUT']
+    db_limiter = ConcurrencyLimiter(DB_CONCURRENCY, DB_QUEUE_DEPTH, DB_QUEUE_TIMEOUT)
+
+
+def acquire_db_slot():
+    if not db_limiter.acquire():
+        raise ServiceUnavailable('The marketplace is busy right now, please try again shortly.',
+                                 retry_after=RETRY_AFTER)
+
+
+def release_db_slot():
+    db_limiter.release()
+
+
+def rate_limited(name):
+    """Limit how often each user may hit the decorated route."""
+    limiter = rate_limiters[name]
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            key = session.get('user_id') or request.remote_addr
+            wait = limiter.take(key)
+            if wait:
+                raise TooManyRequests('Too many requests, please slow down.', retry_after=int(wait) + 1)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def render_metrics():
+    """Limiter state in Prometheus text exposition format."""
+    lines = [
+        '# HELP marketplace_db_inflight Requests currently holding a DB slot.',
+        '# TYPE marketplace_db_inflight gauge',
+        f'marketplace_db_inflight {db_limiter.inflight}',
+        '# HELP marketplace_db_waiting Requests queued for a DB slot.',
+        '# TYPE marketplace_db_waiting gauge',
+        f'marketplace_db_waiting {db_limiter.waiting}',
+        '# HELP marketplace_db_limit Configured DB concurrency and queue depth.',
+        '# TYPE marketplace_db_limit gauge',
+        f'marketplace_db_limit{{kind="concurrency"}} {db_limiter.limit}',
+        f'marketplace_db_limit{{kind="queue"}} {db_limiter.max_queue}',
+        '# HELP marketplace_db_admitted_total Requests admitted to DB work.',
+        '# TYPE marketplace_db_admitted_total counter',
+        f'marketplace_db_admitted_total {db_limiter.admitted}',
+        '# HELP marketplace_db_rejected_total Requests shed with 503.',
+        '# TYPE marketplace_db_rejected_total counter',
+        f'marketplace_db_rejected_total {db_limiter.rejected}',
+        '# HELP marketplace_rate_limited_total Requests rejected with 429, by route.',
+        '# TYPE marketplace_rate_limited_total counter',
+    ]
+    for name, limiter in rate_limiters.items():
+        lines.append(f'marketplace_rate_limited_total{{route="{name}"}} {limiter.rejected}')
+    lines += [
+        '# HELP marketplace_rate_limit_buckets Users currently tracked, by route.',
+        '# TYPE marketplace_rate_limit_buckets gauge',
+    ]
+    for name, limiter in rate_limiters.items():
+        lines.append(f'marketplace_rate_limit_buckets{{route="{name}"}} {len(limiter)}')
+    return '\n'.join(lines) + '\n'
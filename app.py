@@ -1,24 +1,78 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, Blueprint, Response, current_app, g, render_template, request, redirect, url_for, session, flash, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 import mysql.connector
 from datetime import datetime
 import json
+import logging
+import os
+from jinja2 import FileSystemBytecodeCache
+import db as database
+from db import get_db as connect_db
+from config import Config
+from archive import union_archive
+from product_import import import_products
+import order_events
+import dao
+import autocomplete
+import geo
+import shards
+import admission
+from admission import rate_limited
+from streaming import stream_page, compress_response
 
-app = Flask(__name__)
-app.secret_key = 'your-secret-key-here'
-
-# Database configuration
-DB_CONFIG = {
-    'host': '127.0.0.1',
-    'port': 3306,
-    'user': 'root',
-    'password': 'nisht',
-    'database': 'marketplacedb2'
-}
+bp = Blueprint('main', __name__)
+logger = logging.getLogger(__name__)
 
 def get_db():
-    return mysql.connector.connect(**DB_CONFIG)
+    """Connection for the current request, admitted through the global DB limit.
+
+    Views close it when done with it; teardown closes it if an early return
+    or an exception didn't, so pooled connections always go back.
+    """
+    if not g.get('db_admitted'):
+        admission.acquire_db_slot()
+        g.db_admitted = True
+    db = connect_db()
+    g.setdefault('request_dbs', []).append(db)
+    return db
+
+def get_shards(db):
+    """Connections to the other shards next to db, closed on teardown like get_db()'s."""
+    conns = shards.Connections(db)
+    g.setdefault('request_shards', []).append(conns)
+    return conns
+
+def get_stream_db():
+    """Connection that stays open while a streamed page renders, closed on teardown."""
+    return get_db()
+
+def get_stream_shards():
+    """Connections to every shard a streamed page reads from, home being get_stream_db()."""
+    return get_shards(get_stream_db())
+
+@bp.teardown_app_request
+def release_db_slot(exc):
+    # Streamed pages tear down once their body is sent
+    for conns in g.pop('request_shards', ()):
+        conns.close()
+    for db in g.pop('request_dbs', ()):
+        database.close_db(db)
+    if g.pop('db_admitted', False):
+        admission.release_db_slot()
+
+bp.after_app_request(compress_response)
+
+def copy_reference_rows(db, user_id):
+    """Copy a user's changed User/Farmer/Buyer rows to the other shards, which join them."""
+    conns = shards.Connections(db)
+    try:
+        shards.copy_reference_rows(conns, user_id)
+    except mysql.connector.Error:
+        # Home has the change; `python shards.py sync-reference` brings the copies up to date
+        logger.exception('Copying user %s to the other shards failed', user_id)
+    finally:
+        conns.close()
 
 # Decorator for login required
 def login_required(f):
@@ -26,7 +80,7 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             flash('Please login first', 'error')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -35,10 +89,10 @@ def farmer_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         if session.get('role') != 'FARMER':
             flash('Access denied. Farmers only.', 'error')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -47,20 +101,63 @@ def buyer_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         if session.get('role') != 'BUYER':
             flash('Access denied. Buyers only.', 'error')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         return f(*args, **kwargs)
     return decorated_function
 
+def event_stream_response(column, owner_id, followed):
+    """SSE response for one farmer's or buyer's order item changes on the followed shards."""
+    if not order_events.acquire_stream_slot():
+        return Response('Too many live streams, retry shortly', status=503, headers={'Retry-After': '5'})
+    
+    # Resume from the browser's Last-Event-ID, else from the position the page was rendered at
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('after')
+    try:
+        positions = order_events.parse_position(last_id) if last_id else {}
+    except ValueError:
+        # The browser resends a bad Last-Event-ID on every reconnect; start from now instead
+        positions = {}
+    try:
+        missing = [shard for shard in followed if shard not in positions]
+        if missing:
+            db = get_db()
+            conns = get_shards(db)
+            positions.update(order_events.latest_positions([(shard, conns.get(shard)) for shard in missing],
+                                                           column, owner_id))
+            conns.close()
+            db.close()
+        positions = {shard: positions[shard] for shard in followed}
+    except Exception:
+        order_events.release_stream_slot()
+        raise
+    
+    response = Response(order_events.stream_events(column, owner_id, positions), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(order_events.release_stream_slot)
+    return response
+
+@bp.route('/metrics')
+def metrics():
+    return Response(admission.render_metrics() + order_events.render_metrics(),
+                    mimetype='text/plain; version=0.0.4')
+
+@bp.route('/ready')
+def ready():
+    """Readiness probe: green only once templates are compiled and the pool is warm."""
+    if not current_app.extensions.get('marketplace_ready'):
+        return jsonify({'status': 'warming'}), 503
+    return jsonify({'status': 'ready'})
+
 # ==================== AUTH ROUTES ====================
 
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         name = request.form['name']
@@ -73,7 +170,7 @@ def register():
         # Validate role
         if role not in ['FARMER', 'BUYER']:
             flash('Invalid role selected', 'error')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
         
         hashed_password = generate_password_hash(password)
         
@@ -92,23 +189,25 @@ def register():
             # Create corresponding Farmer or Buyer record
             if role == 'FARMER':
                 cursor.execute("INSERT INTO Farmer (userId) VALUES (%s)", (user_id,))
+                shards.assign_farmer(cursor, cursor.lastrowid)
             else:
                 cursor.execute("INSERT INTO Buyer (userId) VALUES (%s)", (user_id,))
             
             db.commit()
+            copy_reference_rows(db, user_id)
             flash('Registration successful! Please login.', 'success')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
             
         except mysql.connector.IntegrityError:
             flash('Email already exists', 'error')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
         finally:
             cursor.close()
             db.close()
     
     return render_template('register.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form['email']
@@ -131,27 +230,31 @@ def login():
             flash(f'Welcome {user["name"]}!', 'success')
             
             if user['role'] == 'FARMER':
-                return redirect(url_for('farmer_dashboard'))
+                return redirect(url_for('main.farmer_dashboard'))
             else:
-                return redirect(url_for('buyer_dashboard'))
+                return redirect(url_for('main.buyer_dashboard'))
         else:
             flash('Invalid email or password', 'error')
     
     return render_template('login.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.clear()
     flash('Logged out successfully', 'success')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 # ==================== FARMER ROUTES ====================
 
-@app.route('/farmer/dashboard')
+@bp.route('/farmer/dashboard')
 @farmer_required
 def farmer_dashboard():
     db = get_db()
-    cursor = db.cursor(dictionary=True)
+    conns = get_shards(db)
+    
+    # Everything below is read from the farmer's shard, which also counts their sales
+    farmer_db = conns.for_farmer(dao.farmer_id(db, session['user_id']))
+    cursor = farmer_db.cursor(dictionary=True)
     
     # Get farmer info
     cursor.execute("""
@@ -170,28 +273,30 @@ def farmer_dashboard():
     """, (farmer['id'],))
     products = cursor.fetchall()
     
-    # Get farmer's payouts and lifetime earnings
-    cursor.execute("""
-        SELECT * FROM Payout 
-        WHERE farmerId = (SELECT id FROM Farmer WHERE userId = %s)
-        ORDER BY createdAt DESC
-    """, (session['user_id'],))
+    # Get farmer's payouts and lifetime earnings (including archived history)
+    payout_query = """
+        SELECT id, farmerId, orderItemId, amount, status, createdAt
+        FROM {Payout}
+        WHERE farmerId = %s
+    """
+    cursor.execute(union_archive(payout_query, "ORDER BY createdAt DESC"),
+                   (farmer['id'], farmer['id']))
     payouts = cursor.fetchall()
     
     cursor.execute("""
         SELECT COALESCE(SUM(amount), 0) as lifetime_earnings
-        FROM Payout 
-        WHERE farmerId = (SELECT id FROM Farmer WHERE userId = %s)
-    """, (session['user_id'],))
+        FROM (""" + union_archive(payout_query) + """) payouts
+    """, (farmer['id'], farmer['id']))
     earnings_result = cursor.fetchone()
     lifetime_earnings = earnings_result['lifetime_earnings'] if earnings_result else 0
     
     cursor.close()
+    conns.close()
     db.close()
     
     return render_template('farmer_dashboard.html', farmer=farmer, products=products, payouts=payouts, lifetime_earnings=lifetime_earnings)
 
-@app.route('/farmer/products/add', methods=['GET', 'POST'])
+@bp.route('/farmer/products/add', methods=['GET', 'POST'])
 @farmer_required
 def add_product():
     if request.method == 'POST':
@@ -207,25 +312,96 @@ def add_product():
         cursor.execute("SELECT id FROM Farmer WHERE userId = %s", (session['user_id'],))
         farmer = cursor.fetchone()
         
+        cursor.close()
+        
         if not farmer:
+            db.close()
             flash('Farmer profile not found', 'error')
-            return redirect(url_for('farmer_dashboard'))
+            return redirect(url_for('main.farmer_dashboard'))
+        
+        # Products are stored on their farmer's shard
+        conns = get_shards(db)
+        farmer_db = conns.for_farmer(farmer['id'])
+        cursor = farmer_db.cursor()
         
         cursor.execute("""
             INSERT INTO Product (farmerId, name, description, price, stockQuantity)
             VALUES (%s, %s, %s, %s, %s)
         """, (farmer['id'], name, description, price, stock))
+        product_id = cursor.lastrowid
         
-        db.commit()
+        farmer_db.commit()
         cursor.close()
+        conns.close()
         db.close()
         
+        autocomplete.index.update_product(product_id, name, farmer['id'], available=stock > 0)
+        
         flash('Product added successfully!', 'success')
-        return redirect(url_for('farmer_dashboard'))
+        return redirect(url_for('main.farmer_dashboard'))
     
     return render_template('add_product.html')
 
-@app.route('/farmer/products/<int:product_id>/edit', methods=['GET', 'POST'])
+@bp.route('/farmer/products/import', methods=['GET', 'POST'])
+@farmer_required
+def import_products_csv():
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        
+        if not upload or not upload.filename:
+            flash('Please choose a CSV file to upload', 'error')
+            return redirect(url_for('main.import_products_csv'))
+        
+        db = get_db()
+        cursor = db.cursor(dictionary=True)
+        
+        # Get the Farmer.id from User.id
+        cursor.execute("SELECT id FROM Farmer WHERE userId = %s", (session['user_id'],))
+        farmer = cursor.fetchone()
+        cursor.close()
+        
+        if not farmer:
+            db.close()
+            flash('Farmer profile not found', 'error')
+            return redirect(url_for('main.farmer_dashboard'))
+        
+        conns = get_shards(db)
+        try:
+            farmer_db = conns.for_farmer(farmer['id'])
+            result = import_products(farmer_db, farmer['id'], upload.stream)
+        except ValueError as e:
+            conns.close()
+            db.close()
+            flash(str(e), 'error')
+            return redirect(url_for('main.import_products_csv'))
+        except Exception as e:
+            conns.close()
+            db.close()
+            flash(f'Error importing products: {str(e)}', 'error')
+            return redirect(url_for('main.import_products_csv'))
+        
+        # The import is committed; a stale index only delays type-ahead until the next rebuild
+        try:
+            autocomplete.index.reload_farmer(farmer_db, farmer['id'])
+        except Exception:
+            logger.exception('Reloading farmer %s into the autocomplete index failed', farmer['id'])
+        finally:
+            conns.close()
+            db.close()
+        
+        if result['inserted'] or result['updated']:
+            flash(f'Imported {result["inserted"]} new and updated {result["updated"]} existing products', 'success')
+        if result['errors']:
+            flash(f'{len(result["errors"])} rows were skipped', 'warning')
+        if result['stopped']:
+            flash(f'Import stopped at line {result["stopped"]["line"]}: {result["stopped"]["error"]}. '
+                  f'Nothing from that line on was saved.', 'error')
+        
+        return render_template('import_products.html', result=result)
+    
+    return render_template('import_products.html', result=None)
+
+@bp.route('/farmer/products/<int:product_id>/edit', methods=['GET', 'POST'])
 @farmer_required
 def edit_product(product_id):
     db = get_db()
@@ -235,18 +411,27 @@ def edit_product(product_id):
     cursor.execute("SELECT id FROM Farmer WHERE userId = %s", (session['user_id'],))
     farmer = cursor.fetchone()
     
+    cursor.close()
+    
     if not farmer:
+        db.close()
         flash('Farmer profile not found', 'error')
-        return redirect(url_for('farmer_dashboard'))
+        return redirect(url_for('main.farmer_dashboard'))
     
-    # Verify ownership
+    # Verify ownership; the farmer's products are all on their shard
+    conns = get_shards(db)
+    farmer_db = conns.for_farmer(farmer['id'])
+    cursor = farmer_db.cursor(dictionary=True)
     cursor.execute("SELECT * FROM Product WHERE id = %s AND farmerId = %s", 
                    (product_id, farmer['id']))
     product = cursor.fetchone()
     
     if not product:
+        cursor.close()
+        conns.close()
+        db.close()
         flash('Product not found', 'error')
-        return redirect(url_for('farmer_dashboard'))
+        return redirect(url_for('main.farmer_dashboard'))
     
     if request.method == 'POST':
         name = request.form['name']
@@ -261,74 +446,121 @@ def edit_product(product_id):
             WHERE id=%s
         """, (name, description, price, stock, available, product_id))
         
-        db.commit()
+        farmer_db.commit()
         cursor.close()
+        conns.close()
         db.close()
         
+        autocomplete.index.update_product(product_id, name, farmer['id'], product['averageRating'],
+                                          available and stock > 0)
+        
         flash('Product updated successfully!', 'success')
-        return redirect(url_for('farmer_dashboard'))
+        return redirect(url_for('main.farmer_dashboard'))
     
     cursor.close()
+    conns.close()
     db.close()
     
     return render_template('edit_product.html', product=product)
 
-@app.route('/farmer/orders')
+@bp.route('/farmer/location', methods=['GET', 'POST'])
 @farmer_required
-def farmer_orders():
+def farm_location():
     db = get_db()
     cursor = db.cursor(dictionary=True)
     
-    # Get the Farmer.id from User.id
-    cursor.execute("SELECT id FROM Farmer WHERE userId = %s", (session['user_id'],))
+    cursor.execute("""
+        SELECT id, farmName, latitude, longitude FROM Farmer WHERE userId = %s
+    """, (session['user_id'],))
     farmer = cursor.fetchone()
     
     if not farmer:
+        cursor.close()
+        db.close()
         flash('Farmer profile not found', 'error')
-        return redirect(url_for('farmer_dashboard'))
+        return redirect(url_for('main.farmer_dashboard'))
     
-    # Get all order items for this farmer's products with delivery details
-    cursor.execute("""
-        SELECT 
-            oi.id as order_item_id,
-            oi.orderId,
-            oi.quantity,
-            oi.price,
-            oi.deliveryStatus,
-            oi.deliveredAt,
-            p.id as product_id,
-            p.name as product_name,
-            o.createdAt as order_date,
-            o.deliveryAddress,
-            o.totalAmount as order_total,
-            u.name as buyer_name,
-            u.email as buyer_email,
-            u.phone as buyer_phone
-        FROM OrderItem oi
-        JOIN Product p ON oi.productId = p.id
-        JOIN `Order` o ON oi.orderId = o.id
-        JOIN User u ON o.userId = u.id
-        WHERE p.farmerId = %s
-        ORDER BY o.createdAt DESC, oi.id ASC
-    """, (farmer['id'],))
+    if request.method == 'POST':
+        try:
+            location = geo.parse_location(request.form)
+        except ValueError as e:
+            cursor.close()
+            db.close()
+            flash(str(e), 'error')
+            return redirect(url_for('main.farm_location'))
+        
+        geo.set_farm_location(cursor, farmer['id'], location)
+        db.commit()
+        cursor.close()
+        copy_reference_rows(db, session['user_id'])
+        db.close()
+        
+        flash('Farm location saved. Buyers nearby can now find you.', 'success')
+        return redirect(url_for('main.farmer_dashboard'))
+    
+    cursor.close()
+    db.close()
+    
+    return render_template('farm_location.html', farmer=farmer)
+
+@bp.route('/farmer/orders')
+@farmer_required
+def farmer_orders():
+    conns = get_stream_shards()
+    
+    # Get the Farmer.id from User.id
+    farmer_id = dao.farmer_id(conns.home, session['user_id'])
+    
+    if not farmer_id:
+        flash('Farmer profile not found', 'error')
+        return redirect(url_for('main.farmer_dashboard'))
+    
+    # The farmer's orders are all on their shard
+    shard = shards.shard_for_farmer(conns.home, farmer_id)
+    farmer_db = conns.get(shard)
+    last_event_id = order_events.format_position(
+        order_events.latest_positions([(shard, farmer_db)], 'farmerId', farmer_id))
+    
+    # Get all order items for this farmer's products with delivery details,
+    # fetched while the page streams
+    order_items = dao.farmer_order_items(farmer_db, farmer_id)
+    
+    return stream_page('farmer_orders.html', order_items=order_items, last_event_id=last_event_id)
+
+@bp.route('/farmer/orders/stream')
+@farmer_required
+def farmer_orders_stream():
+    db = get_db()
+    cursor = db.cursor(dictionary=True)
     
-    order_items = cursor.fetchall()
+    # Get the Farmer.id from User.id
+    cursor.execute("SELECT id FROM Farmer WHERE userId = %s", (session['user_id'],))
+    farmer = cursor.fetchone()
     
     cursor.close()
+    
+    if not farmer:
+        db.close()
+        return Response('Farmer profile not found', status=404)
+    
+    shard = shards.shard_for_farmer(db, farmer['id'])
     db.close()
     
-    return render_template('farmer_orders.html', order_items=order_items)
+    return event_stream_response('farmerId', farmer['id'], [shard])
 
-@app.route('/farmer/orders/mark-delivered/<int:order_item_id>', methods=['POST'])
+@bp.route('/farmer/orders/mark-delivered/<int:order_item_id>', methods=['POST'])
 @farmer_required
 def mark_as_delivered(order_item_id):
     db = get_db()
-    cursor = db.cursor(dictionary=True)
+    conns = get_shards(db)
+    # Order items live on their farmer's shard, and the id says which one
+    shard_db = conns.for_id(order_item_id)
+    cursor = shard_db.cursor(dictionary=True)
     
     try:
         # Verify this order item belongs to farmer's product
         cursor.execute("""
-            SELECT oi.*, p.farmerId, o.checkoutId
+            SELECT oi.*, p.farmerId, o.checkoutId, o.userId as buyerId
             FROM OrderItem oi
             JOIN Product p ON oi.productId = p.id
             JOIN `Order` o ON oi.orderId = o.id
@@ -339,19 +571,18 @@ def mark_as_delivered(order_item_id):
         
         if not order_item:
             flash('Order item not found', 'error')
-            return redirect(url_for('farmer_orders'))
+            return redirect(url_for('main.farmer_orders'))
         
         # Get the Farmer.id from User.id
-        cursor.execute("SELECT id FROM Farmer WHERE userId = %s", (session['user_id'],))
-        farmer = cursor.fetchone()
+        farmer_id = dao.farmer_id(db, session['user_id'])
         
-        if not farmer or order_item['farmerId'] != farmer['id']:
+        if not farmer_id or order_item['farmerId'] != farmer_id:
             flash('Unauthorized', 'error')
-            return redirect(url_for('farmer_orders'))
+            return redirect(url_for('main.farmer_orders'))
         
         if order_item['deliveryStatus'] == 'delivered':
             flash('Item already marked as delivered', 'info')
-            return redirect(url_for('farmer_orders'))
+            return redirect(url_for('main.farmer_orders'))
         
         # Mark item as delivered
         cursor.execute("""
@@ -360,80 +591,115 @@ def mark_as_delivered(order_item_id):
                 deliveredAt = NOW()
             WHERE id = %s
         """, (order_item_id,))
+        
+        order_events.record_event(cursor, order_item_id, order_item['farmerId'], order_item['buyerId'], 'delivered')
 
-        db.commit()
+        shard_db.commit()
         flash('Item marked as delivered. Payout processed automatically.', 'success')
         
     except Exception as e:
-        db.rollback()
+        shard_db.rollback()
         flash(f'Error marking item as delivered: {str(e)}', 'error')
     finally:
         cursor.close()
+        conns.close()
         db.close()
     
-    return redirect(url_for('farmer_orders'))
+    return redirect(url_for('main.farmer_orders'))
 
 # ==================== BUYER ROUTES ====================
 
-@app.route('/buyer/dashboard')
+@bp.route('/buyer/dashboard')
 @buyer_required
+@rate_limited('catalog')
 def buyer_dashboard():
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
+    conns = get_stream_shards()
+    
+    radius = request.args.get('radius', type=float)
+    nearest = request.args.get('nearest', type=int)
+    location = geo.buyer_location(conns.home, session['user_id'])
+    
+    # Get available products from every shard, nearest farms first when asked for,
+    # fetched while the page streams
+    if location and radius and radius > 0:
+        products = geo.products_within(conns, location.latitude, location.longitude, radius)
+    elif location and nearest and nearest > 0:
+        products = geo.products_near(conns, location.latitude, location.longitude, min(nearest, geo.MAX_FARMS))
+    else:
+        products = dao.available_products(conns)
     
-    # Get all available products
-    cursor.execute("""
-        SELECT p.*, u.name as farmer_name, f.rating as farmer_rating
-        FROM Product p
-        JOIN Farmer f ON p.farmerId = f.id
-        JOIN User u ON f.userId = u.id
-        WHERE p.isAvailable = TRUE AND p.stockQuantity > 0
-        ORDER BY p.createdAt DESC
-    """)
-    products = cursor.fetchall()
+    return stream_page('buyer_dashboard.html', products=products, location=location,
+                       radius=radius, radius_options=geo.RADIUS_OPTIONS_KM, nearest_count=geo.NEAREST_FARMS)
+
+@bp.route('/buyer/location', methods=['POST'])
+@buyer_required
+def set_buyer_location():
+    try:
+        location = geo.parse_location(request.form)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('main.buyer_dashboard'))
     
+    db = get_db()
+    cursor = db.cursor()
+    geo.set_buyer_location(cursor, session['user_id'], location)
+    db.commit()
     cursor.close()
+    copy_reference_rows(db, session['user_id'])
     db.close()
     
-    return render_template('buyer_dashboard.html', products=products)
+    flash('Location saved. Delivery fees are now priced by distance.', 'success')
+    return redirect(url_for('main.buyer_dashboard'))
+
+@bp.route('/api/suggest')
+@login_required
+def suggest():
+    """Type-ahead suggestions for product and farm names, served from memory."""
+    query = request.args.get('q', '')
+    suggestions = []
+    for entry in autocomplete.suggest(query):
+        suggestion = {'type': entry.kind, 'id': entry.id, 'text': entry.text}
+        if entry.kind == 'product':
+            suggestion['url'] = url_for('main.product_reviews', product_id=entry.id)
+        suggestions.append(suggestion)
+    return jsonify({'query': query, 'suggestions': suggestions})
 
-@app.route('/buyer/cart')
+@bp.route('/buyer/cart')
 @buyer_required
 def view_cart():
     db = get_db()
-    cursor = db.cursor(dictionary=True)
-    
-    cursor.execute("""
-        SELECT c.*, p.name, p.price, p.stockQuantity, u.name as farmer_name
-        FROM Cart c
-        JOIN Product p ON c.productId = p.id
-        JOIN User u ON p.farmerId = u.id
-        WHERE c.userId = %s
-    """, (session['user_id'],))
+    conns = get_shards(db)
     
-    cart_items = cursor.fetchall()
-    total = sum(item['price'] * item['quantity'] for item in cart_items)
+    # Cart lines are kept on their product's shard
+    cart_items = dao.cart_items(conns, session['user_id'])
+    total = sum(item.price * item.quantity for item in cart_items)
     
-    cursor.close()
+    conns.close()
     db.close()
     
     return render_template('cart.html', cart_items=cart_items, total=total)
 
-@app.route('/buyer/cart/add/<int:product_id>', methods=['POST'])
+@bp.route('/buyer/cart/add/<int:product_id>', methods=['POST'])
 @buyer_required
 def add_to_cart(product_id):
     quantity = int(request.form.get('quantity', 1))
     
     db = get_db()
-    cursor = db.cursor(dictionary=True)
+    conns = get_shards(db)
+    # The cart line goes on the product's shard, next to the product
+    shard_db = conns.for_id(product_id)
+    cursor = shard_db.cursor(dictionary=True)
     
     # Check if product exists and is available
     cursor.execute("SELECT * FROM Product WHERE id = %s", (product_id,))
     product = cursor.fetchone()
     
     if not product or not product['isAvailable'] or product['stockQuantity'] < quantity:
+        cursor.close()
+        conns.close()
+        db.close()
         flash('Product not available', 'error')
-        return redirect(url_for('buyer_dashboard'))
+        return redirect(url_for('main.buyer_dashboard'))
     
     # Check if already in cart
     cursor.execute("SELECT * FROM Cart WHERE userId = %s AND productId = %s", 
@@ -451,50 +717,49 @@ def add_to_cart(product_id):
             VALUES (%s, %s, %s)
         """, (session['user_id'], product_id, quantity))
     
-    db.commit()
+    shard_db.commit()
     cursor.close()
+    conns.close()
     db.close()
     
     flash('Added to cart!', 'success')
-    return redirect(url_for('buyer_dashboard'))
+    return redirect(url_for('main.buyer_dashboard'))
 
-@app.route('/buyer/cart/remove/<int:cart_id>', methods=['POST'])
+@bp.route('/buyer/cart/remove/<int:cart_id>', methods=['POST'])
 @buyer_required
 def remove_from_cart(cart_id):
     db = get_db()
-    cursor = db.cursor()
+    conns = get_shards(db)
+    shard_db = conns.for_id(cart_id)
+    cursor = shard_db.cursor()
     
     cursor.execute("DELETE FROM Cart WHERE id = %s AND userId = %s", 
                    (cart_id, session['user_id']))
     
-    db.commit()
+    shard_db.commit()
     cursor.close()
+    conns.close()
     db.close()
     
     flash('Removed from cart', 'success')
-    return redirect(url_for('view_cart'))
+    return redirect(url_for('main.view_cart'))
 
-@app.route('/buyer/checkout', methods=['GET', 'POST'])
+@bp.route('/buyer/checkout', methods=['GET', 'POST'])
 @buyer_required
+@rate_limited('checkout')
 def checkout():
     # Show checkout page with cart summary on GET
     if request.method == 'GET':
         db = get_db()
-        cursor = db.cursor(dictionary=True)
+        conns = get_shards(db)
 
-        cursor.execute("""
-            SELECT c.*, p.name as product_name, p.price, p.stockQuantity
-            FROM Cart c
-            JOIN Product p ON c.productId = p.id
-            WHERE c.userId = %s
-        """, (session['user_id'],))
-        cart_items = cursor.fetchall()
+        cart_items = dao.checkout_items(conns, session['user_id'])
 
-        total = sum(item['price'] * item['quantity'] for item in cart_items) if cart_items else 0.0
-        delivery_fee = float(total) / 10.0 if total else 0.0
+        total = sum(item.price * item.quantity for item in cart_items) if cart_items else 0.0
+        delivery_fee = geo.delivery_fee(db, session['user_id'], [item.farmerId for item in cart_items], total)
         grand_total = total + delivery_fee
 
-        cursor.close()
+        conns.close()
         db.close()
 
         return render_template('checkout.html', cart_items=cart_items, total=total, delivery_fee=delivery_fee, grand_total=grand_total)
@@ -502,31 +767,26 @@ def checkout():
     # Create checkout and redirect to payment on POST
     if request.method == 'POST':
         db = get_db()
+        conns = get_shards(db)
         cursor = db.cursor(dictionary=True)
 
         try:
             # Get cart items
-            cursor.execute("""
-                SELECT c.*, p.price, p.stockQuantity, p.name as product_name
-                FROM Cart c
-                JOIN Product p ON c.productId = p.id
-                WHERE c.userId = %s
-            """, (session['user_id'],))
-            cart_items = cursor.fetchall()
+            cart_items = dao.checkout_items(conns, session['user_id'])
 
             if not cart_items:
                 flash('Cart is empty', 'error')
-                return redirect(url_for('view_cart'))
+                return redirect(url_for('main.view_cart'))
 
             # Validate stock
             for item in cart_items:
-                if item['stockQuantity'] < item['quantity']:
-                    flash(f'Insufficient stock for {item["product_name"]}', 'error')
-                    return redirect(url_for('view_cart'))
+                if item.stockQuantity < item.quantity:
+                    flash(f'Insufficient stock for {item.product_name}', 'error')
+                    return redirect(url_for('main.view_cart'))
 
             # Calculate total
-            total = sum(item['price'] * item['quantity'] for item in cart_items)
-            delivery_fee = float(total) / 10.0
+            total = sum(item.price * item.quantity for item in cart_items)
+            delivery_fee = geo.delivery_fee(db, session['user_id'], [item.farmerId for item in cart_items], total)
             grand_total = total + delivery_fee
 
             # Create checkout record
@@ -545,30 +805,29 @@ def checkout():
             }
 
             db.commit()
-            cursor.close()
-            db.close()
 
             # Redirect to payment page
-            return redirect(url_for('payment_page'))
+            return redirect(url_for('main.payment_page'))
 
         except Exception as e:
             db.rollback()
             flash(f'Error processing checkout: {str(e)}', 'error')
-            return redirect(url_for('view_cart'))
+            return redirect(url_for('main.view_cart'))
         finally:
             cursor.close()
+            conns.close()
             db.close()
 
     # Fallback
-    return redirect(url_for('view_cart'))
+    return redirect(url_for('main.view_cart'))
 
-@app.route('/buyer/payment')
+@bp.route('/buyer/payment')
 @buyer_required
 def payment_page():
     # Check if there's a pending checkout
     if 'pending_checkout' not in session:
         flash('No pending checkout found', 'error')
-        return redirect(url_for('view_cart'))
+        return redirect(url_for('main.view_cart'))
     
     checkout_info = session['pending_checkout']
     
@@ -578,36 +837,64 @@ def payment_page():
                          delivery_fee=checkout_info['delivery_fee'],
                          total_amount=checkout_info['total_amount'])
 
-@app.route('/buyer/payment/process', methods=['POST'])
+def write_order(cursor, user_id, amount, delivery_address, checkout_id, items):
+    """Create the order for cart items stored on the shard cursor writes to, and
+    clear them from the cart. Returns the order id."""
+    # Create order with delivery address
+    cursor.execute("""
+        INSERT INTO `Order` (userId, totalAmount, deliveryAddress, checkoutId, status)
+        VALUES (%s, %s, %s, %s, %s)
+    """, (user_id, amount, delivery_address, checkout_id, 'completed'))
+    order_id = cursor.lastrowid
+    
+    # Create order items
+    for item in items:
+        if item.stockQuantity < item.quantity:
+            raise Exception(f'Insufficient stock for product ID {item.productId}')
+        
+        # Insert order item with delivery status
+        cursor.execute("""
+            INSERT INTO OrderItem (orderId, productId, quantity, price, deliveryStatus)
+            VALUES (%s, %s, %s, %s, 'pending')
+        """, (order_id, item.productId, item.quantity, item.price))
+        
+        order_events.record_event(cursor, cursor.lastrowid, item.farmerId, user_id, 'created')
+    
+    # Clear cart
+    cursor.execute("DELETE FROM Cart WHERE userId = %s", (user_id,))
+    return order_id
+
+@bp.route('/buyer/payment/process', methods=['POST'])
 @buyer_required
+@rate_limited('process_payment')
 def process_payment():
     import random
     import string
     
     if 'pending_checkout' not in session:
         flash('No pending checkout found', 'error')
-        return redirect(url_for('view_cart'))
+        return redirect(url_for('main.view_cart'))
     
     checkout_info = session['pending_checkout']
     checkout_id = checkout_info['checkout_id']
     payment_method = request.form.get('payment_method')
     
     db = get_db()
+    conns = get_shards(db)
     cursor = db.cursor(dictionary=True)
+    branches = []
+    committing = False
     
     try:
         # Get cart items
-        cursor.execute("""
-            SELECT c.*, p.price, p.stockQuantity, p.farmerId
-            FROM Cart c
-            JOIN Product p ON c.productId = p.id
-            WHERE c.userId = %s
-        """, (session['user_id'],))
-        cart_items = cursor.fetchall()
+        cart_items = dao.checkout_items(conns, session['user_id'])
         
         if not cart_items:
+            cursor.close()
+            conns.close()
+            db.close()
             flash('Cart is empty', 'error')
-            return redirect(url_for('view_cart'))
+            return redirect(url_for('main.view_cart'))
         
         # Get user's delivery address
         cursor.execute("""
@@ -619,23 +906,43 @@ def process_payment():
         # Generate fake transaction ID (simulating payment gateway)
         transaction_id = 'TXN' + ''.join(random.choices(string.ascii_uppercase + string.digits, k=12))
         
-        # Create order with delivery address
-        cursor.execute("""
-            INSERT INTO `Order` (userId, totalAmount, deliveryAddress, checkoutId, status)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (session['user_id'], checkout_info['total_amount'], delivery_address, checkout_id, 'completed'))
-        order_id = cursor.lastrowid
-        
-        # Create order items
-        for item in cart_items:
-            if item['stockQuantity'] < item['quantity']:
-                raise Exception(f'Insufficient stock for product ID {item["productId"]}')
+        # One order per shard holding ordered products. Orders on other shards
+        # are XA branches, prepared here and committed once the payment commits
+        # on home, so the payment and every order are kept or none are.
+        parts = shards.group_by_shard(cart_items, lambda item: item.productId)
+        subtotal = sum(item.price * item.quantity for item in cart_items)
+        remaining = checkout_info['total_amount']
+        order_ids = []
+        for number, (shard, items) in enumerate(parts.items(), 1):
+            # Each order carries its share of the grand total, delivery fee included
+            if number == len(parts):
+                amount = remaining
+            else:
+                share = sum(item.price * item.quantity for item in items) / subtotal if subtotal else 0
+                amount = round(checkout_info['total_amount'] * share, 2)
+                remaining -= amount
             
-            # Insert order item with delivery status
-            cursor.execute("""
-                INSERT INTO OrderItem (orderId, productId, quantity, price, deliveryStatus)
-                VALUES (%s, %s, %s, %s, 'pending')
-            """, (order_id, item['productId'], item['quantity'], item['price']))
+            if shard == shards.HOME_SHARD:
+                order_ids.append(write_order(cursor, session['user_id'], amount, delivery_address,
+                                             checkout_id, items))
+                continue
+            
+            branch = shards.Branch(conns.get(shard), shards.checkout_xid(checkout_id))
+            branches.append(branch)
+            branch.start()
+            order_id = write_order(branch.cursor, session['user_id'], amount, delivery_address,
+                                   checkout_id, items)
+            order_ids.append(order_id)
+            
+            # On home the Payment trigger creates payouts, but it can only see home's orders
+            branch.cursor.execute("""
+                INSERT INTO Payout (farmerId, amount, status, orderItemId)
+                SELECT p.farmerId, oi.quantity * oi.price, 'pending', oi.id
+                FROM OrderItem oi
+                JOIN Product p ON p.id = oi.productId
+                WHERE oi.orderId = %s
+            """, (order_id,))
+            branch.prepare()
         
         # Insert payment record (simulating successful payment)
         cursor.execute("""
@@ -655,40 +962,63 @@ def process_payment():
         
         # (payout creation removed)
         
-        # Clear cart
-        cursor.execute("DELETE FROM Cart WHERE userId = %s", (session['user_id'],))
-        
+        committing = True
         db.commit()
         
-        # Store payment details for success page
-        session['payment_success'] = {
-            'order_id': order_id,
-            'transaction_id': transaction_id,
-            'payment_method': payment_method,
-            'amount': checkout_info['total_amount']
-        }
-        
-        # Clear pending checkout
-        session.pop('pending_checkout', None)
-        
-        cursor.close()
-        db.close()
-        
-        return redirect(url_for('payment_success'))
-        
     except Exception as e:
+        for branch in branches:
+            # A failed commit may still have recorded the payment; recover() then
+            # commits the branches from what home holds, so they must outlive this request
+            if committing:
+                branch.leave_prepared()
+            else:
+                branch.rollback()
+            branch.close()
+        if committing:
+            logger.exception('Commit of payment for checkout %s failed', checkout_id)
+            try:
+                db.rollback()
+            except mysql.connector.Error:
+                # The session went with the commit; hand the pool a fresh one
+                db.reconnect()
+            cursor.close()
+            flash('Your payment could not be confirmed. Please check your orders before paying again.', 'error')
+            return redirect(url_for('main.buyer_orders'))
         db.rollback()
         cursor.close()
+        conns.close()
         db.close()
         flash(f'Payment failed: {str(e)}', 'error')
-        return redirect(url_for('payment_page'))
+        return redirect(url_for('main.payment_page'))
+    
+    # The payment is committed; a branch failing to commit now is finished by `shards.py recover`
+    for branch in branches:
+        branch.commit()
+        branch.close()
+    
+    # Store payment details for success page
+    session['payment_success'] = {
+        'order_id': order_ids[0],
+        'transaction_id': transaction_id,
+        'payment_method': payment_method,
+        'amount': checkout_info['total_amount']
+    }
+    
+    # Clear pending checkout
+    session.pop('pending_checkout', None)
+    
+    cursor.close()
+    conns.close()
+    db.close()
+    
+    return redirect(url_for('main.payment_success'))
 
-@app.route('/buyer/payment/success')
+@bp.route('/buyer/payment/success')
 @buyer_required
 def payment_success():
     if 'payment_success' not in session:
         flash('No payment information found', 'error')
-        return redirect(url_for('buyer_dashboard'))
+        return redirect(url_for('main.buyer_dashboard'))
     
     payment_info = session['payment_success']
     
@@ -701,60 +1031,50 @@ def payment_success():
                          payment_method=payment_info['payment_method'],
                          amount=payment_info['amount'])
 
-@app.route('/buyer/orders')
+def group_orders(order_items):
+    """Group consecutive order item rows into orders for display."""
+    order = None
+    for item in order_items:
+        if order is None or order['id'] != item.order_id:
+            if order is not None:
+                yield order
+            order = {
+                'id': item.order_id,
+                'order_date': item.order_date,
+                'totalAmount': item.totalAmount,
+                'deliveryAddress': item.deliveryAddress,
+                'order_items': []
+            }
+        order['order_items'].append(item)
+    if order is not None:
+        yield order
+
+@bp.route('/buyer/orders')
 @buyer_required
 def buyer_orders():
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
+    conns = get_stream_shards()
     
-    # Get orders with item-level delivery status
-    cursor.execute("""
-        SELECT 
-            o.id as order_id,
-            o.createdAt as order_date,
-            o.totalAmount,
-            o.deliveryAddress,
-            oi.id as order_item_id,
-            oi.quantity,
-            oi.price,
-            oi.deliveryStatus,
-            oi.deliveredAt,
-            p.id as product_id,
-            p.name as product_name,
-            u.name as farmer_name
-        FROM `Order` o
-        JOIN OrderItem oi ON o.id = oi.orderId
-        JOIN Product p ON oi.productId = p.id
-        JOIN User u ON p.farmerId = u.id
-        WHERE o.userId = %s
-        ORDER BY o.createdAt DESC, oi.id ASC
-    """, (session['user_id'],))
+    last_event_id = order_events.format_position(
+        order_events.latest_positions(conns.each(), 'buyerId', session['user_id']))
     
-    order_items = cursor.fetchall()
-    
-    # Group items by order for display
-    orders = {}
-    for item in order_items:
-        order_id = item['order_id']
-        if order_id not in orders:
-            orders[order_id] = {
-                'id': order_id,
-                'order_date': item['order_date'],
-                'totalAmount': item['totalAmount'],
-                'deliveryAddress': item['deliveryAddress'],
-                'order_items': []  # Changed from 'items' to 'order_items'
-            }
-        orders[order_id]['order_items'].append(item)  # Changed from 'items' to 'order_items'
-    
-    cursor.close()
-    db.close()
+    # Get orders with item-level delivery status from every shard, fetched while the page streams
+    order_items = dao.buyer_order_items(conns, session['user_id'])
     
-    return render_template('buyer_orders.html', orders=list(orders.values()))
+    return stream_page('buyer_orders.html', orders=group_orders(order_items), last_event_id=last_event_id)
+
+@bp.route('/buyer/orders/stream')
+@buyer_required
+def buyer_orders_stream():
+    return event_stream_response('buyerId', session['user_id'], shards.all_shards())
 
-@app.route('/buyer/review/<int:product_id>', methods=['POST'])
+@bp.route('/buyer/review/<int:product_id>', methods=['POST'])
 @buyer_required
+@rate_limited('add_review')
 def add_review(product_id):
-    db = get_db()
+    home_db = get_db()
+    conns = get_shards(home_db)
+    # Reviews are kept on the product's shard, with the orders that verify them
+    db = conns.for_id(product_id)
     cursor = db.cursor(dictionary=True)
     
     # Check if buyer already reviewed this product
@@ -766,9 +1086,10 @@ def add_review(product_id):
     existing_review = cursor.fetchone()
     if existing_review:
         cursor.close()
-        db.close()
+        conns.close()
+        home_db.close()
         flash('You have already reviewed this product', 'error')
-        return redirect(url_for('product_reviews', product_id=product_id))
+        return redirect(url_for('main.product_reviews', product_id=product_id))
     
     # Validate rating
     rating_raw = request.form.get('rating')
@@ -778,31 +1099,31 @@ def add_review(product_id):
             raise ValueError()
     except (TypeError, ValueError):
         cursor.close()
-        db.close()
+        conns.close()
+        home_db.close()
         flash('Invalid rating value', 'error')
-        return redirect(url_for('product_reviews', product_id=product_id))
+        return redirect(url_for('main.product_reviews', product_id=product_id))
 
     title = request.form.get('title', '')
     comment = request.form.get('comment', '')
     order_id = request.form.get('order_id', None)
 
     # Verify the buyer has purchased this product
-    cursor.execute("""
-        SELECT oi.* FROM OrderItem oi
-        JOIN `Order` o ON o.id = oi.orderId
+    cursor.execute(union_archive("""
+        SELECT oi.id, oi.orderId FROM {OrderItem} oi
+        JOIN {Order} o ON o.id = oi.orderId
         WHERE oi.productId = %s AND o.userId = %s
-        LIMIT 1
-    """, (product_id, session['user_id']))
+    """, "LIMIT 1"), (product_id, session['user_id'], product_id, session['user_id']))
 
     purchase = cursor.fetchone()
     is_verified = purchase is not None
     
     if order_id and purchase:
         # Use the provided order_id if valid
-        cursor.execute("""
-            SELECT * FROM OrderItem 
+        cursor.execute(union_archive("""
+            SELECT id FROM {OrderItem}
             WHERE orderId = %s AND productId = %s
-        """, (order_id, product_id))
+        """, "LIMIT 1"), (order_id, product_id, order_id, product_id))
         if cursor.fetchone():
             order_id_to_use = order_id
         else:
@@ -823,56 +1144,34 @@ def add_review(product_id):
     # (removed update_product_rating call)
     
     cursor.close()
-    db.close()
+    conns.close()
+    home_db.close()
 
     flash('Review submitted successfully!', 'success')
-    return redirect(url_for('product_reviews', product_id=product_id))
+    return redirect(url_for('main.product_reviews', product_id=product_id))
 
-@app.route('/product/<int:product_id>/reviews')
+@bp.route('/product/<int:product_id>/reviews')
 @login_required
 def product_reviews(product_id):
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
+    home_db = get_db()
+    conns = get_shards(home_db)
+    # The product, its reviews and its orders are all on the product's shard
+    db = conns.for_id(product_id)
     
     # Get product info
-    cursor.execute("""
-        SELECT p.*, u.name as farmer_name
-        FROM Product p
-        JOIN User u ON p.farmerId = u.id
-        WHERE p.id = %s
-    """, (product_id,))
-    product = cursor.fetchone()
+    product = dao.product_detail(db, product_id)
     
     if not product:
         flash('Product not found', 'error')
-        cursor.close()
-        db.close()
-        return redirect(url_for('index'))
+        conns.close()
+        home_db.close()
+        return redirect(url_for('main.index'))
     
     # Get all reviews for this product
-    cursor.execute("""
-        SELECT r.*, u.name as reviewer_name
-        FROM Review r
-        JOIN User u ON r.reviewerId = u.id
-        WHERE r.productId = %s
-        ORDER BY r.createdAt DESC
-    """, (product_id,))
-    reviews = cursor.fetchall()
+    reviews = dao.product_reviews(db, product_id)
     
     # Calculate rating statistics
-    cursor.execute("""
-        SELECT 
-            COUNT(*) as total_reviews,
-            AVG(rating) as avg_rating,
-            SUM(CASE WHEN rating = 5 THEN 1 ELSE 0 END) as five_star,
-            SUM(CASE WHEN rating = 4 THEN 1 ELSE 0 END) as four_star,
-            SUM(CASE WHEN rating = 3 THEN 1 ELSE 0 END) as three_star,
-            SUM(CASE WHEN rating = 2 THEN 1 ELSE 0 END) as two_star,
-            SUM(CASE WHEN rating = 1 THEN 1 ELSE 0 END) as one_star
-        FROM Review
-        WHERE productId = %s
-    """, (product_id,))
-    stats = cursor.fetchone()
+    stats = dao.review_stats(db, product_id)
     
     # Check if current user can review (for buyers only)
     can_review = False
@@ -880,27 +1179,16 @@ def product_reviews(product_id):
     already_reviewed = False
     
     if session.get('role') == 'BUYER':
-        # Check if buyer has purchased this product
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM OrderItem oi
-            JOIN `Order` o ON o.id = oi.orderId
-            WHERE oi.productId = %s AND o.userId = %s
-        """, (product_id, session['user_id']))
-        purchase_check = cursor.fetchone()
-        has_purchased = purchase_check['count'] > 0
+        # Check if buyer has purchased this product (including archived orders)
+        has_purchased = dao.has_purchased(db, product_id, session['user_id'])
         
         # Check if buyer already reviewed this product
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM Review
-            WHERE productId = %s AND reviewerId = %s
-        """, (product_id, session['user_id']))
-        review_check = cursor.fetchone()
-        already_reviewed = review_check['count'] > 0
+        already_reviewed = dao.has_reviewed(db, product_id, session['user_id'])
         
         can_review = has_purchased and not already_reviewed
     
-    cursor.close()
-    db.close()
+    conns.close()
+    home_db.close()
     
     return render_template('product_reviews.html', 
                          product=product, 
@@ -910,5 +1198,66 @@ def product_reviews(product_id):
                          has_purchased=has_purchased,
                          already_reviewed=already_reviewed)
 
+# ==================== APP FACTORY ====================
+
+def precompile_templates(app):
+    """Compile every template now instead of on its first request."""
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+
+def warm_up(app):
+    """Precompile templates, open the DB pools and build the autocomplete index;
+    call once per worker after fork.
+
+    Marks the app ready for /ready. Returns False, leaving it not ready,
+    if the database can't be reached.
+    """
+    precompile_templates(app)
+    try:
+        for shard in shards.all_shards():
+            database.init_pool(shard)
+        db = database.init_pool().get_connection()
+        cursor = db.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        cursor.close()
+        autocomplete.index.rebuild(db)
+        db.close()
+    except mysql.connector.Error as e:
+        logger.warning('Database warm-up failed: %s', e)
+        return False
+    app.extensions['marketplace_ready'] = True
+    return True
+
+def create_app(config_object=Config):
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    database.configure(app.config)
+    admission.configure(app.config)
+    order_events.configure(app.config)
+    
+    # Bytecode cache must be set before the first template is loaded
+    cache_dir = app.config['TEMPLATE_CACHE_DIR']
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    
+    app.register_blueprint(bp)
+    
+    if app.config['PRECOMPILE_TEMPLATES']:
+        precompile_templates(app)
+    
+    return app
+
+def __getattr__(name):
+    # Keep `app:app` (gunicorn, flask run) working without building an app,
+    # and compiling its templates, whenever this module is imported
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 if __name__ == '__main__':
+    app = create_app()
+    warm_up(app)
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,413 @@
+"""Maintenance CLI for the order-side tables.
+
+Moves cold order history (Order, OrderItem, Payout, Payment, Checkout) into
+the monthly partitioned *Archive tables from mysqlfiles/archive.sql and purges
+abandoned checkouts and stale carts. All work is done in small batches, each
+in its own short transaction, so the hot tables are never locked for long.
+Every command runs on each shard in turn (see shards.py), home last. A
+checkout and its payment stay on home until no other shard has a hot
+order or an unresolved branch for it.
+
+Usage:
+    python archive.py partitions --months-ahead 3
+    python archive.py archive --older-than-days 365
+    python archive.py purge-checkouts --ttl-hours 24
+    python archive.py purge-carts --ttl-days 30
+    python archive.py purge-events --ttl-days 7
+    python archive.py all
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import shards
+
+# Table names used by queries that must also see archived history.
+# Queries are written with {Order}, {OrderItem} and {Payout} placeholders
+# and expanded once for the hot tables and once for the archive tables.
+HOT_TABLES = {'Order': '`Order`', 'OrderItem': 'OrderItem', 'Payout': 'Payout'}
+ARCHIVE_TABLES = {'Order': 'OrderArchive', 'OrderItem': 'OrderItemArchive', 'Payout': 'PayoutArchive'}
+
+PARTITIONED_TABLES = ['OrderArchive', 'OrderItemArchive', 'PayoutArchive', 'PaymentArchive', 'CheckoutArchive']
+
+
+def union_archive(select, order_by=''):
+    """Combine a query over the hot tables with the same query over the archive.
+
+    Parameters are not duplicated here; callers pass their params twice.
+    """
+    return '(' + select.format(**HOT_TABLES) + ') UNION ALL (' + select.format(**ARCHIVE_TABLES) + ') ' + order_by
+
+
+def _month_key(value):
+    return value.year * 100 + value.month
+
+
+def _next_month(month):
+    year, mon = divmod(month, 100)
+    if mon == 12:
+        return (year + 1) * 100 + 1
+    return month + 1
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+# ==================== PARTITIONS ====================
+
+def ensure_partitions(db, first_month, last_month):
+    """Split p_future so every archive table has a partition per month up to last_month."""
+    cursor = db.cursor()
+    created = 0
+
+    for table in PARTITIONED_TABLES:
+        cursor.execute("""
+            SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+              AND PARTITION_NAME IS NOT NULL AND PARTITION_NAME != 'p_future'
+        """, (table,))
+        existing = [int(row[0][1:]) for row in cursor.fetchall()]
+
+        month = _next_month(max(existing)) if existing else first_month
+        new_parts = []
+        while month <= last_month:
+            new_parts.append("PARTITION p%d VALUES LESS THAN (%d)" % (month, _next_month(month)))
+            month = _next_month(month)
+
+        if not new_parts:
+            continue
+
+        new_parts.append("PARTITION p_future VALUES LESS THAN MAXVALUE")
+        cursor.execute("ALTER TABLE %s REORGANIZE PARTITION p_future INTO (%s)"
+                       % (table, ', '.join(new_parts)))
+        created += len(new_parts) - 1
+
+    cursor.close()
+    return created
+
+
+def ensure_partitions_ahead(db, months_ahead=3):
+    """Create monthly partitions from the oldest order up to months_ahead from now."""
+    cursor = db.cursor()
+    cursor.execute("SELECT MIN(createdAt) FROM `Order`")
+    oldest = cursor.fetchone()[0]
+    cursor.close()
+
+    last_month = _month_key(datetime.now())
+    for _ in range(months_ahead):
+        last_month = _next_month(last_month)
+    first_month = _month_key(oldest) if oldest else _month_key(datetime.now())
+
+    return ensure_partitions(db, first_month, last_month)
+
+
+# ==================== ARCHIVAL ====================
+
+def archive_orders(db, older_than_days=365, batch_size=500, pause=0.1, other_shards=()):
+    """Move fully delivered orders older than the cutoff into the archive tables.
+
+    On home, other_shards are connections to the other shards, checked
+    before a checkout and its payment are moved; see archive_checkouts().
+    """
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    ensure_partitions_ahead(db, months_ahead=0)
+
+    cursor = db.cursor()
+    archived = 0
+
+    while True:
+        cursor.execute("""
+            SELECT o.id FROM `Order` o
+            WHERE o.createdAt < %s
+              AND NOT EXISTS (
+                  SELECT 1 FROM OrderItem oi
+                  WHERE oi.orderId = o.id AND oi.deliveryStatus != 'delivered'
+              )
+            ORDER BY o.id
+            LIMIT %s
+        """, (cutoff, batch_size))
+        order_ids = [row[0] for row in cursor.fetchall()]
+
+        if not order_ids:
+            break
+
+        try:
+            _archive_order_batch(cursor, order_ids, other_shards)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        archived += len(order_ids)
+        if len(order_ids) < batch_size:
+            break
+        time.sleep(pause)
+
+    cursor.close()
+    if other_shards:
+        archive_checkouts(db, cutoff, other_shards, batch_size, pause)
+    return archived
+
+
+def archive_checkouts(db, cutoff, other_shards, batch_size=500, pause=0.1):
+    """Move paid checkouts older than cutoff whose orders are all archived.
+
+    With shards, a checkout's orders on other shards are archived there, and
+    some checkouts have no order on home at all, so archiving home's orders
+    can't find every checkout that is done. Returns checkouts moved.
+    """
+    cursor = db.cursor()
+    moved = 0
+    last_id = 0
+
+    while True:
+        cursor.execute("""
+            SELECT c.id FROM Checkout c
+            WHERE c.id > %s AND c.createdAt < %s
+              AND EXISTS (SELECT 1 FROM Payment p WHERE p.checkoutId = c.id)
+              AND NOT EXISTS (SELECT 1 FROM `Order` o WHERE o.checkoutId = c.id)
+            ORDER BY c.id
+            LIMIT %s
+        """, (last_id, cutoff, batch_size))
+        checkout_ids = [row[0] for row in cursor.fetchall()]
+
+        if not checkout_ids:
+            break
+        last_id = checkout_ids[-1]
+
+        in_use = shards.checkouts_in_use(other_shards, checkout_ids)
+        done = [checkout_id for checkout_id in checkout_ids if checkout_id not in in_use]
+        if done:
+            try:
+                _archive_checkouts(cursor, done)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            moved += len(done)
+        else:
+            db.rollback()
+
+        if len(checkout_ids) < batch_size:
+            break
+        time.sleep(pause)
+
+    cursor.close()
+    return moved
+
+
+def _archive_order_batch(cursor, order_ids, other_shards=()):
+    ids = _placeholders(order_ids)
+
+    cursor.execute("SELECT DISTINCT checkoutId FROM `Order` WHERE id IN (%s) AND checkoutId IS NOT NULL" % ids,
+                   order_ids)
+    checkout_ids = [row[0] for row in cursor.fetchall()]
+
+    # Copy payouts, items and orders, tagged with the month the order was placed
+    cursor.execute("""
+        INSERT INTO PayoutArchive (id, farmerId, orderItemId, amount, status, createdAt, archiveMonth)
+        SELECT pa.id, pa.farmerId, pa.orderItemId, pa.amount, pa.status, pa.createdAt,
+               EXTRACT(YEAR_MONTH FROM o.createdAt)
+        FROM Payout pa
+        JOIN OrderItem oi ON pa.orderItemId = oi.id
+        JOIN `Order` o ON oi.orderId = o.id
+        WHERE o.id IN (%s)
+    """ % ids, order_ids)
+
+    cursor.execute("""
+        INSERT INTO OrderItemArchive (id, orderId, productId, quantity, price, deliveryStatus, deliveredAt, archiveMonth)
+        SELECT oi.id, oi.orderId, oi.productId, oi.quantity, oi.price, oi.deliveryStatus, oi.deliveredAt,
+               EXTRACT(YEAR_MONTH FROM o.createdAt)
+        FROM OrderItem oi
+        JOIN `Order` o ON oi.orderId = o.id
+        WHERE o.id IN (%s)
+    """ % ids, order_ids)
+
+    cursor.execute("""
+        INSERT INTO OrderArchive (id, userId, totalAmount, deliveryAddress, status, createdAt, checkoutId, archiveMonth)
+        SELECT o.id, o.userId, o.totalAmount, o.deliveryAddress, o.status, o.createdAt, o.checkoutId,
+               EXTRACT(YEAR_MONTH FROM o.createdAt)
+        FROM `Order` o
+        WHERE o.id IN (%s)
+    """ % ids, order_ids)
+
+    # Remove from the hot tables in foreign key order
+    cursor.execute("""
+        DELETE FROM Payout
+        WHERE orderItemId IN (SELECT id FROM OrderItem WHERE orderId IN (%s))
+    """ % ids, order_ids)
+    cursor.execute("DELETE FROM OrderItem WHERE orderId IN (%s)" % ids, order_ids)
+    cursor.execute("DELETE FROM `Order` WHERE id IN (%s)" % ids, order_ids)
+
+    if not checkout_ids:
+        return
+
+    # Only move checkouts that no remaining hot order, here or on another shard, still points at
+    cursor.execute("""
+        SELECT c.id FROM Checkout c
+        WHERE c.id IN (%s)
+          AND NOT EXISTS (SELECT 1 FROM `Order` o WHERE o.checkoutId = c.id)
+    """ % _placeholders(checkout_ids), checkout_ids)
+    checkout_ids = [row[0] for row in cursor.fetchall()]
+    in_use = shards.checkouts_in_use(other_shards, checkout_ids)
+    checkout_ids = [checkout_id for checkout_id in checkout_ids if checkout_id not in in_use]
+
+    if checkout_ids:
+        _archive_checkouts(cursor, checkout_ids)
+
+
+def _archive_checkouts(cursor, checkout_ids):
+    ids = _placeholders(checkout_ids)
+
+    cursor.execute("""
+        INSERT INTO PaymentArchive (id, checkoutId, payerId, amount, method, status, gatewayTransactionId,
+                                    paidAt, gatewayResponse, archiveMonth)
+        SELECT p.id, p.checkoutId, p.payerId, p.amount, p.method, p.status, p.gatewayTransactionId,
+               p.paidAt, p.gatewayResponse, EXTRACT(YEAR_MONTH FROM c.createdAt)
+        FROM Payment p
+        JOIN Checkout c ON p.checkoutId = c.id
+        WHERE c.id IN (%s)
+    """ % ids, checkout_ids)
+
+    cursor.execute("""
+        INSERT INTO CheckoutArchive (id, customerId, grandTotal, deliveryFee, createdAt, updatedAt, archiveMonth)
+        SELECT c.id, c.customerId, c.grandTotal, c.deliveryFee, c.createdAt, c.updatedAt,
+               EXTRACT(YEAR_MONTH FROM c.createdAt)
+        FROM Checkout c
+        WHERE c.id IN (%s)
+    """ % ids, checkout_ids)
+
+    cursor.execute("DELETE FROM Payment WHERE checkoutId IN (%s)" % ids, checkout_ids)
+    cursor.execute("DELETE FROM Checkout WHERE id IN (%s)" % ids, checkout_ids)
+
+
+# ==================== PURGES ====================
+
+def _purge_in_batches(db, select_sql, delete_sql, params, batch_size, pause):
+    cursor = db.cursor()
+    purged = 0
+
+    while True:
+        cursor.execute(select_sql, params + (batch_size,))
+        row_ids = [row[0] for row in cursor.fetchall()]
+
+        if not row_ids:
+            break
+
+        cursor.execute(delete_sql % _placeholders(row_ids), row_ids)
+        db.commit()
+
+        purged += len(row_ids)
+        if len(row_ids) < batch_size:
+            break
+        time.sleep(pause)
+
+    cursor.close()
+    return purged
+
+
+def purge_checkouts(db, ttl_hours=24, batch_size=1000, pause=0.05):
+    """Delete checkouts that were never paid for and are older than the TTL."""
+    cutoff = datetime.now() - timedelta(hours=ttl_hours)
+    return _purge_in_batches(db, """
+        SELECT c.id FROM Checkout c
+        WHERE c.createdAt < %s
+          AND NOT EXISTS (SELECT 1 FROM Payment p WHERE p.checkoutId = c.id)
+          AND NOT EXISTS (SELECT 1 FROM `Order` o WHERE o.checkoutId = c.id)
+        ORDER BY c.id
+        LIMIT %s
+    """, "DELETE FROM Checkout WHERE id IN (%s)", (cutoff,), batch_size, pause)
+
+
+def purge_carts(db, ttl_days=30, batch_size=1000, pause=0.05):
+    """Delete cart rows that have not been touched for ttl_days."""
+    cutoff = datetime.now() - timedelta(days=ttl_days)
+    return _purge_in_batches(db, """
+        SELECT id FROM Cart
+        WHERE addedAt < %s
+        ORDER BY id
+        LIMIT %s
+    """, "DELETE FROM Cart WHERE id IN (%s)", (cutoff,), batch_size, pause)
+
+
+def purge_events(db, ttl_days=7, batch_size=1000, pause=0.05):
+    """Delete order change feed rows older than any live stream still needs."""
+    cutoff = datetime.now() - timedelta(days=ttl_days)
+    return _purge_in_batches(db, """
+        SELECT id FROM OrderEvent
+        WHERE createdAt < %s
+        ORDER BY id
+        LIMIT %s
+    """, "DELETE FROM OrderEvent WHERE id IN (%s)", (cutoff,), batch_size, pause)
+
+
+# ==================== CLI ====================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Archive order history and purge stale rows.')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--pause', type=float, default=0.1, help='seconds to sleep between batches')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    partitions = sub.add_parser('partitions', help='create monthly archive partitions')
+    partitions.add_argument('--months-ahead', type=int, default=3)
+
+    archive = sub.add_parser('archive', help='move delivered orders into the archive tables')
+    archive.add_argument('--older-than-days', type=int, default=365)
+
+    checkouts = sub.add_parser('purge-checkouts', help='delete abandoned checkouts')
+    checkouts.add_argument('--ttl-hours', type=int, default=24)
+
+    carts = sub.add_parser('purge-carts', help='delete stale cart rows')
+    carts.add_argument('--ttl-days', type=int, default=30)
+
+    events = sub.add_parser('purge-events', help='delete old order change feed rows')
+    events.add_argument('--ttl-days', type=int, default=7)
+
+    everything = sub.add_parser('all', help='run every maintenance task with its defaults')
+    everything.add_argument('--older-than-days', type=int, default=365)
+    everything.add_argument('--ttl-hours', type=int, default=24)
+    everything.add_argument('--ttl-days', type=int, default=30)
+    everything.add_argument('--event-ttl-days', type=int, default=7)
+
+    args = parser.parse_args(argv)
+
+    from db import get_db
+
+    # Order history, carts and change feeds are kept on every shard. Home goes
+    # last, so checkouts whose orders the others just archived can follow them
+    for shard in reversed(shards.all_shards()):
+        if shards.enabled():
+            print(f'Shard {shard}:')
+        db = get_db(shard)
+        other_shards = []
+
+        try:
+            if args.command in ('partitions', 'all'):
+                created = ensure_partitions_ahead(db, getattr(args, 'months_ahead', 3))
+                print(f'Created {created} archive partitions')
+            if args.command in ('archive', 'all'):
+                if shard == shards.HOME_SHARD:
+                    other_shards = [get_db(other) for other in shards.all_shards() if other != shard]
+                archived = archive_orders(db, args.older_than_days, args.batch_size, args.pause, other_shards)
+                print(f'Archived {archived} orders')
+            if args.command in ('purge-checkouts', 'all') and shard == shards.HOME_SHARD:
+                purged = purge_checkouts(db, args.ttl_hours, args.batch_size, args.pause)
+                print(f'Purged {purged} abandoned checkouts')
+            if args.command in ('purge-carts', 'all'):
+                purged = purge_carts(db, args.ttl_days, args.batch_size, args.pause)
+                print(f'Purged {purged} stale cart rows')
+            if args.command == 'purge-events':
+                purged = purge_events(db, args.ttl_days, args.batch_size, args.pause)
+                print(f'Purged {purged} order change feed rows')
+            elif args.command == 'all':
+                purged = purge_events(db, args.event_ttl_days, args.batch_size, args.pause)
+                print(f'Purged {purged} order change feed rows')
+        finally:
+            for other_db in other_shards:
+                other_db.close()
+            db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,509 @@
+"""Optional async serving mode for the read-heavy pages.
+
+    pip install -r requirements-optional.txt
+    uvicorn --factory asgi:create_asgi_app --workers 4
+
+The buyer catalog, both order history pages and the product reviews page
+run as coroutines on an aiomysql pool. A worker waiting on MySQL serves
+other connections in the meantime, instead of parking a thread per
+request. Every other route goes to the regular Flask app, which runs on a
+thread pool through a2wsgi.
+
+The async views reuse the Flask app's URL map, sessions, login decorators,
+rate limits and templates. They also use the SQL and row types in dao.py,
+so both modes render the same pages from the same queries. Pages stream
+through an async overlay of the app's Jinja environment, so rows are
+fetched while the page is sent, as stream_page() does in sync mode.
+
+Each shard (see shards.py) gets its own pool, and the views route and
+merge across shards as their sync counterparts do.
+"""
+import asyncio
+import inspect
+import io
+import logging
+import sys
+from operator import attrgetter
+
+import aiomysql
+from a2wsgi import WSGIMiddleware
+from flask import current_app, flash, g, get_flashed_messages, redirect, request, session, url_for
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.exceptions import HTTPException, ServiceUnavailable
+
+import admission
+import dao
+import db as database
+import geo
+import order_events
+import shards
+from admission import rate_limited
+from app import buyer_required, create_app, farmer_required, login_required, warm_up
+from config import Config
+from streaming import CHUNK_SIZE, Compressor, negotiate_encoding
+
+logger = logging.getLogger(__name__)
+
+# Threads serving the routes that stay synchronous
+WSGI_THREADS = 10
+
+# endpoint -> coroutine view
+ASYNC_VIEWS = {}
+
+
+class Page:
+    """A template to stream; async views return this instead of a response."""
+
+    def __init__(self, template_name, **context):
+        self.template_name = template_name
+        self.context = context
+
+
+def async_view(endpoint):
+    def decorator(f):
+        ASYNC_VIEWS[endpoint] = f
+        return f
+    return decorator
+
+
+# ==================== DATA ACCESS ====================
+
+class RowStream:
+    """Async iterator over an unbuffered result, mapping rows to row_type."""
+
+    def __init__(self, cursor, row_type, batch_size):
+        self._cursor = cursor
+        self._row_type = row_type
+        self._batch_size = batch_size
+        self._batch = iter(())
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        row = next(self._batch, None)
+        if row is None:
+            batch = await self._cursor.fetchmany(self._batch_size)
+            if not batch:
+                raise StopAsyncIteration
+            self._batch = iter(batch)
+            row = next(self._batch)
+        return self._row_type._make(row)
+
+
+async def get_async_db(shard=shards.HOME_SHARD):
+    """Connection to a shard for the current request, released once the response is sent."""
+    if 'async_dbs' not in g:
+        g.async_dbs = {}
+        g.async_cursors = []
+    db = g.async_dbs.get(shard)
+    if db is None:
+        pool = current_app.extensions['async_db_pools'][shard]
+        try:
+            db = await asyncio.wait_for(pool.acquire(), admission.DB_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise ServiceUnavailable('The marketplace is busy right now, please try again shortly.',
+                                     retry_after=admission.RETRY_AFTER)
+        g.async_dbs[shard] = db
+    return db
+
+
+async def each_db():
+    """(shard, connection) for every shard, for scatter-gather reads."""
+    return [(shard, await get_async_db(shard)) for shard in shards.all_shards()]
+
+
+async def release_async_db():
+    dbs = g.pop('async_dbs', None)
+    if not dbs:
+        return
+    try:
+        # Closing an unbuffered cursor drains rows a disconnected client left unread
+        for cursor in g.pop('async_cursors'):
+            await cursor.close()
+    finally:
+        pools = current_app.extensions['async_db_pools']
+        for shard, db in dbs.items():
+            pools[shard].release(db)
+
+
+async def fetch_all(db, row_type, sql, params=()):
+    async with db.cursor() as cursor:
+        await cursor.execute(sql, params)
+        return [row_type._make(row) for row in await cursor.fetchall()]
+
+
+async def fetch_one(db, row_type, sql, params=()):
+    rows = await fetch_all(db, row_type, sql, params)
+    return rows[0] if rows else None
+
+
+async def fetch_value(db, sql, params=()):
+    async with db.cursor() as cursor:
+        await cursor.execute(sql, params)
+        row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+async def iter_rows(db, row_type, sql, params=(), batch_size=500):
+    """Execute now and return a RowStream fetching rows batch_size at a time."""
+    cursor = await db.cursor(aiomysql.SSCursor)
+    g.async_cursors.append(cursor)
+    await cursor.execute(sql, params)
+    return RowStream(cursor, row_type, batch_size)
+
+
+def merge_rows(streams, key, reverse=False):
+    """Async counterpart of shards.merge, for RowStreams."""
+    if len(streams) == 1:
+        return streams[0]
+    return _merged_rows(streams, key, reverse)
+
+
+async def _merged_rows(streams, key, reverse):
+    # Few shards, so picking the next row from their heads beats keeping a heap
+    heads = {}
+    for number, stream in enumerate(streams):
+        row = await anext(stream, None)
+        if row is not None:
+            heads[number] = row
+    pick = max if reverse else min
+    while heads:
+        number = pick(heads, key=lambda candidate: key(heads[candidate]))
+        yield heads[number]
+        row = await anext(streams[number], None)
+        if row is None:
+            del heads[number]
+        else:
+            heads[number] = row
+
+
+async def farmer_shard(db, farmer_id):
+    """Async counterpart of shards.shard_for_farmer."""
+    if not shards.enabled():
+        return shards.HOME_SHARD
+    shard = shards.cached_shard(farmer_id)
+    if shard is None:
+        shard = shards.remember_shard(farmer_id, await fetch_value(db, shards.FARMER_SHARD_SQL, (farmer_id,)))
+    return shard
+
+
+async def latest_position(dbs, column, owner_id):
+    """Async counterpart of order_events.latest_positions, formatted for a page."""
+    sql = order_events.LATEST_EVENT_SQL[column]
+    return order_events.format_position({shard: await fetch_value(db, sql, (owner_id,)) for shard, db in dbs})
+
+
+async def nearest_radius(db, location, count):
+    """Async counterpart of geo.nearest_radius."""
+    for radius_km in geo.SEARCH_RADII_KM:
+        sql, params = geo.nearby_farms_query(location.latitude, location.longitude, radius_km, count)
+        farms = await fetch_all(db, geo.NearbyFarm, sql, params)
+        if len(farms) >= count:
+            return farms[-1].distance_km
+    return geo.SEARCH_RADII_KM[-1]
+
+
+async def group_orders(order_items):
+    """Async counterpart of app.group_orders."""
+    order = None
+    async for item in order_items:
+        if order is None or order['id'] != item.order_id:
+            if order is not None:
+                yield order
+            order = {
+                'id': item.order_id,
+                'order_date': item.order_date,
+                'totalAmount': item.totalAmount,
+                'deliveryAddress': item.deliveryAddress,
+                'order_items': []
+            }
+        order['order_items'].append(item)
+    if order is not None:
+        yield order
+
+
+# ==================== ASYNC VIEWS ====================
+
+@async_view('main.buyer_dashboard')
+@buyer_required
+@rate_limited('catalog')
+async def buyer_dashboard():
+    db = await get_async_db()
+    radius = request.args.get('radius', type=float)
+    nearest = request.args.get('nearest', type=int)
+    location = await fetch_one(db, geo.Location, geo.BUYER_LOCATION_SQL, (session['user_id'],))
+    if location and location.latitude is None:
+        location = None
+
+    if location and radius and radius > 0:
+        sql, params = geo.nearby_catalog_query(location.latitude, location.longitude, radius)
+    elif location and nearest and nearest > 0:
+        nearest = min(nearest, geo.MAX_FARMS)
+        radius_km = await nearest_radius(db, location, nearest)
+        sql, params = geo.nearby_catalog_query(location.latitude, location.longitude, radius_km, nearest)
+    else:
+        sql = None
+
+    dbs = await each_db()
+    if sql:
+        products = merge_rows([await iter_rows(shard_db, dao.NearbyCatalogRow, sql, params) for _, shard_db in dbs],
+                              key=attrgetter('distance_km'))
+    else:
+        products = merge_rows([await iter_rows(shard_db, dao.CatalogRow, dao.CATALOG_SQL) for _, shard_db in dbs],
+                              key=attrgetter('createdAt'), reverse=True)
+
+    return Page('buyer_dashboard.html', products=products, location=location,
+                radius=radius, radius_options=geo.RADIUS_OPTIONS_KM, nearest_count=geo.NEAREST_FARMS)
+
+
+@async_view('main.farmer_orders')
+@farmer_required
+async def farmer_orders():
+    db = await get_async_db()
+    farmer_id = await fetch_value(db, dao.FARMER_ID_SQL, (session['user_id'],))
+
+    if not farmer_id:
+        flash('Farmer profile not found', 'error')
+        return redirect(url_for('main.farmer_dashboard'))
+
+    shard = await farmer_shard(db, farmer_id)
+    farmer_db = await get_async_db(shard)
+    last_event_id = await latest_position([(shard, farmer_db)], 'farmerId', farmer_id)
+    order_items = await iter_rows(farmer_db, dao.FarmerOrderRow, dao.FARMER_ORDERS_SQL, (farmer_id, farmer_id))
+    return Page('farmer_orders.html', order_items=order_items, last_event_id=last_event_id)
+
+
+@async_view('main.buyer_orders')
+@buyer_required
+async def buyer_orders():
+    dbs = await each_db()
+    user_id = session['user_id']
+    last_event_id = await latest_position(dbs, 'buyerId', user_id)
+    order_items = merge_rows([await iter_rows(db, dao.BuyerOrderRow, dao.BUYER_ORDERS_SQL, (user_id, user_id))
+                              for _, db in dbs], key=dao.buyer_order_key, reverse=True)
+    return Page('buyer_orders.html', orders=group_orders(order_items), last_event_id=last_event_id)
+
+
+@async_view('main.product_reviews')
+@login_required
+async def product_reviews(product_id):
+    db = await get_async_db(shards.shard_for_id(product_id))
+    product = await fetch_one(db, dao.ProductRow, dao.PRODUCT_SQL, (product_id,))
+
+    if not product:
+        flash('Product not found', 'error')
+        return redirect(url_for('main.index'))
+
+    reviews = await fetch_all(db, dao.ReviewRow, dao.REVIEWS_SQL, (product_id,))
+    stats = await fetch_one(db, dao.ReviewStats, dao.REVIEW_STATS_SQL, (product_id,))
+
+    has_purchased = False
+    already_reviewed = False
+    if session.get('role') == 'BUYER':
+        user_id = session['user_id']
+        has_purchased = await fetch_value(db, dao.HAS_PURCHASED_SQL,
+                                          (product_id, user_id, product_id, user_id)) is not None
+        already_reviewed = await fetch_value(db, dao.HAS_REVIEWED_SQL, (product_id, user_id)) > 0
+
+    return Page('product_reviews.html',
+                product=product,
+                reviews=reviews,
+                stats=stats,
+                can_review=has_purchased and not already_reviewed,
+                has_purchased=has_purchased,
+                already_reviewed=already_reviewed)
+
+
+# ==================== ASGI APP ====================
+
+def build_environ(scope):
+    """WSGI environ for a body-less ASGI request; enough for routing, sessions and url_for."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope['http_version'],
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+        else:
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def _asgi_headers(response):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in response.headers.items()]
+
+
+async def _send_body(send, strings, encoding):
+    """Send rendered template fragments in CHUNK_SIZE pieces, compressed if negotiated."""
+    compressor = Compressor(encoding) if encoding else None
+    buffer = []
+    size = 0
+    async for text in strings:
+        buffer.append(text)
+        size += len(text)
+        if size < CHUNK_SIZE:
+            continue
+        data = ''.join(buffer).encode('utf-8')
+        buffer = []
+        size = 0
+        if compressor:
+            # Flush every chunk so the browser can start rendering it
+            data = compressor.compress(data) + compressor.flush()
+        if data:
+            await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+    data = ''.join(buffer).encode('utf-8')
+    if compressor:
+        data = compressor.compress(data) + compressor.finish()
+    await send({'type': 'http.response.body', 'body': data})
+
+
+class MarketplaceASGI:
+    """Serves ASYNC_VIEWS natively and hands every other request to the Flask app."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+
+        # Same loader, globals and filters as the sync environment. The async
+        # templates compile to different code, so they get their own caches.
+        bytecode_cache = None
+        cache_dir = flask_app.config['TEMPLATE_CACHE_DIR']
+        if cache_dir:
+            bytecode_cache = FileSystemBytecodeCache(cache_dir, '__jinja2_async_%s.cache')
+        self.jinja_env = flask_app.jinja_env.overlay(enable_async=True, cache_size=400,
+                                                     bytecode_cache=bytecode_cache)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        # Async views only answer GETs, and only once the async pools are open
+        if (scope['type'] == 'http' and scope['method'] == 'GET'
+                and 'async_db_pools' in self.flask_app.extensions):
+            environ = build_environ(scope)
+            try:
+                endpoint, args = self.flask_app.url_map.bind_to_environ(environ).match()
+            except HTTPException:
+                endpoint = None
+            view = ASYNC_VIEWS.get(endpoint)
+            if view is not None:
+                await self.dispatch(view, args, environ, send)
+                return
+
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        config = self.flask_app.config
+        if config['PRECOMPILE_TEMPLATES']:
+            for name in self.jinja_env.list_templates(extensions=['html']):
+                self.jinja_env.get_template(name)
+
+        pools = []
+        try:
+            for shard_config in database.SHARD_CONFIGS:
+                pools.append(await aiomysql.create_pool(
+                    host=shard_config['host'],
+                    port=shard_config['port'],
+                    user=shard_config['user'],
+                    password=shard_config['password'],
+                    db=shard_config['database'],
+                    connect_timeout=shard_config['connection_timeout'],
+                    minsize=config['ASYNC_DB_POOL_SIZE'],
+                    maxsize=config['ASYNC_DB_POOL_SIZE'],
+                    # Each statement sees fresh data, as get_db()'s rollback ensures in sync mode
+                    autocommit=True))
+            self.flask_app.extensions['async_db_pools'] = pools
+        except (OSError, aiomysql.Error) as e:
+            logger.warning('Async database pools failed to open, serving every route sync: %s', e)
+            await self._close_pools(pools)
+
+        # Warm the sync side too; it serves every other route
+        await asyncio.to_thread(warm_up, self.flask_app)
+
+    async def shutdown(self):
+        await self._close_pools(self.flask_app.extensions.pop('async_db_pools', []))
+
+    async def _close_pools(self, pools):
+        for pool in pools:
+            pool.close()
+            await pool.wait_closed()
+
+    async def dispatch(self, view, args, environ, send):
+        app = self.flask_app
+        with app.request_context(environ):
+            try:
+                try:
+                    rv = view(**args)
+                    # The login and rate limit decorators may answer without awaiting the view
+                    if inspect.isawaitable(rv):
+                        rv = await rv
+                except HTTPException as e:
+                    rv = app.handle_user_exception(e)
+
+                if isinstance(rv, Page):
+                    await self.send_page(rv, send)
+                else:
+                    response = app.process_response(app.make_response(rv))
+                    await send({'type': 'http.response.start', 'status': response.status_code,
+                                'headers': _asgi_headers(response)})
+                    await send({'type': 'http.response.body', 'body': response.get_data()})
+            finally:
+                await release_async_db()
+
+    async def send_page(self, page, send):
+        app = self.flask_app
+        # Pop flashed messages now; the session cookie goes out with the headers
+        get_flashed_messages(with_categories=True)
+
+        context = dict(page.context)
+        app.update_template_context(context)
+        template = self.jinja_env.get_template(page.template_name)
+
+        # Every page is larger than MIN_SIZE, so compress whenever the client accepts it
+        encoding = negotiate_encoding()
+        response = app.response_class(mimetype='text/html')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response = app.process_response(response)
+        response.headers.pop('Content-Length', None)
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': _asgi_headers(response)})
+        await _send_body(send, template.generate_async(context), encoding)
+
+
+def create_asgi_app(config_object=Config):
+    return MarketplaceASGI(create_app(config_object))
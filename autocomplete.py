@@ -0,0 +1,279 @@
+"""In-process prefix index for product and farm name type-ahead.
+
+Names live in a sorted list searched with bisect, so a keystroke costs a
+dictionary hit or a binary search instead of a LIKE query. Every word of
+a name is indexed, so "tom" finds "Cherry Tomatoes". Products are ranked
+by averageRating and farms by rating, then both by the farmer's
+totalSales.
+
+The index is per worker process. Routes that change product names update
+it in place; other workers see the change after their next background
+rebuild, which runs every REBUILD_INTERVAL seconds.
+"""
+import bisect
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import shards
+from db import get_db
+
+logger = logging.getLogger(__name__)
+
+# Products and farms held at most; past this the lowest ranked are left out
+MAX_ENTRIES = 100000
+# Characters of each name that are indexed
+MAX_NAME_LENGTH = 64
+MAX_RESULTS = 8
+# Answered prefixes kept for repeat keystrokes, least recently used dropped first
+MAX_CACHED_PREFIXES = 5000
+# Prefixes matching more keys than this are answered by walking names in
+# rank order, which finds the best few quickly when matches are common
+SCAN_LIMIT = 500
+# Seconds between full rebuilds, which pick up rating and sales changes
+REBUILD_INTERVAL = 600
+# Seconds before retrying a rebuild that failed
+REBUILD_RETRY = 30
+
+# words is the normalized name with a leading space, for word-start matching
+Suggestion = namedtuple('Suggestion', ['kind', 'id', 'text', 'score', 'words'])
+
+PRODUCTS_SQL = """
+    SELECT p.id, p.name, p.farmerId, COALESCE(p.averageRating, 0)
+    FROM Product p
+    WHERE p.isAvailable = TRUE AND p.stockQuantity > 0
+"""
+
+FARMER_PRODUCTS_SQL = PRODUCTS_SQL + " AND p.farmerId = %s"
+
+FARMS_SQL = """
+    SELECT id, farmName, COALESCE(rating, 0), totalSales
+    FROM Farmer
+    WHERE farmName IS NOT NULL
+"""
+
+
+def normalize(text):
+    return ' '.join(text.casefold().split())[:MAX_NAME_LENGTH]
+
+
+def make_suggestion(kind, id, text, score):
+    return Suggestion(kind, id, text, score, ' ' + normalize(text))
+
+
+def index_keys(entry):
+    """Sorted-list keys for an entry: its name from each word onwards, so any
+    word can start a match, tagged with the entry so every key is unique."""
+    words = entry.words[1:].split(' ')
+    tag = f'\x00{entry.kind}{entry.id}'
+    return [(' '.join(words[i:]) + tag) for i in range(len(words)) if words[i]]
+
+
+def rank(entry):
+    return entry.score, entry.kind, entry.id
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []  # sorted index keys
+        self._refs = []  # (kind, id) owning the key at the same position
+        self._ranked = []  # entries, lowest rank first
+        self._entries = {}  # (kind, id) -> Suggestion
+        self._farmer_products = {}  # farmer id -> product ids
+        self._farmer_sales = {}  # farmer id -> totalSales
+        self._cache = OrderedDict()  # prefix -> suggestions
+        self._next_rebuild = 0
+        self._rebuilding = False
+        self.built_at = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    # ---------- building ----------
+
+    def rebuild(self, db):
+        """Replace the whole index with what is in the database; db is the home shard."""
+        conns = shards.Connections(db)
+        farms = {}
+        products = []
+        try:
+            for _, shard_db in conns.each():
+                cursor = shard_db.cursor()
+                cursor.execute(FARMS_SQL)
+                for farm in cursor.fetchall():
+                    # Sales are counted on the farmer's own shard and only grow, so its copy has the most
+                    if farm[0] not in farms or farm[3] > farms[farm[0]][3]:
+                        farms[farm[0]] = farm
+                cursor.execute(PRODUCTS_SQL)
+                products += cursor.fetchall()
+                cursor.close()
+        finally:
+            conns.close()
+        self.load(list(farms.values()), products)
+
+    def load(self, farms, products):
+        """Replace the index with (id, farmName, rating, totalSales) farm rows
+        and (id, name, farmerId, averageRating) product rows."""
+        sales = {farm_id: total_sales for farm_id, _, _, total_sales in farms}
+        entries = [make_suggestion('farm', farm_id, name, (rating, total_sales))
+                   for farm_id, name, rating, total_sales in farms]
+        entries += [make_suggestion('product', product_id, name, (rating, sales.get(farmer_id, 0)))
+                    for product_id, name, farmer_id, rating in products]
+        entries.sort(key=rank)
+        # Over the bound, keep the best ranked
+        del entries[:-MAX_ENTRIES]
+
+        # Build aside and swap, so lookups never wait on a rebuild
+        farmer_of = {product_id: farmer_id for product_id, _, farmer_id, _ in products}
+        ref_of = {}  # keys are unique, so sort them alone and look refs up after
+        farmer_products = {}
+        for entry in entries:
+            ref = (entry.kind, entry.id)
+            for key in index_keys(entry):
+                ref_of[key] = ref
+            if entry.kind == 'product':
+                farmer_products.setdefault(farmer_of[entry.id], set()).add(entry.id)
+        keys = sorted(ref_of)
+        refs = [ref_of[key] for key in keys]
+
+        with self._lock:
+            self._keys = keys
+            self._refs = refs
+            self._ranked = entries
+            self._entries = {(entry.kind, entry.id): entry for entry in entries}
+            self._farmer_products = farmer_products
+            self._farmer_sales = sales
+            self._cache.clear()
+            self._next_rebuild = time.monotonic() + REBUILD_INTERVAL
+            self.built_at = time.time()
+
+    def rebuild_if_stale(self):
+        """Start a background rebuild when the index is due for one."""
+        now = time.monotonic()
+        with self._lock:
+            if self._rebuilding or now < self._next_rebuild:
+                return
+            self._rebuilding = True
+            self._next_rebuild = now + REBUILD_RETRY
+        threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    def _rebuild_in_background(self):
+        try:
+            db = get_db()
+            try:
+                self.rebuild(db)
+            finally:
+                db.close()
+        except Exception:
+            logger.exception('Autocomplete index rebuild failed')
+        finally:
+            self._rebuilding = False
+
+    # ---------- incremental updates ----------
+
+    def update_product(self, product_id, name, farmer_id, rating=None, available=True):
+        """Reflect an added or edited product; unavailable products are dropped."""
+        with self._lock:
+            self._remove(('product', product_id))
+            self._farmer_products.setdefault(farmer_id, set()).discard(product_id)
+            if available:
+                score = (rating or 0, self._farmer_sales.get(farmer_id, 0))
+                if self._add(make_suggestion('product', product_id, name, score)):
+                    self._farmer_products[farmer_id].add(product_id)
+
+    def reload_farmer(self, db, farmer_id):
+        """Re-read one farmer's products from their shard, e.g. after a bulk import."""
+        cursor = db.cursor()
+        cursor.execute(FARMER_PRODUCTS_SQL, (farmer_id,))
+        products = cursor.fetchall()
+        cursor.close()
+
+        with self._lock:
+            for product_id in self._farmer_products.pop(farmer_id, ()):
+                self._remove(('product', product_id))
+            sales = self._farmer_sales.get(farmer_id, 0)
+            added = set()
+            for product_id, name, _, rating in products:
+                if self._add(make_suggestion('product', product_id, name, (rating, sales))):
+                    added.add(product_id)
+            self._farmer_products[farmer_id] = added
+
+    def _add(self, entry):
+        if len(self._entries) >= MAX_ENTRIES:
+            return False
+        ref = (entry.kind, entry.id)
+        self._entries[ref] = entry
+        bisect.insort(self._ranked, entry, key=rank)
+        for key in index_keys(entry):
+            position = bisect.bisect_left(self._keys, key)
+            self._keys.insert(position, key)
+            self._refs.insert(position, ref)
+            self._invalidate(key)
+        return True
+
+    def _remove(self, ref):
+        entry = self._entries.pop(ref, None)
+        if entry is None:
+            return
+        del self._ranked[bisect.bisect_left(self._ranked, rank(entry), key=rank)]
+        for key in index_keys(entry):
+            position = bisect.bisect_left(self._keys, key)
+            del self._keys[position]
+            del self._refs[position]
+            self._invalidate(key)
+
+    def _invalidate(self, key):
+        # Only prefixes of a changed name can have a different answer
+        key = key[:key.index('\x00')]
+        for end in range(1, len(key) + 1):
+            self._cache.pop(key[:end], None)
+
+    # ---------- lookups ----------
+
+    def suggest(self, query, limit=MAX_RESULTS):
+        """Best ranked names with a word starting with query."""
+        prefix = normalize(query).replace('\x00', '')
+        if not prefix:
+            return []
+
+        with self._lock:
+            results = self._cache.get(prefix)
+            if results is not None:
+                self._cache.move_to_end(prefix)
+                return results[:limit]
+
+            start = bisect.bisect_left(self._keys, prefix)
+            end = bisect.bisect_left(self._keys, prefix + '\U0010ffff', start)
+            if end - start <= SCAN_LIMIT:
+                candidates = sorted([self._entries[ref] for ref in set(self._refs[start:end])],
+                                    key=rank, reverse=True)
+            else:
+                # Common prefix: the best ranked names soon include enough matches
+                needle = ' ' + prefix
+                candidates = (entry for entry in reversed(self._ranked) if needle in entry.words)
+
+            results = []
+            seen = set()
+            for entry in candidates:
+                # Many farmers sell "Tomatoes"; suggest the name once
+                text = (entry.kind, entry.words)
+                if text not in seen:
+                    seen.add(text)
+                    results.append(entry)
+                    if len(results) == MAX_RESULTS:
+                        break
+
+            self._cache[prefix] = results
+            if len(self._cache) > MAX_CACHED_PREFIXES:
+                self._cache.popitem(last=False)
+        return results[:limit]
+
+
+index = PrefixIndex()
+
+
+def suggest(query, limit=MAX_RESULTS):
+    index.rebuild_if_stale()
+    return index.suggest(query, limit)
@@ -0,0 +1,190 @@
+"""Requests/sec and server memory, sync (gunicorn) vs async (uvicorn) mode.
+
+Starts each server in turn with the same number of worker processes, holds
+--connections keep-alive connections open against one page for --duration
+seconds, and reports throughput, latency and the peak resident memory of
+the whole server process tree, scaled to 1,000 connections.
+
+Needs a populated database (see config.py for the DB_* variables) and, for
+the two servers, `pip install gunicorn uvicorn aiomysql a2wsgi`. Requests
+are signed in as --user-id with a session cookie minted from SECRET_KEY,
+so no password is needed. The buyer catalog is rate limited per user, so
+benchmark the order or review pages. Raise `ulimit -n` above the
+connection count first. Linux only (memory is read from /proc).
+
+Usage (from the repository root):
+    python benchmarks/bench_async.py --path /buyer/orders --user-id 3 --connections 1000
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from app import create_app
+
+
+def session_cookie(user_id, role):
+    app = create_app()
+    serializer = app.session_interface.get_signing_serializer(app)
+    return serializer.dumps({'user_id': user_id, 'role': role, 'name': 'Bench'})
+
+
+def server_command(mode, port, workers):
+    if mode == 'sync':
+        return ['gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+                '--workers', str(workers), 'app:create_app()']
+    return ['uvicorn', '--factory', 'asgi:create_asgi_app', '--host', '127.0.0.1', '--port', str(port),
+            '--workers', str(workers), '--log-level', 'warning', '--no-access-log']
+
+
+def tree_rss(pid):
+    """Resident memory in bytes of pid and all of its descendants."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, ()))
+        try:
+            with open(f'/proc/{current}/statm') as f:
+                total += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except OSError:
+            pass
+    return total
+
+
+async def read_response(reader):
+    """Read one HTTP/1.1 response; returns the status code."""
+    status = int((await reader.readline()).split()[1])
+    length = None
+    chunked = False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'transfer-encoding' and 'chunked' in value.lower():
+            chunked = True
+
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length:
+        await reader.readexactly(length)
+    return status
+
+
+async def client(port, request, deadline, stats):
+    reader = writer = None
+    while time.monotonic() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            start = time.perf_counter()
+            writer.write(request)
+            status = await read_response(reader)
+            stats['latencies'].append(time.perf_counter() - start)
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+            stats['errors'] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            await asyncio.sleep(0.05)
+    if writer is not None:
+        writer.close()
+
+
+async def load(port, request, connections, duration, server_pid):
+    stats = {'latencies': [], 'statuses': {}, 'errors': 0}
+    deadline = time.monotonic() + duration
+    tasks = [asyncio.create_task(client(port, request, deadline, stats)) for _ in range(connections)]
+
+    peak_rss = 0
+    while not all(task.done() for task in tasks):
+        peak_rss = max(peak_rss, tree_rss(server_pid))
+        await asyncio.sleep(0.5)
+    await asyncio.gather(*tasks)
+    return stats, peak_rss
+
+
+async def wait_ready(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'GET /ready HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+            status = await read_response(reader)
+            writer.close()
+            if status == 200:
+                return
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError('server did not become ready; is the database reachable?')
+
+
+def run(mode, args, request):
+    server = subprocess.Popen(server_command(mode, args.port, args.workers), cwd=ROOT)
+    try:
+        asyncio.run(wait_ready(args.port))
+        idle_rss = tree_rss(server.pid)
+        stats, peak_rss = asyncio.run(load(args.port, request, args.connections, args.duration, server.pid))
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+    latencies = sorted(stats['latencies'])
+    ok = stats['statuses'].get(200, 0)
+    p = lambda q: latencies[int(q * (len(latencies) - 1))] * 1000 if latencies else 0
+    per_1k = (peak_rss - idle_rss) / args.connections * 1000 / 2 ** 20
+    print(f'{mode:<6} {ok / args.duration:9.1f} req/s  p50 {p(0.5):7.1f}ms  p99 {p(0.99):7.1f}ms  '
+          f'rss idle {idle_rss / 2 ** 20:6.1f}MB peak {peak_rss / 2 ** 20:6.1f}MB  '
+          f'+{per_1k:.1f}MB per 1k conns  statuses {stats["statuses"]} errors {stats["errors"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', default='/buyer/orders')
+    parser.add_argument('--user-id', type=int, required=True)
+    parser.add_argument('--role', default='BUYER', choices=['BUYER', 'FARMER'])
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--modes', default='sync,async')
+    args = parser.parse_args()
+
+    cookie = session_cookie(args.user_id, args.role)
+    request = (f'GET {args.path} HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: gzip\r\n'
+               f'Cookie: session={cookie}\r\n\r\n').encode('latin-1')
+
+    print(f'{args.connections} connections, {args.workers} workers, GET {args.path} for {args.duration:.0f}s')
+    for mode in args.modes.split(','):
+        run(mode, args, request)
+
+
+if __name__ == '__main__':
+    main()
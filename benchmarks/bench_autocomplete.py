@@ -0,0 +1,134 @@
+"""Lookup latency and memory of the autocomplete prefix index.
+
+Builds the index from a synthetic catalog of --products products spread
+over --farms farms, then times suggestions for every prefix of a set of
+queries: cold (first time a prefix is seen) and cached. Also times
+incremental product edits. No database is needed. With --db it instead
+compares against the `LIKE 'prefix%'` query the index replaces, on the
+database configured in config.py.
+
+Usage (from the repository root):
+    python benchmarks/bench_autocomplete.py --products 50000
+    python benchmarks/bench_autocomplete.py --db
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import autocomplete
+
+PRODUCE = ['Tomatoes', 'Cherry Tomatoes', 'Potatoes', 'Sweet Potatoes', 'Carrots', 'Onions', 'Red Onions',
+           'Garlic', 'Spinach', 'Kale', 'Lettuce', 'Cabbage', 'Broccoli', 'Cauliflower', 'Apples',
+           'Green Apples', 'Strawberries', 'Blueberries', 'Honey', 'Raw Honey', 'Eggs', 'Milk',
+           'Goat Cheese', 'Mangoes', 'Bananas', 'Okra', 'Peppers', 'Chillies', 'Pumpkin', 'Zucchini']
+VARIETIES = ['Organic', 'Heirloom', 'Fresh', 'Local', 'Premium', 'Farm', 'Seasonal', 'Baby', '']
+QUERIES = ['tomatoes', 'organic carrots', 'honey', 'green apples', 'sweet potatoes', 'farm 12', 'zucchini']
+
+
+def synthetic_catalog(products, farms):
+    rng = random.Random(1)
+    farm_rows = [(i, f'Farm {i} {rng.choice(["Acres", "Fields", "Orchard", "Gardens"])}',
+                  round(rng.uniform(0, 5), 1), rng.randint(0, 5000)) for i in range(1, farms + 1)]
+    product_rows = [(i, f'{rng.choice(VARIETIES)} {rng.choice(PRODUCE)} {i % 97}'.strip(),
+                     rng.randint(1, farms), round(rng.uniform(0, 5), 1)) for i in range(1, products + 1)]
+    return farm_rows, product_rows
+
+
+def time_lookups(index, prefixes):
+    timings = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        index.suggest(prefix)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1e6, timings[int(len(timings) * 0.99)] * 1e6, timings[-1] * 1e6
+
+
+def bench_memory(args):
+    farms, products = synthetic_catalog(args.products, args.farms)
+
+    # Memory is measured on a throwaway build, since tracing slows everything down
+    tracemalloc.start()
+    index = autocomplete.PrefixIndex()
+    index.load(farms, products)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del index
+
+    index = autocomplete.PrefixIndex()
+    start = time.perf_counter()
+    index.load(farms, products)
+    build = time.perf_counter() - start
+
+    # Keep the collector's first full pass over the new index out of the timings
+    gc.collect()
+
+    print(f'{len(index):,} entries built in {build * 1000:.0f}ms, {size / 2 ** 20:.1f}MB '
+          f'({size / len(index):.0f} bytes per entry)')
+
+    prefixes = [query[:end] for query in QUERIES for end in range(1, len(query) + 1)]
+    print(f'{"lookup":<20} {"p50":>9} {"p99":>9} {"max":>9}')
+    for label in ('cold', 'cached'):
+        p50, p99, worst = time_lookups(index, prefixes)
+        print(f'{label:<20} {p50:7.1f}us {p99:7.1f}us {worst:7.1f}us')
+
+    rng = random.Random(2)
+    start = time.perf_counter()
+    for _ in range(1000):
+        product_id, _, farmer_id, rating = rng.choice(products)
+        index.update_product(product_id, f'{rng.choice(PRODUCE)} {product_id}', farmer_id, rating)
+    print(f'{"edit product":<20} {(time.perf_counter() - start) * 1000:7.1f}us mean')
+
+    p50, p99, worst = time_lookups(index, prefixes)
+    print(f'{"after edits":<20} {p50:7.1f}us {p99:7.1f}us {worst:7.1f}us')
+
+
+def bench_db(args):
+    from db import get_db
+
+    db = get_db()
+    index = autocomplete.PrefixIndex()
+    index.rebuild(db)
+    cursor = db.cursor()
+    prefixes = [query[:end] for query in QUERIES for end in range(1, len(query) + 1)]
+
+    timings = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        cursor.execute("""
+            SELECT id, name FROM Product
+            WHERE isAvailable = TRUE AND stockQuantity > 0 AND name LIKE %s
+            ORDER BY averageRating DESC LIMIT 8
+        """, (prefix + '%',))
+        cursor.fetchall()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    cursor.close()
+    db.close()
+
+    print(f'{len(index):,} entries from the database')
+    print(f'LIKE query  p50 {timings[len(timings) // 2] * 1e6:9.1f}us')
+    print(f'index cold  p50 {time_lookups(index, prefixes)[0]:9.1f}us')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--farms', type=int, default=2000)
+    parser.add_argument('--db', action='store_true')
+    args = parser.parse_args()
+
+    if args.db:
+        bench_db(args)
+    else:
+        bench_memory(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""How much of the Farmer table a "farms near me" search reads.
+
+Without a database this places --farms synthetic farms across India and
+replays the radius search the way MySQL runs it: a range scan of the
+geohash index for each covering cell, then an exact distance check. It
+reports the index rows examined, the farms within radius and the time per
+search, against a full scan that checks the distance of every farm. With
+--db it times the real queries from geo.py against the database
+configured in config.py, which needs farms with saved locations.
+
+Usage (from the repository root):
+    python benchmarks/bench_geo.py --farms 100000
+    python benchmarks/bench_geo.py --db
+"""
+import argparse
+import bisect
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import geo
+
+# Rough bounding box of India
+LATITUDES = (8.0, 35.0)
+LONGITUDES = (68.0, 97.0)
+RADII_KM = (5, 10, 25, 50, 100)
+
+
+def synthetic_farms(count, rng):
+    farms = []
+    for farm_id in range(count):
+        latitude = rng.uniform(*LATITUDES)
+        longitude = rng.uniform(*LONGITUDES)
+        farms.append((geo.encode(latitude, longitude), latitude, longitude, farm_id))
+    farms.sort()
+    return farms
+
+
+def indexed_search(farms, hashes, latitude, longitude, radius_km):
+    examined = 0
+    found = []
+    for prefix in geo.covering_prefixes(latitude, longitude, radius_km):
+        start = bisect.bisect_left(hashes, prefix)
+        end = bisect.bisect_left(hashes, prefix + '~', start)
+        examined += end - start
+        for _, lat, lng, farm_id in farms[start:end]:
+            distance = geo.distance_km(latitude, longitude, lat, lng)
+            if distance <= radius_km:
+                found.append((distance, farm_id))
+    found.sort()
+    return examined, found
+
+
+def full_scan(farms, latitude, longitude, radius_km):
+    found = []
+    for _, lat, lng, farm_id in farms:
+        distance = geo.distance_km(latitude, longitude, lat, lng)
+        if distance <= radius_km:
+            found.append((distance, farm_id))
+    found.sort()
+    return found
+
+
+def bench_offline(args):
+    rng = random.Random(1)
+    farms = synthetic_farms(args.farms, rng)
+    hashes = [farm[0] for farm in farms]
+    queries = [(rng.uniform(*LATITUDES), rng.uniform(*LONGITUDES)) for _ in range(args.queries)]
+
+    print(f'{args.farms:,} farms, {args.queries} searches per radius')
+    print(f'{"radius":>7} {"cells":>6} {"examined":>9} {"found":>7} {"indexed":>10} {"full scan":>10}')
+    for radius_km in RADII_KM:
+        cells = examined = found = 0
+        indexed_time = 0.0
+        for latitude, longitude in queries:
+            start = time.perf_counter()
+            rows, matches = indexed_search(farms, hashes, latitude, longitude, radius_km)
+            indexed_time += time.perf_counter() - start
+            cells += len(geo.covering_prefixes(latitude, longitude, radius_km))
+            examined += rows
+            found += len(matches)
+
+        # The full scan is slow; a few searches are enough, and they check the index missed nothing
+        scan_time = 0.0
+        for latitude, longitude in queries[:5]:
+            start = time.perf_counter()
+            expected = full_scan(farms, latitude, longitude, radius_km)
+            scan_time += time.perf_counter() - start
+            assert expected == indexed_search(farms, hashes, latitude, longitude, radius_km)[1]
+
+        n = len(queries)
+        print(f'{radius_km:>5}km {cells / n:6.1f} {examined / n:9.0f} {found / n:7.1f} '
+              f'{indexed_time / n * 1000:8.2f}ms {scan_time / 5 * 1000:8.1f}ms')
+
+
+def bench_db(args):
+    from db import get_db
+    import dao
+
+    rng = random.Random(1)
+    db = get_db()
+    queries = [(rng.uniform(*LATITUDES), rng.uniform(*LONGITUDES)) for _ in range(args.queries)]
+    full_scan_sql = """
+        SELECT nf.id, ST_Distance_Sphere(POINT(nf.longitude, nf.latitude), POINT(%s, %s)) / 1000 as distance_km
+        FROM Farmer nf
+        WHERE nf.latitude IS NOT NULL
+        HAVING distance_km <= %s
+        ORDER BY distance_km
+        LIMIT %s
+    """
+
+    print(f'{"radius":>7} {"indexed":>10} {"full scan":>10}')
+    for radius_km in RADII_KM:
+        indexed_time = scan_time = 0.0
+        for latitude, longitude in queries:
+            start = time.perf_counter()
+            geo.farms_within(db, latitude, longitude, radius_km)
+            indexed_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            dao.fetch_all(db, geo.NearbyFarm, full_scan_sql, (longitude, latitude, radius_km, geo.MAX_FARMS))
+            scan_time += time.perf_counter() - start
+
+        n = len(queries)
+        print(f'{radius_km:>5}km {indexed_time / n * 1000:8.2f}ms {scan_time / n * 1000:8.2f}ms')
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--farms', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--db', action='store_true')
+    args = parser.parse_args()
+
+    if args.db:
+        bench_db(args)
+    else:
+        bench_offline(args)
+
+
+if __name__ == '__main__':
+    main()
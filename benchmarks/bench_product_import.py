@@ -0,0 +1,73 @@
+"""Benchmark the bulk CSV product import.
+
+Generates a synthetic price list and reports rows per second for parsing and
+validation alone and, with --farmer-id, for the full import into the
+database configured in db.py.
+
+Usage (from the repository root):
+    python benchmarks/bench_product_import.py --rows 100000
+    python benchmarks/bench_product_import.py --rows 100000 --farmer-id 1
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from product_import import import_products, read_rows, validate_row
+
+
+def make_csv(rows):
+    lines = ['name,description,price,stock,available']
+    for i in range(rows):
+        lines.append(f'Bench Product {i},Synthetic benchmark product {i},{10 + i % 500}.50,{i % 200},yes')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def bench_parse(data):
+    start = time.perf_counter()
+    valid = 0
+    for _, row, _ in read_rows(io.BytesIO(data)):
+        product, error = validate_row(row)
+        if product:
+            valid += 1
+    return valid, time.perf_counter() - start
+
+
+def bench_import(data, farmer_id, batch_size):
+    from db import get_db
+
+    db = get_db()
+    try:
+        start = time.perf_counter()
+        result = import_products(db, farmer_id, io.BytesIO(data), batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+    finally:
+        db.close()
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--farmer-id', type=int, help='run the full import for this Farmer.id')
+    args = parser.parse_args()
+
+    data = make_csv(args.rows)
+    print(f'CSV size: {len(data) / 1024 / 1024:.1f} MiB, {args.rows} rows')
+
+    valid, elapsed = bench_parse(data)
+    print(f'parse + validate: {valid} rows in {elapsed:.2f}s ({valid / elapsed:,.0f} rows/s)')
+
+    if args.farmer_id is not None:
+        result, elapsed = bench_import(data, args.farmer_id, args.batch_size)
+        total = result['inserted'] + result['updated']
+        print(f'full import (batch {args.batch_size}): {result["inserted"]} inserted, '
+              f'{result["updated"]} updated in {elapsed:.2f}s ({total / elapsed:,.0f} rows/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Compare dictionary-cursor rows with the namedtuple rows returned by dao.py.
+
+Without a database this measures memory and build time for a synthetic
+catalog of --rows products: the dicts a `SELECT p.*` dictionary cursor
+produced versus dao.CatalogRow. With --db it also times the buyer catalog
+query both ways against the database configured in db.py.
+
+Usage (from the repository root):
+    python benchmarks/bench_row_objects.py --rows 10000
+    python benchmarks/bench_row_objects.py --rows 10000 --db --iterations 200
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dao
+import shards
+
+# Columns of `SELECT p.*, u.name as farmer_name, f.rating as farmer_rating`
+DICT_COLUMNS = ('id', 'farmerId', 'name', 'description', 'price', 'stockQuantity', 'isAvailable',
+                'averageRating', 'createdAt', 'farmer_name', 'farmer_rating')
+
+OLD_CATALOG_SQL = """
+    SELECT p.*, u.name as farmer_name, f.rating as farmer_rating
+    FROM Product p
+    JOIN Farmer f ON p.farmerId = f.id
+    JOIN User u ON f.userId = u.id
+    WHERE p.isAvailable = TRUE AND p.stockQuantity > 0
+    ORDER BY p.createdAt DESC
+"""
+
+
+def synthetic_rows(rows):
+    now = datetime.now()
+    return [(i, i % 50, f'Product {i}', f'Fresh produce number {i}', 10.5 + i % 90, 5 + i % 100, 1,
+             4.2, now, f'Farmer {i % 50}', 4.5) for i in range(rows)]
+
+
+def measure(build, raw):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build(raw)
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+
+def build_dicts(raw):
+    return [dict(zip(DICT_COLUMNS, row)) for row in raw]
+
+
+def build_tuples(raw):
+    # Same values the slimmer catalog query selects
+    return [dao.CatalogRow._make((r[0], r[2], r[3], r[4], r[5], r[7], r[9], r[10], r[8])) for r in raw]
+
+
+def bench_db(iterations):
+    from db import get_db
+
+    db = get_db()
+    conns = shards.Connections(db)
+    cursor = db.cursor(dictionary=True)
+    try:
+        # Warm up both paths once (prepares the statement)
+        cursor.execute(OLD_CATALOG_SQL)
+        cursor.fetchall()
+        list(dao.available_products(conns))
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            cursor.execute(OLD_CATALOG_SQL)
+            cursor.fetchall()
+        dict_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            list(dao.available_products(conns))
+        dao_elapsed = time.perf_counter() - start
+    finally:
+        cursor.close()
+        conns.close()
+        db.close()
+    return dict_elapsed / iterations, dao_elapsed / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--db', action='store_true', help='also time the catalog query against MySQL')
+    parser.add_argument('--iterations', type=int, default=100)
+    args = parser.parse_args()
+
+    raw = synthetic_rows(args.rows)
+
+    _, dict_bytes, dict_time = measure(build_dicts, raw)
+    _, tuple_bytes, tuple_time = measure(build_tuples, raw)
+
+    print(f'{args.rows} catalog rows')
+    print(f'  dict rows:       {dict_bytes / 1024:8.0f} KiB  {dict_time * 1000:7.2f} ms')
+    print(f'  namedtuple rows: {tuple_bytes / 1024:8.0f} KiB  {tuple_time * 1000:7.2f} ms')
+    print(f'  saving:          {(1 - tuple_bytes / dict_bytes) * 100:7.1f} %')
+
+    if args.db:
+        dict_latency, dao_latency = bench_db(args.iterations)
+        print(f'catalog query over {args.iterations} runs')
+        print(f'  text protocol, dict cursor: {dict_latency * 1000:7.2f} ms/query')
+        print(f'  prepared, dao rows:         {dao_latency * 1000:7.2f} ms/query')
+
+
+if __name__ == '__main__':
+    main()
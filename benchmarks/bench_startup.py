@@ -0,0 +1,60 @@
+"""Measure cold start and first-request latency.
+
+Each mode runs in a fresh interpreter: import + create_app() time, then the
+first and a repeat request for each page that renders without a database
+(templates only). Modes:
+
+    lazy        templates compiled on first hit, no bytecode cache (old behaviour)
+    precompile  templates compiled in create_app(), empty bytecode cache
+    cached      templates compiled in create_app() from a warm bytecode cache
+
+Usage (from the repository root):
+    python benchmarks/bench_startup.py
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PAGES = ['/', '/login', '/register']
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from app import create_app
+app = create_app()
+startup = time.perf_counter() - start
+client = app.test_client()
+pages = {}
+for page in %r:
+    t = time.perf_counter(); client.get(page); first = time.perf_counter() - t
+    t = time.perf_counter(); client.get(page); repeat = time.perf_counter() - t
+    pages[page] = (first, repeat)
+print(json.dumps({'startup': startup, 'pages': pages}))
+""" % (PAGES,)
+
+
+def run(precompile, cache_dir):
+    env = dict(os.environ, PRECOMPILE_TEMPLATES='1' if precompile else '0', TEMPLATE_CACHE_DIR=cache_dir)
+    out = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        results = [('lazy', run(False, '')),
+                   ('precompile', run(True, cache_dir)),
+                   ('cached', run(True, cache_dir))]
+
+    print(f'{"mode":<12} {"startup":>9}  ' + '  '.join(f'{p + " 1st/2nd":>18}' for p in PAGES))
+    for name, result in results:
+        cells = '  '.join(f'{first * 1000:8.2f}/{repeat * 1000:.2f}ms'.rjust(18)
+                          for first, repeat in (result['pages'][p] for p in PAGES))
+        print(f'{name:<12} {result["startup"] * 1000:7.1f}ms  {cells}')
+
+
+if __name__ == '__main__':
+    main()
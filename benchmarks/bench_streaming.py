@@ -0,0 +1,79 @@
+"""Time-to-first-byte and bytes on the wire for the buyer catalog page.
+
+Renders buyer_dashboard.html for a synthetic catalog (default 10k
+products) three ways: the old buffered render_template, the streamed page
+uncompressed, and the streamed page with gzip (and brotli, if installed).
+No database is needed; rows come from a generator as they would from dao.
+
+Usage (from the repository root):
+    python benchmarks/bench_streaming.py --products 10000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import render_template, session
+
+import dao
+import streaming
+from app import create_app
+
+app = create_app()
+
+
+def catalog(products):
+    now = datetime.now()
+    for i in range(products):
+        yield dao.CatalogRow(i, f'Product {i}', f'Fresh produce number {i} from a local farm',
+                             10.5 + i % 90, 5 + i % 100, 4.2 if i % 3 else None, f'Farmer {i % 50}', 4.5, now)
+
+
+def bench_buffered(products):
+    with app.test_request_context('/buyer/dashboard'):
+        session.update(user_id=1, name='Bench', role='BUYER')
+        start = time.perf_counter()
+        body = render_template('buyer_dashboard.html', products=list(catalog(products))).encode('utf-8')
+        elapsed = time.perf_counter() - start
+    # Nothing can be sent until the whole page is rendered
+    return elapsed, elapsed, len(body)
+
+
+def bench_streamed(products, accept_encoding):
+    headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+    with app.test_request_context('/buyer/dashboard', headers=headers):
+        session.update(user_id=1, name='Bench', role='BUYER')
+        start = time.perf_counter()
+        response = streaming.stream_page('buyer_dashboard.html', products=catalog(products))
+        ttfb = None
+        size = 0
+        for chunk in response.response:
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            size += len(chunk)
+        elapsed = time.perf_counter() - start
+    return ttfb, elapsed, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=10000)
+    args = parser.parse_args()
+
+    results = [('buffered, identity', bench_buffered(args.products)),
+               ('streamed, identity', bench_streamed(args.products, None)),
+               ('streamed, gzip', bench_streamed(args.products, 'gzip'))]
+    if streaming.brotli is not None:
+        results.append(('streamed, br', bench_streamed(args.products, 'br')))
+
+    print(f'buyer_dashboard with {args.products} products')
+    print(f'  {"mode":<20} {"TTFB":>10} {"total":>10} {"bytes":>12}')
+    for name, (ttfb, total, size) in results:
+        print(f'  {name:<20} {ttfb * 1000:8.1f}ms {total * 1000:8.1f}ms {size:>12,}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class Config:
+    """Settings read from the environment; defaults suit local development."""
+
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-here')
+
+    DB_HOST = os.environ.get('DB_HOST', '127.0.0.1')
+    DB_PORT = int(os.environ.get('DB_PORT', 3306))
+    DB_USER = os.environ.get('DB_USER', 'root')
+    DB_PASSWORD = os.environ.get('DB_PASSWORD', 'nisht')
+    DB_NAME = os.environ.get('DB_NAME', 'marketplacedb2')
+    DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', 5))
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    # Admission control (admission.py): requests holding a DB connection at
+    # once, kept below DB_POOL_SIZE, then how many may queue and for how long
+    DB_CONCURRENCY = int(os.environ.get('DB_CONCURRENCY', 8))
+    DB_QUEUE_DEPTH = int(os.environ.get('DB_QUEUE_DEPTH', 32))
+    DB_QUEUE_TIMEOUT = float(os.environ.get('DB_QUEUE_TIMEOUT', 2.0))
+    # Extra databases holding farmer-owned data (see shards.py), comma separated
+    # [user[:password]@]host[:port][/database]; unset means one database
+    SHARD_DSNS = [dsn.strip() for dsn in os.environ.get('SHARD_DSNS', '').split(',') if dsn.strip()]
+    # Threads per gunicorn worker (gunicorn.conf.py)
+    THREADS = int(os.environ.get('THREADS', 4))
+    # Live order streams per worker. Each holds a thread for up to five
+    # minutes, so they must leave some of THREADS free for page requests
+    MAX_STREAMS = int(os.environ.get('MAX_STREAMS', max(THREADS - 2, 0)))
+    # Connections per worker for the async serving mode (asgi.py)
+    ASYNC_DB_POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE', 20))
+
+    # Compiled templates are cached here so new workers skip Jinja compilation
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR',
+                                        os.path.join(tempfile.gettempdir(), 'marketplace-templates'))
+    PRECOMPILE_TEMPLATES = _env_bool('PRECOMPILE_TEMPLATES', True)
@@ -0,0 +1,270 @@
+"""Data access for the hot read paths: catalog, cart, orders and reviews.
+
+Each query selects only the columns its template uses and returns rows as
+namedtuples, which are tuple-backed and much smaller than the dicts
+returned by dictionary cursors. Statements run as server-side prepared
+statements: one prepared cursor per statement is cached on each pooled
+connection, so a statement is parsed by MySQL once per connection rather
+than on every request.
+
+The catalog and order history queries return iterators that fetch rows in
+batches while a streamed page renders (see streaming.py) instead of
+materialising every row first.
+
+The SQL strings below must be module constants. The connector only skips
+re-preparing when it is given the very same string object again.
+
+Functions taking conns (a shards.Connections) read from every shard and
+combine the results, in the order the single-shard query would return.
+"""
+from collections import namedtuple
+from operator import attrgetter
+
+import shards
+from archive import union_archive
+
+CatalogRow = namedtuple('CatalogRow', [
+    'id', 'name', 'description', 'price', 'stockQuantity', 'averageRating', 'farmer_name', 'farmer_rating',
+    'createdAt'
+])
+# Catalog row from a "farms near me" search (see geo.py)
+NearbyCatalogRow = namedtuple('NearbyCatalogRow', CatalogRow._fields + ('distance_km',))
+CartRow = namedtuple('CartRow', ['id', 'name', 'price', 'quantity', 'stockQuantity', 'farmer_name'])
+CheckoutRow = namedtuple('CheckoutRow', [
+    'id', 'productId', 'quantity', 'product_name', 'price', 'stockQuantity', 'farmerId'
+])
+FarmerOrderRow = namedtuple('FarmerOrderRow', [
+    'order_item_id', 'orderId', 'quantity', 'price', 'deliveryStatus', 'deliveredAt', 'product_name',
+    'order_date', 'deliveryAddress', 'buyer_name', 'buyer_email', 'buyer_phone'
+])
+BuyerOrderRow = namedtuple('BuyerOrderRow', [
+    'order_id', 'order_date', 'totalAmount', 'deliveryAddress', 'order_item_id', 'quantity', 'price',
+    'deliveryStatus', 'deliveredAt', 'product_id', 'product_name', 'farmer_name'
+])
+ProductRow = namedtuple('ProductRow', ['id', 'name', 'price', 'stockQuantity', 'averageRating', 'farmer_name'])
+ReviewRow = namedtuple('ReviewRow', ['rating', 'title', 'comment', 'isVerifiedPurchase', 'createdAt', 'reviewer_name'])
+ReviewStats = namedtuple('ReviewStats', [
+    'total_reviews', 'avg_rating', 'five_star', 'four_star', 'three_star', 'two_star', 'one_star'
+])
+
+CATALOG_SQL = """
+    SELECT p.id, p.name, p.description, p.price, p.stockQuantity, p.averageRating,
+           u.name as farmer_name, f.rating as farmer_rating, p.createdAt
+    FROM Product p
+    JOIN Farmer f ON p.farmerId = f.id
+    JOIN User u ON f.userId = u.id
+    WHERE p.isAvailable = TRUE AND p.stockQuantity > 0
+    ORDER BY p.createdAt DESC
+"""
+
+CART_SQL = """
+    SELECT c.id, p.name, p.price, c.quantity, p.stockQuantity, u.name as farmer_name
+    FROM Cart c
+    JOIN Product p ON c.productId = p.id
+    JOIN User u ON p.farmerId = u.id
+    WHERE c.userId = %s
+"""
+
+CHECKOUT_SQL = """
+    SELECT c.id, c.productId, c.quantity, p.name as product_name, p.price, p.stockQuantity, p.farmerId
+    FROM Cart c
+    JOIN Product p ON c.productId = p.id
+    WHERE c.userId = %s
+"""
+
+FARMER_ORDERS_SQL = union_archive("""
+    SELECT
+        oi.id as order_item_id,
+        oi.orderId,
+        oi.quantity,
+        oi.price,
+        oi.deliveryStatus,
+        oi.deliveredAt,
+        p.name as product_name,
+        o.createdAt as order_date,
+        o.deliveryAddress,
+        u.name as buyer_name,
+        u.email as buyer_email,
+        u.phone as buyer_phone
+    FROM {OrderItem} oi
+    JOIN Product p ON oi.productId = p.id
+    JOIN {Order} o ON oi.orderId = o.id
+    JOIN User u ON o.userId = u.id
+    WHERE p.farmerId = %s
+""", "ORDER BY order_date DESC, order_item_id ASC")
+
+BUYER_ORDERS_SQL = union_archive("""
+    SELECT
+        o.id as order_id,
+        o.createdAt as order_date,
+        o.totalAmount,
+        o.deliveryAddress,
+        oi.id as order_item_id,
+        oi.quantity,
+        oi.price,
+        oi.deliveryStatus,
+        oi.deliveredAt,
+        p.id as product_id,
+        p.name as product_name,
+        u.name as farmer_name
+    FROM {Order} o
+    JOIN {OrderItem} oi ON o.id = oi.orderId
+    JOIN Product p ON oi.productId = p.id
+    JOIN User u ON p.farmerId = u.id
+    WHERE o.userId = %s
+""", "ORDER BY order_date DESC, order_id DESC, order_item_id ASC")
+
+PRODUCT_SQL = """
+    SELECT p.id, p.name, p.price, p.stockQuantity, p.averageRating, u.name as farmer_name
+    FROM Product p
+    JOIN User u ON p.farmerId = u.id
+    WHERE p.id = %s
+"""
+
+REVIEWS_SQL = """
+    SELECT r.rating, r.title, r.comment, r.isVerifiedPurchase, r.createdAt, u.name as reviewer_name
+    FROM Review r
+    JOIN User u ON r.reviewerId = u.id
+    WHERE r.productId = %s
+    ORDER BY r.createdAt DESC
+"""
+
+FARMER_ID_SQL = "SELECT id FROM Farmer WHERE userId = %s"
+
+HAS_PURCHASED_SQL = union_archive("""
+    SELECT oi.id FROM {OrderItem} oi
+    JOIN {Order} o ON o.id = oi.orderId
+    WHERE oi.productId = %s AND o.userId = %s
+""", "LIMIT 1")
+
+HAS_REVIEWED_SQL = """
+    SELECT COUNT(*) FROM Review
+    WHERE productId = %s AND reviewerId = %s
+"""
+
+REVIEW_STATS_SQL = """
+    SELECT
+        COUNT(*) as total_reviews,
+        AVG(rating) as avg_rating,
+        SUM(CASE WHEN rating = 5 THEN 1 ELSE 0 END) as five_star,
+        SUM(CASE WHEN rating = 4 THEN 1 ELSE 0 END) as four_star,
+        SUM(CASE WHEN rating = 3 THEN 1 ELSE 0 END) as three_star,
+        SUM(CASE WHEN rating = 2 THEN 1 ELSE 0 END) as two_star,
+        SUM(CASE WHEN rating = 1 THEN 1 ELSE 0 END) as one_star
+    FROM Review
+    WHERE productId = %s
+"""
+
+
+def _prepared_cursor(db, sql):
+    """Return this connection's prepared cursor for sql, creating it on first use."""
+    cnx = getattr(db, '_cnx', db)  # unwrap pooled connections
+    cache = getattr(cnx, '_prepared_cursors', None)
+    # A reconnect gets a new server session, which drops its prepared statements
+    if cache is None or cache[0] != cnx.connection_id:
+        cache = (cnx.connection_id, {})
+        cnx._prepared_cursors = cache
+
+    cursor = cache[1].get(sql)
+    if cursor is None:
+        cursor = cnx.cursor(prepared=True)
+        cache[1][sql] = cursor
+    return cursor
+
+
+def fetch_all(db, row_type, sql, params=()):
+    cursor = _prepared_cursor(db, sql)
+    cursor.execute(sql, params)
+    return [row_type._make(row) for row in cursor.fetchall()]
+
+
+def fetch_one(db, row_type, sql, params=()):
+    rows = fetch_all(db, row_type, sql, params)
+    return rows[0] if rows else None
+
+
+def iter_rows(db, row_type, sql, params=(), batch_size=500):
+    """Execute now and return an iterator fetching rows batch_size at a time.
+
+    Nothing else may run on db until the iterator is exhausted or closed.
+    """
+    cursor = _prepared_cursor(db, sql)
+    cursor.execute(sql, params)
+
+    def rows():
+        finished = False
+        try:
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    finished = True
+                    return
+                for row in batch:
+                    yield row_type._make(row)
+        finally:
+            # Drain what's left if the client went away, so the connection is reusable
+            if not finished:
+                cursor.fetchall()
+
+    return rows()
+
+
+def fetch_value(db, sql, params=()):
+    """First column of the first row, or None."""
+    cursor = _prepared_cursor(db, sql)
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    return rows[0][0] if rows else None
+
+
+def buyer_order_key(row):
+    """Sort key of BUYER_ORDERS_SQL, for merging shards' results in reverse."""
+    return row.order_date, row.order_id, -row.order_item_id
+
+
+def available_products(conns):
+    """Catalog rows from every shard, newest first."""
+    return shards.merge([iter_rows(db, CatalogRow, CATALOG_SQL) for _, db in conns.each()],
+                        key=attrgetter('createdAt'), reverse=True)
+
+
+def cart_items(conns, user_id):
+    return [row for _, db in conns.each() for row in fetch_all(db, CartRow, CART_SQL, (user_id,))]
+
+
+def checkout_items(conns, user_id):
+    return [row for _, db in conns.each() for row in fetch_all(db, CheckoutRow, CHECKOUT_SQL, (user_id,))]
+
+
+def farmer_id(db, user_id):
+    return fetch_value(db, FARMER_ID_SQL, (user_id,))
+
+
+def farmer_order_items(db, farmer_id):
+    return iter_rows(db, FarmerOrderRow, FARMER_ORDERS_SQL, (farmer_id, farmer_id))
+
+
+def buyer_order_items(conns, user_id):
+    """Order items from every shard, newest order first, with each order's items adjacent."""
+    return shards.merge([iter_rows(db, BuyerOrderRow, BUYER_ORDERS_SQL, (user_id, user_id))
+                         for _, db in conns.each()], key=buyer_order_key, reverse=True)
+
+
+def product_detail(db, product_id):
+    return fetch_one(db, ProductRow, PRODUCT_SQL, (product_id,))
+
+
+def product_reviews(db, product_id):
+    return fetch_all(db, ReviewRow, REVIEWS_SQL, (product_id,))
+
+
+def review_stats(db, product_id):
+    return fetch_one(db, ReviewStats, REVIEW_STATS_SQL, (product_id,))
+
+
+def has_purchased(db, product_id, user_id):
+    return fetch_value(db, HAS_PURCHASED_SQL, (product_id, user_id, product_id, user_id)) is not None
+
+
+def has_reviewed(db, product_id, user_id):
+    return fetch_value(db, HAS_REVIEWED_SQL, (product_id, user_id)) > 0
@@ -0,0 +1,92 @@
+import mysql.connector
+from mysql.connector import pooling
+
+from config import Config
+
+# Database configuration, replaced by configure() when the app is created
+DB_CONFIG = {
+    'host': Config.DB_HOST,
+    'port': Config.DB_PORT,
+    'user': Config.DB_USER,
+    'password': Config.DB_PASSWORD,
+    'database': Config.DB_NAME,
+    'connection_timeout': Config.DB_CONNECT_TIMEOUT
+}
+
+# Connections are pooled so server-side prepared statements (see dao.py)
+# survive between requests. Sessions are not reset on return for the same
+# reason; get_db() rolls back any transaction a previous request left open
+# so reads never see a stale snapshot.
+POOL_SIZE = Config.DB_POOL_SIZE
+
+def parse_dsn(dsn, defaults):
+    """Settings for '[user[:password]@]host[:port][/database]', the rest taken from defaults."""
+    config = dict(defaults)
+    credentials, _, address = dsn.rpartition('@')
+    if credentials:
+        user, has_password, password = credentials.partition(':')
+        config['user'] = user
+        if has_password:
+            config['password'] = password
+    address, _, database = address.partition('/')
+    host, _, port = address.partition(':')
+    config['host'] = host
+    if port:
+        config['port'] = int(port)
+    if database:
+        config['database'] = database
+    return config
+
+# Shard 0 is the home database above; SHARD_DSNS adds the others (see shards.py)
+SHARD_CONFIGS = [DB_CONFIG] + [parse_dsn(dsn, DB_CONFIG) for dsn in Config.SHARD_DSNS]
+
+_pools = {}
+
+def configure(config):
+    """Apply DB settings from a Flask config mapping."""
+    global POOL_SIZE
+    DB_CONFIG.update({
+        'host': config['DB_HOST'],
+        'port': config['DB_PORT'],
+        'user': config['DB_USER'],
+        'password': config['DB_PASSWORD'],
+        'database': config['DB_NAME'],
+        'connection_timeout': config['DB_CONNECT_TIMEOUT']
+    })
+    SHARD_CONFIGS[1:] = [parse_dsn(dsn, DB_CONFIG) for dsn in config['SHARD_DSNS']]
+    POOL_SIZE = config['DB_POOL_SIZE']
+    reset_pool()
+
+def init_pool(shard=0):
+    """Create a shard's pool, opening all POOL_SIZE connections up front."""
+    pool = _pools.get(shard)
+    if pool is None:
+        name = 'marketplace' if shard == 0 else f'marketplace_shard{shard}'
+        pool = _pools[shard] = pooling.MySQLConnectionPool(pool_name=name, pool_size=POOL_SIZE,
+                                                           pool_reset_session=False, **SHARD_CONFIGS[shard])
+    return pool
+
+def reset_pool():
+    """Forget the pools, e.g. in a freshly forked worker; they are rebuilt on next use."""
+    _pools.clear()
+
+def close_db(db):
+    """Close a get_db() connection unless that was already done; safe to repeat.
+
+    Closing a pooled connection twice would hand it back to the pool twice.
+    """
+    if isinstance(db, pooling.PooledMySQLConnection):
+        if db._cnx is not None:
+            db.close()
+    elif db.is_connected():
+        db.close()
+
+def get_db(shard=0):
+    try:
+        db = init_pool(shard).get_connection()
+    except pooling.PoolError:
+        # Pool exhausted: fall back to a one-off connection
+        return mysql.connector.connect(**SHARD_CONFIGS[shard])
+    if db.in_transaction:
+        db.rollback()
+    return db
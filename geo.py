@@ -0,0 +1,253 @@
+"""Farm locations: "farms near me" searches and distance-based delivery fees.
+
+Farms store a latitude/longitude and its geohash, a base32 string whose
+prefixes name ever smaller grid cells. A radius search covers the circle's
+bounding box with the smallest cells that take at most MAX_CELLS prefixes.
+Only farms in those cells are read, through the geohash index, and
+MySQL's ST_Distance_Sphere trims them to the exact radius.
+
+Farms are found on the home shard, whose Farmer table lists every farm;
+their products are then read from every shard, each of which finds the
+same farms in its copy of Farmer.
+"""
+import math
+from collections import namedtuple
+from operator import attrgetter
+
+import dao
+import shards
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_LENGTH = 9  # cells of about 5m
+# Most geohash cells (index ranges) one search may read
+MAX_CELLS = 24
+# Matches the sphere ST_Distance_Sphere uses by default
+EARTH_RADIUS_KM = 6370.986
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Radius choices offered on the buyer dashboard
+RADIUS_OPTIONS_KM = (5, 10, 25, 50, 100)
+NEAREST_FARMS = 10
+# Most farms a radius search returns products for
+MAX_FARMS = 200
+# Radii tried in turn by a nearest-N search until enough farms are found
+SEARCH_RADII_KM = (5, 20, 50, 150, 500, 2000, 20100)
+
+DELIVERY_BASE_FEE = 20.0  # per farm delivering to the buyer
+DELIVERY_FEE_PER_KM = 1.5
+# Share of the subtotal charged when the buyer or a farm has no location
+FALLBACK_FEE_RATE = 0.10
+
+Location = namedtuple('Location', ['latitude', 'longitude'])
+NearbyFarm = namedtuple('NearbyFarm', ['id', 'distance_km'])
+
+BUYER_LOCATION_SQL = "SELECT latitude, longitude FROM Buyer WHERE userId = %s"
+FARM_LOCATION_SQL = "SELECT latitude, longitude FROM Farmer WHERE id = %s"
+
+# {cells} is filled in per number of covering cells by _query()
+NEARBY_FARMS_SQL = """
+    SELECT nf.id, ST_Distance_Sphere(POINT(nf.longitude, nf.latitude), POINT(%s, %s)) / 1000 as distance_km
+    FROM Farmer nf
+    WHERE {cells}
+    HAVING distance_km <= %s
+    ORDER BY distance_km
+    LIMIT %s
+"""
+
+NEARBY_CATALOG_SQL = """
+    SELECT p.id, p.name, p.description, p.price, p.stockQuantity, p.averageRating,
+           u.name as farmer_name, f.rating as farmer_rating, p.createdAt, near.distance_km
+    FROM (""" + NEARBY_FARMS_SQL + """) near
+    JOIN Farmer f ON f.id = near.id
+    JOIN Product p ON p.farmerId = f.id
+    JOIN User u ON f.userId = u.id
+    WHERE p.isAvailable = TRUE AND p.stockQuantity > 0
+    ORDER BY near.distance_km, p.createdAt DESC
+"""
+
+_queries = {}  # (template, cell count) -> SQL, so prepared statements are reused
+
+
+# ==================== GEOHASH ====================
+
+def encode(latitude, longitude, length=GEOHASH_LENGTH):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < length:
+        # Bits alternate between longitude and latitude, longitude first
+        bounds, value = (lng_range, longitude) if even else (lat_range, latitude)
+        mid = (bounds[0] + bounds[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            bounds[0] = mid
+        else:
+            bits = bits * 2
+            bounds[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def cell_size(length):
+    """(height, width) in degrees of a geohash cell of the given length."""
+    lat_bits = 5 * length // 2
+    lng_bits = 5 * length - lat_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def covering_prefixes(latitude, longitude, radius_km):
+    """Geohash prefixes whose cells together cover the circle, or None if
+    the circle is too large for any cell size to help.
+
+    Uses the longest prefixes (smallest cells) for which at most MAX_CELLS
+    cells cover the circle's bounding box.
+    """
+    lat_span = radius_km / KM_PER_DEGREE
+    lat_min = max(latitude - lat_span, -90.0)
+    lat_max = min(latitude + lat_span, 90.0)
+    # Degrees of longitude shrink towards the poles; size the box at its poleward edge
+    edge_scale = math.cos(math.radians(max(abs(lat_min), abs(lat_max))))
+    lng_span = radius_km / (KM_PER_DEGREE * edge_scale) if edge_scale > 1e-9 else 180.0
+    if lng_span >= 180.0:
+        lng_span = 180.0
+
+    for length in range(GEOHASH_LENGTH, 0, -1):
+        height, width = cell_size(length)
+        rows = range(int((lat_min + 90.0) // height), int((min(lat_max, 89.999999) + 90.0) // height) + 1)
+        first_column = math.floor((longitude - lng_span + 180.0) / width)
+        last_column = math.floor((longitude + lng_span + 180.0) / width)
+        columns = min(last_column - first_column + 1, round(360.0 / width))
+        if len(rows) * columns <= MAX_CELLS:
+            break
+    else:
+        return None
+
+    prefixes = set()
+    for row in rows:
+        cell_latitude = -90.0 + (row + 0.5) * height
+        for column in range(first_column, first_column + columns):
+            cell_longitude = (-180.0 + (column + 0.5) * width + 180.0) % 360.0 - 180.0
+            prefixes.add(encode(cell_latitude, cell_longitude, length))
+    return sorted(prefixes)
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance, as ST_Distance_Sphere computes it."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def parse_location(form):
+    """Location from latitude/longitude form fields; raises ValueError if invalid."""
+    try:
+        latitude = float(form['latitude'])
+        longitude = float(form['longitude'])
+    except (KeyError, ValueError):
+        raise ValueError('Please enter a latitude and longitude')
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('Latitude must be between -90 and 90 and longitude between -180 and 180')
+    return Location(latitude, longitude)
+
+
+# ==================== QUERIES ====================
+
+def _query(template, latitude, longitude, radius_km, limit):
+    """SQL and params for a nearby query built from template."""
+    prefixes = covering_prefixes(latitude, longitude, radius_km) or []
+    key = (template, len(prefixes))
+    sql = _queries.get(key)
+    if sql is None:
+        cells = ' OR '.join(['nf.geohash LIKE %s'] * len(prefixes)) if prefixes else 'nf.geohash IS NOT NULL'
+        sql = _queries[key] = template.format(cells='(' + cells + ')')
+    params = (longitude, latitude, *[prefix + '%' for prefix in prefixes], radius_km, limit)
+    return sql, params
+
+
+def nearby_farms_query(latitude, longitude, radius_km, limit=MAX_FARMS):
+    return _query(NEARBY_FARMS_SQL, latitude, longitude, radius_km, limit)
+
+
+def nearby_catalog_query(latitude, longitude, radius_km, limit=MAX_FARMS):
+    return _query(NEARBY_CATALOG_SQL, latitude, longitude, radius_km, limit)
+
+
+def buyer_location(db, user_id):
+    location = dao.fetch_one(db, Location, BUYER_LOCATION_SQL, (user_id,))
+    return location if location and location.latitude is not None else None
+
+
+def farms_within(db, latitude, longitude, radius_km, limit=MAX_FARMS):
+    """Farms within radius_km, nearest first."""
+    sql, params = nearby_farms_query(latitude, longitude, radius_km, limit)
+    return dao.fetch_all(db, NearbyFarm, sql, params)
+
+
+def nearest_radius(db, latitude, longitude, count):
+    """Smallest radius holding the nearest count farms (or every located farm)."""
+    for radius_km in SEARCH_RADII_KM:
+        farms = farms_within(db, latitude, longitude, radius_km, count)
+        if len(farms) >= count:
+            return farms[-1].distance_km
+    return SEARCH_RADII_KM[-1]
+
+
+def products_within(conns, latitude, longitude, radius_km, farm_limit=MAX_FARMS):
+    """Catalog rows from farms within radius_km, nearest farm first, fetched as they stream."""
+    sql, params = nearby_catalog_query(latitude, longitude, radius_km, farm_limit)
+    return shards.merge([dao.iter_rows(db, dao.NearbyCatalogRow, sql, params) for _, db in conns.each()],
+                        key=attrgetter('distance_km'))
+
+
+def products_near(conns, latitude, longitude, count=NEAREST_FARMS):
+    """Catalog rows from the nearest count farms."""
+    radius_km = nearest_radius(conns.home, latitude, longitude, count)
+    return products_within(conns, latitude, longitude, radius_km, count)
+
+
+# ==================== UPDATES AND FEES ====================
+
+def set_farm_location(cursor, farmer_id, location):
+    cursor.execute("""
+        UPDATE Farmer SET latitude = %s, longitude = %s, geohash = %s
+        WHERE id = %s
+    """, (location.latitude, location.longitude, encode(*location), farmer_id))
+
+
+def set_buyer_location(cursor, user_id, location):
+    cursor.execute("""
+        UPDATE Buyer SET latitude = %s, longitude = %s
+        WHERE userId = %s
+    """, (location.latitude, location.longitude, user_id))
+
+
+def fee_for_distances(distances_km, subtotal):
+    """One delivery from each farm, priced by distance; None for an unknown distance."""
+    if not distances_km or not subtotal:
+        return 0.0
+    if None in distances_km:
+        return round(subtotal * FALLBACK_FEE_RATE, 2)
+    return round(sum(DELIVERY_BASE_FEE + DELIVERY_FEE_PER_KM * km for km in distances_km), 2)
+
+
+def delivery_fee(db, user_id, farmer_ids, subtotal):
+    """Delivery fee for a cart holding products from farmer_ids."""
+    buyer = buyer_location(db, user_id)
+    distances = []
+    for farmer_id in set(farmer_ids):
+        farm = dao.fetch_one(db, Location, FARM_LOCATION_SQL, (farmer_id,))
+        if buyer is None or farm is None or farm.latitude is None:
+            distances.append(None)
+        else:
+            distances.append(distance_km(buyer.latitude, buyer.longitude, farm.latitude, farm.longitude))
+    return fee_for_distances(distances, subtotal)
@@ -0,0 +1,38 @@
+"""Gunicorn settings for production.
+
+    gunicorn -c gunicorn.conf.py 'app:create_app()'    # or app:app
+
+The app is loaded once in the master so templates are compiled before
+forking and shared copy-on-write. Each worker then drops any inherited DB
+state and opens its own warm pool before it accepts traffic; /ready turns
+green once that is done.
+
+Each open live order stream (order_events.py) holds one of a worker's
+THREADS for as long as the order page is open, up to MAX_STREAMS per
+worker, by default two threads fewer than THREADS. Threads are cheap in
+gthread workers: where farmers keep their order page open all day, raise
+THREADS (e.g. THREADS=16 gives 14 streams per worker) rather than workers.
+
+    THREADS=16 gunicorn -c gunicorn.conf.py 'app:create_app()'
+"""
+import multiprocessing
+import os
+
+from config import Config
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = Config.THREADS
+worker_class = 'gthread' if threads > 1 else 'sync'
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Sockets opened in the master must never be shared between workers
+    import db
+    db.reset_pool()
+
+
+def post_worker_init(worker):
+    from app import warm_up
+    warm_up(worker.wsgi)
@@ -0,0 +1,129 @@
+-- ============================
+-- ORDER HISTORY ARCHIVE
+-- ============================
+-- Cold order history is moved here by `python archive.py archive`.
+-- Archive tables carry no foreign keys so they can be partitioned by
+-- month (archiveMonth = YYYYMM the order was placed). Monthly partitions
+-- are split off p_future by `python archive.py partitions`.
+
+USE marketplacedb2;
+
+CREATE TABLE OrderArchive (
+    id INT NOT NULL,
+    userId INT NOT NULL,
+    totalAmount FLOAT NOT NULL,
+    deliveryAddress VARCHAR(500),
+    status VARCHAR(50),
+    createdAt DATETIME,
+    checkoutId INT,
+    archiveMonth INT NOT NULL,
+    PRIMARY KEY (id, archiveMonth),
+    KEY idx_orderarchive_user (userId, createdAt),
+    KEY idx_orderarchive_checkout (checkoutId)
+)
+PARTITION BY RANGE (archiveMonth) (
+    PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+CREATE TABLE OrderItemArchive (
+    id INT NOT NULL,
+    orderId INT NOT NULL,
+    productId INT NOT NULL,
+    quantity INT NOT NULL,
+    price FLOAT NOT NULL,
+    deliveryStatus ENUM('pending', 'shipped', 'delivered'),
+    deliveredAt DATETIME NULL,
+    archiveMonth INT NOT NULL,
+    PRIMARY KEY (id, archiveMonth),
+    KEY idx_orderitemarchive_order (orderId),
+    KEY idx_orderitemarchive_product (productId)
+)
+PARTITION BY RANGE (archiveMonth) (
+    PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+CREATE TABLE PayoutArchive (
+    id INT NOT NULL,
+    farmerId INT NOT NULL,
+    orderItemId INT NOT NULL,
+    amount FLOAT NOT NULL,
+    status ENUM('pending', 'transferred'),
+    createdAt DATETIME,
+    archiveMonth INT NOT NULL,
+    PRIMARY KEY (id, archiveMonth),
+    KEY idx_payoutarchive_farmer (farmerId, createdAt),
+    KEY idx_payoutarchive_orderitem (orderItemId)
+)
+PARTITION BY RANGE (archiveMonth) (
+    PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+CREATE TABLE PaymentArchive (
+    id INT NOT NULL,
+    checkoutId INT NOT NULL,
+    payerId INT NOT NULL,
+    amount FLOAT NOT NULL,
+    method VARCHAR(255),
+    status VARCHAR(50),
+    gatewayTransactionId VARCHAR(255),
+    paidAt DATETIME,
+    gatewayResponse JSON,
+    archiveMonth INT NOT NULL,
+    PRIMARY KEY (id, archiveMonth),
+    KEY idx_paymentarchive_checkout (checkoutId)
+)
+PARTITION BY RANGE (archiveMonth) (
+    PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+CREATE TABLE CheckoutArchive (
+    id INT NOT NULL,
+    customerId INT NOT NULL,
+    grandTotal FLOAT NOT NULL,
+    deliveryFee FLOAT,
+    createdAt DATETIME,
+    updatedAt DATETIME,
+    archiveMonth INT NOT NULL,
+    PRIMARY KEY (id, archiveMonth),
+    KEY idx_checkoutarchive_customer (customerId)
+)
+PARTITION BY RANGE (archiveMonth) (
+    PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+-- Indexes so the batched archive/purge scans stay cheap
+CREATE INDEX idx_order_createdAt ON `Order` (createdAt);
+CREATE INDEX idx_checkout_createdAt ON Checkout (createdAt);
+CREATE INDEX idx_cart_addedAt ON Cart (addedAt);
+
+-- Reviews may point at an order that has since been archived
+ALTER TABLE Review DROP FOREIGN KEY fk_review_order;
+
+-- A purchase counts as verified whether the order is hot or archived
+DROP TRIGGER IF EXISTS validate_review_purchase;
+
+DELIMITER $$
+
+CREATE TRIGGER validate_review_purchase
+BEFORE INSERT ON Review
+FOR EACH ROW
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 
+        FROM OrderItem oi
+        JOIN `Order` o ON oi.orderId = o.id
+        WHERE o.userId = NEW.reviewerId
+        AND oi.productId = NEW.productId
+    ) AND NOT EXISTS (
+        SELECT 1
+        FROM OrderItemArchive oi
+        JOIN OrderArchive o ON oi.orderId = o.id
+        WHERE o.userId = NEW.reviewerId
+        AND oi.productId = NEW.productId
+    ) THEN
+        SIGNAL SQLSTATE '45000'
+        SET MESSAGE_TEXT = 'Cannot review without verified purchase';
+    END IF;
+END$$
+
+DELIMITER ;
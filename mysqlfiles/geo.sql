@@ -0,0 +1,20 @@
+-- ============================
+-- FARM LOCATIONS
+-- ============================
+-- Farmers and buyers may store a latitude/longitude. geohash is the
+-- base32 geohash of that point (see geo.py); the B-tree index on it serves
+-- radius and nearest-farm searches as a few prefix range scans, and exact
+-- distances are then computed only for the farms in those cells.
+
+USE marketplacedb2;
+
+ALTER TABLE Farmer
+    ADD COLUMN latitude DOUBLE NULL,
+    ADD COLUMN longitude DOUBLE NULL,
+    ADD COLUMN geohash CHAR(9) NULL;
+
+CREATE INDEX idx_farmer_geohash ON Farmer (geohash);
+
+ALTER TABLE Buyer
+    ADD COLUMN latitude DOUBLE NULL,
+    ADD COLUMN longitude DOUBLE NULL;
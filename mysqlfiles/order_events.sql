@@ -0,0 +1,20 @@
+-- ============================
+-- ORDER CHANGE FEED
+-- ============================
+-- Appended to by process_payment and mark_as_delivered and read by the
+-- live order streams. No foreign keys so archival and purging stay cheap;
+-- old rows are removed by `python archive.py purge-events`.
+
+USE marketplacedb2;
+
+CREATE TABLE OrderEvent (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    orderItemId INT NOT NULL,
+    farmerId INT NOT NULL,
+    buyerId INT NOT NULL,
+    eventType ENUM('created', 'delivered') NOT NULL,
+    createdAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_orderevent_farmer (farmerId, id),
+    KEY idx_orderevent_buyer (buyerId, id),
+    KEY idx_orderevent_createdAt (createdAt)
+);
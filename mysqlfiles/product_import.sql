@@ -0,0 +1,8 @@
+-- ============================
+-- PRODUCT IMPORT
+-- ============================
+-- Bulk CSV import matches existing products on (farmerId, name).
+
+USE marketplacedb2;
+
+CREATE INDEX idx_product_farmer_name ON Product (farmerId, name);
@@ -0,0 +1,21 @@
+-- ============================
+-- SHARD DIRECTORY
+-- ============================
+-- Load into the home database only, before setting SHARD_DSNS. Records the
+-- shard holding each farmer's products and sales (see shards.py). Farmers
+-- already registered stay on the home shard, 0. The other shards get the
+-- full schema from the other files here and are then prepared by
+-- `python shards.py init`.
+
+USE marketplacedb2;
+
+CREATE TABLE FarmerShard (
+    farmerId INT PRIMARY KEY,
+    shardId TINYINT UNSIGNED NOT NULL,
+    assignedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_farmershard_shard (shardId),
+    CONSTRAINT fk_farmershard_farmer FOREIGN KEY (farmerId) REFERENCES Farmer(id)
+);
+
+INSERT INTO FarmerShard (farmerId, shardId)
+SELECT id, 0 FROM Farmer;
@@ -0,0 +1,254 @@
+"""Change feed and Server-Sent Events streams for order items.
+
+process_payment and mark_as_delivered append a row to OrderEvent in the same
+transaction as the change itself. Open farmer_orders / buyer_orders pages
+subscribe to an SSE stream that polls the feed by id, so each poll is a cheap
+index range scan instead of re-running the full order history join.
+
+AUTO_INCREMENT ids are handed out at insert, not at commit, so a feed row
+can become visible after rows with higher ids. Each poll therefore scans
+again from a position that trails the newest row by RESCAN_SECONDS and
+skips rows it has already sent. A row committing later than that after
+its insert is missed. The page drops rows sent twice after a reconnect by
+their event_id.
+
+Each shard has its own feed for the orders stored there (see shards.py). A
+farmer's stream polls the farmer's shard and a buyer's polls every shard;
+its position, sent as the SSE event id, holds the trailing id on each.
+
+Every poll takes a slot from the same DB limiter as page requests
+(admission.py), so a saturated database sheds polls too; a shed poll is
+skipped and retried after POLL_INTERVAL.
+"""
+import json
+import logging
+import threading
+import time
+
+import admission
+import shards
+from config import Config
+from db import get_db
+
+logger = logging.getLogger(__name__)
+
+# Per worker process; each open stream holds one thread. Set by configure()
+MAX_STREAMS = Config.MAX_STREAMS
+POLL_INTERVAL = 2
+HEARTBEAT_INTERVAL = 15
+# Streams end after this long and the browser reconnects with Last-Event-ID
+MAX_STREAM_SECONDS = 300
+BATCH_SIZE = 100
+# How long after a row is seen a row with a lower id may still commit
+RESCAN_SECONDS = 30
+
+_stream_slots = threading.BoundedSemaphore(MAX_STREAMS) if MAX_STREAMS else None
+
+# Counters for /metrics
+stats = {'open': 0, 'polls': 0, 'shed': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name, delta=1):
+    with _stats_lock:
+        stats[name] += delta
+
+
+def configure(config):
+    """Size the stream slots from a Flask config mapping.
+
+    At least one of the worker's THREADS is always left for page requests.
+    """
+    global MAX_STREAMS, _stream_slots
+    limit = max(min(config['MAX_STREAMS'], config['THREADS'] - 1), 0)
+    if limit < config['MAX_STREAMS']:
+        logger.warning('MAX_STREAMS=%s would take every one of THREADS=%s; using %s',
+                       config['MAX_STREAMS'], config['THREADS'], limit)
+    MAX_STREAMS = limit
+    _stream_slots = threading.BoundedSemaphore(limit) if limit else None
+
+
+def record_event(cursor, order_item_id, farmer_id, buyer_id, event_type):
+    """Append a change to the feed; call inside the transaction making the change."""
+    cursor.execute("""
+        INSERT INTO OrderEvent (orderItemId, farmerId, buyerId, eventType)
+        VALUES (%s, %s, %s, %s)
+    """, (order_item_id, farmer_id, buyer_id, event_type))
+
+
+def acquire_stream_slot():
+    """Reserve one of this worker's stream slots; False when all are taken."""
+    if _stream_slots is None or not _stream_slots.acquire(blocking=False):
+        return False
+    _count('open')
+    return True
+
+
+def release_stream_slot():
+    _count('open', -1)
+    _stream_slots.release()
+
+
+# column -> query for the position a farmer's/buyer's stream starts from:
+# the newest feed row older than the rescan window
+LATEST_EVENT_SQL = {
+    column: "SELECT COALESCE(MAX(id), 0) as last_id FROM OrderEvent WHERE " + column
+            + " = %s AND createdAt < NOW() - INTERVAL " + str(RESCAN_SECONDS) + " SECOND"
+    for column in ('farmerId', 'buyerId')
+}
+
+
+def latest_event_id(cursor, column, owner_id):
+    """Id a farmer's/buyer's stream starts after, for a page about to be rendered.
+
+    Rows in the rescan window are sent again; the page applies them idempotently.
+    """
+    cursor.execute(LATEST_EVENT_SQL[column], (owner_id,))
+    row = cursor.fetchone()
+    return row['last_id'] if isinstance(row, dict) else row[0]
+
+
+def format_position(positions):
+    """Stream position from {shard: event id}: the bare id when only home is followed."""
+    if list(positions) == [shards.HOME_SHARD]:
+        return str(positions[shards.HOME_SHARD])
+    return ','.join(f'{shard}:{last_id}' for shard, last_id in sorted(positions.items()))
+
+
+def parse_position(position):
+    """{shard: event id} from format_position(); raises ValueError if malformed."""
+    if ':' not in position:
+        return {shards.HOME_SHARD: int(position)}
+    positions = {}
+    for part in position.split(','):
+        shard, last_id = part.split(':')
+        positions[int(shard)] = int(last_id)
+    return positions
+
+
+def latest_positions(dbs, column, owner_id):
+    """{shard: latest_event_id()} of a farmer/buyer on each (shard, connection) in dbs."""
+    positions = {}
+    for shard, db in dbs:
+        cursor = db.cursor()
+        positions[shard] = latest_event_id(cursor, column, owner_id)
+        cursor.close()
+    return positions
+
+
+def _fetch_events(shard, column, owner_id, after_id):
+    db = get_db(shard)
+    cursor = db.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT
+            e.id as event_id,
+            e.eventType,
+            oi.id as order_item_id,
+            oi.orderId,
+            oi.quantity,
+            oi.price,
+            oi.deliveryStatus,
+            oi.deliveredAt,
+            p.name as product_name
+        FROM OrderEvent e
+        JOIN OrderItem oi ON e.orderItemId = oi.id
+        JOIN Product p ON oi.productId = p.id
+        WHERE e.""" + column + """ = %s AND e.id > %s
+        ORDER BY e.id
+        LIMIT %s
+    """, (owner_id, after_id, BATCH_SIZE))
+    events = cursor.fetchall()
+    cursor.close()
+    db.close()
+    return events
+
+
+def _format_event(event, position):
+    if event['deliveredAt']:
+        event['deliveredAt'] = event['deliveredAt'].strftime('%b %d, %Y')
+    return f"id: {position}\nevent: order_item\ndata: {json.dumps(event)}\n\n"
+
+
+def advance_position(position, sent, now):
+    """New position for one shard, given {event id: time sent} of rows sent after it.
+
+    Moves past rows sent RESCAN_SECONDS ago, as any lower id has committed
+    by then, and forgets them.
+    """
+    settled = [event_id for event_id, sent_at in sent.items() if now - sent_at >= RESCAN_SECONDS]
+    if settled:
+        position = max(position, *settled)
+        for event_id in [event_id for event_id in sent if event_id <= position]:
+            del sent[event_id]
+    return position
+
+
+def _poll(column, owner_id, positions, sent):
+    """SSE messages for rows after positions not yet sent; advances positions and sent."""
+    messages = []
+    for shard in positions:
+        # Page through everything after the position, the rescan window included
+        after_id = positions[shard]
+        while True:
+            events = _fetch_events(shard, column, owner_id, after_id)
+            for event in events:
+                after_id = event['event_id']
+                if after_id in sent[shard]:
+                    continue
+                sent[shard][after_id] = time.monotonic()
+                messages.append(_format_event(event, format_position(positions)))
+            if len(events) < BATCH_SIZE:
+                break
+        positions[shard] = advance_position(positions[shard], sent[shard], time.monotonic())
+    return messages
+
+
+def stream_events(column, owner_id, positions):
+    """Yield SSE messages for feed rows after positions ({shard: event id}).
+
+    column is 'farmerId' or 'buyerId'.
+    """
+    yield f"retry: {POLL_INTERVAL * 1000}\n\n"
+
+    sent = {shard: {} for shard in positions}  # shard -> {event id: time sent} past its position
+    started = time.monotonic()
+    last_sent = started
+    while time.monotonic() - started < MAX_STREAM_SECONDS:
+        messages = []
+        if admission.db_limiter.acquire():
+            _count('polls')
+            try:
+                messages = _poll(column, owner_id, positions, sent)
+            finally:
+                # Released before sending, so a slow client never holds a DB slot
+                admission.db_limiter.release()
+        else:
+            _count('shed')
+        yield from messages
+
+        now = time.monotonic()
+        if messages:
+            last_sent = now
+        elif now - last_sent >= HEARTBEAT_INTERVAL:
+            yield ": keep-alive\n\n"
+            last_sent = now
+
+        time.sleep(POLL_INTERVAL)
+
+
+def render_metrics():
+    """Stream counters in Prometheus text exposition format."""
+    return '\n'.join([
+        '# HELP marketplace_streams_open Live order streams currently open.',
+        '# TYPE marketplace_streams_open gauge',
+        f'marketplace_streams_open {stats["open"]}',
+        '# HELP marketplace_streams_limit Configured live order streams per worker.',
+        '# TYPE marketplace_streams_limit gauge',
+        f'marketplace_streams_limit {MAX_STREAMS}',
+        '# HELP marketplace_stream_polls_total Change feed polls admitted to DB work.',
+        '# TYPE marketplace_stream_polls_total counter',
+        f'marketplace_stream_polls_total {stats["polls"]}',
+        '# HELP marketplace_stream_polls_shed_total Change feed polls skipped by the DB limiter.',
+        '# TYPE marketplace_stream_polls_shed_total counter',
+        f'marketplace_stream_polls_shed_total {stats["shed"]}',
+    ]) + '\n'
@@ -0,0 +1,192 @@
+"""Bulk CSV product import for farmers.
+
+The upload is read row by row straight from the request stream, validated,
+and written in chunks: each chunk is one short transaction that looks up
+which product names the farmer already has, then runs one executemany
+UPDATE and one executemany INSERT.
+
+Expected columns (header row required): name, description, price, stock,
+and optionally available (1/0, yes/no, true/false; defaults to yes).
+
+Lines that aren't valid UTF-8 or CSV are reported like invalid rows. If
+writing a chunk fails, the import stops there: chunks already written stay
+committed and the result says at which line it stopped.
+"""
+import csv
+import io
+import re
+import unicodedata
+
+REQUIRED_COLUMNS = ('name', 'price', 'stock')
+TRUE_VALUES = ('1', 'yes', 'y', 'true')
+FALSE_VALUES = ('0', 'no', 'n', 'false')
+MAX_NAME_LENGTH = 255
+
+# Bytes that aren't valid UTF-8 are decoded to lone surrogates in this range
+_UNDECODABLE = re.compile('[\udc80-\udcff]')
+
+
+def read_rows(stream):
+    """Yield (line_number, row, error) from a binary CSV stream without loading it.
+
+    row is None when the line couldn't be decoded or parsed, and error says why.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='surrogateescape', newline='')
+    reader = csv.DictReader(text)
+
+    try:
+        fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+    except csv.Error as e:
+        raise ValueError(f'Could not read the header row: {e}')
+    if any(_UNDECODABLE.search(name) for name in fieldnames):
+        raise ValueError('The file is not UTF-8 encoded')
+    missing = [column for column in REQUIRED_COLUMNS if column not in fieldnames]
+    if missing:
+        raise ValueError('Missing required column(s): ' + ', '.join(missing))
+    reader.fieldnames = fieldnames
+
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            # The reader starts afresh on the next line
+            yield reader.line_num, None, f'Could not parse line: {e}'
+            continue
+        if any(isinstance(value, str) and _UNDECODABLE.search(value) for value in row.values()):
+            yield reader.line_num, None, 'Line is not valid UTF-8'
+            continue
+        yield reader.line_num, row, None
+
+
+def validate_row(row):
+    """Return (product, error) where product is (name, description, price, stock, available)."""
+    name = (row.get('name') or '').strip()
+    if not name:
+        return None, 'Product name is required'
+    if len(name) > MAX_NAME_LENGTH:
+        return None, f'Product name is longer than {MAX_NAME_LENGTH} characters'
+
+    try:
+        price = float(row.get('price'))
+        if price < 0:
+            raise ValueError()
+    except (TypeError, ValueError):
+        return None, f'Invalid price: {row.get("price")!r}'
+
+    try:
+        stock = int(row.get('stock'))
+        if stock < 0:
+            raise ValueError()
+    except (TypeError, ValueError):
+        return None, f'Invalid stock quantity: {row.get("stock")!r}'
+
+    available_raw = (row.get('available') or 'yes').strip().lower()
+    if available_raw in TRUE_VALUES:
+        available = stock > 0
+    elif available_raw in FALSE_VALUES:
+        available = False
+    else:
+        return None, f'Invalid available value: {row.get("available")!r}'
+
+    description = (row.get('description') or '').strip()
+    return (name, description, price, stock, available), None
+
+
+def name_key(name):
+    """Names that are the same product: case and accents are ignored, as by
+    the accent- and case-insensitive collation of Product.name."""
+    decomposed = unicodedata.normalize('NFKD', name.casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def _write_chunk(db, farmer_id, chunk):
+    """Insert or update one chunk of products in a single transaction."""
+    cursor = db.cursor()
+    try:
+        products = list(chunk.values())
+        names = [product[0] for product in products]
+        placeholders = ', '.join(['%s'] * len(names))
+        # MySQL matches the names under the column's collation, and FIELD()
+        # says which of ours each existing product matched
+        cursor.execute("""
+            SELECT id, FIELD(name, """ + placeholders + """) FROM Product
+            WHERE farmerId = %s AND name IN (""" + placeholders + ")",
+                       names + [farmer_id] + names)
+        existing = {position - 1: product_id for product_id, position in cursor.fetchall()}
+
+        updates = []
+        inserts = []
+        for position, (name, description, price, stock, available) in enumerate(products):
+            if position in existing:
+                updates.append((description, price, stock, available, existing[position]))
+            else:
+                inserts.append((farmer_id, name, description, price, stock, available))
+
+        if updates:
+            cursor.executemany("""
+                UPDATE Product
+                SET description=%s, price=%s, stockQuantity=%s, isAvailable=%s
+                WHERE id=%s
+            """, updates)
+        if inserts:
+            cursor.executemany("""
+                INSERT INTO Product (farmerId, name, description, price, stockQuantity, isAvailable)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, inserts)
+
+        db.commit()
+        return len(inserts), len(updates)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def import_products(db, farmer_id, stream, batch_size=500):
+    """Import a CSV stream for one farmer.
+
+    Returns a dict with inserted/updated counts, a list of
+    {'line': n, 'name': ..., 'error': ...} entries for rejected rows, and
+    'stopped': None, or {'line': n, 'error': ...} when a failure ended the
+    import with nothing from line n on saved.
+    Products are matched on (farmerId, name), ignoring case and accents as
+    the column's collation does; a name repeated within the file keeps its
+    last row.
+    """
+    result = {'inserted': 0, 'updated': 0, 'errors': [], 'stopped': None}
+    chunk = {}
+    chunk_start = line = None
+
+    def flush():
+        if chunk:
+            inserted, updated = _write_chunk(db, farmer_id, chunk)
+            result['inserted'] += inserted
+            result['updated'] += updated
+            chunk.clear()
+
+    try:
+        for line, row, error in read_rows(stream):
+            product = None
+            if not error:
+                product, error = validate_row(row)
+            if error:
+                result['errors'].append({'line': line, 'name': row and row.get('name'), 'error': error})
+                continue
+
+            key = name_key(product[0])
+            if key not in chunk and len(chunk) >= batch_size:
+                flush()
+            if not chunk:
+                chunk_start = line
+            chunk[key] = product
+
+        flush()
+    except Exception as e:
+        if line is None:
+            raise  # failed on the header row, before anything was imported
+        # Earlier chunks are committed; nothing from the unwritten chunk or the failing line on is
+        result['stopped'] = {'line': chunk_start if chunk else line + 1, 'error': str(e)}
+    return result
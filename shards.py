@@ -0,0 +1,492 @@
+"""Horizontal sharding of farmer-owned data.
+
+Each farmer is placed on one shard, a MySQL database with the full schema,
+and everything about the farmer's products lives there: the Product rows,
+their Cart lines and Reviews, and the Order, OrderItem, Payout and
+OrderEvent rows of their sales. Shard 0 is the home database (the DB_*
+settings). It also keeps Checkout and Payment, and the FarmerShard
+directory recording which shard each farmer is on. User, Farmer and Buyer
+are reference tables, copied from home to every shard so queries there
+join them as before.
+
+Every shard allocates ids for its tables from its own block of
+2**SHARD_ID_BITS, so a product, cart line or order item id names its shard
+and routing by id needs no lookup. Farmers are routed through the
+directory, cached per process. A farmer is placed once, when they
+register, on the shard with the fewest farmers; farmers who registered
+before sharding stay on home.
+
+A checkout spanning shards writes one order per shard. The order on each
+other shard is an XA transaction branch, prepared before the payment is
+committed on home and committed after it, so the payment row decides the
+outcome. `python shards.py recover` commits branches a crash left prepared
+if their payment exists and rolls back the rest.
+
+With SHARD_DSNS unset there is only the home shard. The directory is then
+never read and every query runs on the home database as before.
+
+Trying it with several local MySQL instances:
+    1. Start MySQL on ports 3306 (home), 3307 and 3308, e.g.
+           docker run -d -p 3307:3306 -e MYSQL_ROOT_PASSWORD=nisht mysql:8.0
+       and load every file in mysqlfiles/ into each, in the order they
+       were added.
+    2. Load mysqlfiles/shards.sql into the home database only.
+    3. export SHARD_DSNS=127.0.0.1:3307,127.0.0.1:3308
+    4. python shards.py init
+    5. python app.py, register a few farmers, and check where their data
+       went with `python shards.py status`.
+tests/test_sharded_checkout.py scripts the rest: it registers farmers on
+two shards, checks out a cart holding both and recovers prepared branches.
+Run it on throwaway databases with MARKETPLACE_SHARD_TEST=1 after step 3.
+
+Usage:
+    python shards.py init
+    python shards.py sync-reference
+    python shards.py recover --grace 60
+    python shards.py status
+"""
+import argparse
+import heapq
+import logging
+import time
+
+import db as database
+
+logger = logging.getLogger(__name__)
+
+HOME_SHARD = 0
+# Shard n allocates ids from n << SHARD_ID_BITS, which leaves 16 shards of
+# 134M rows each in a signed INT column
+SHARD_ID_BITS = 27
+MAX_SHARDS = 16
+# Tables whose rows live on their farmer's shard, with ids from its block
+SHARDED_TABLES = ['Product', 'Cart', 'Review', '`Order`', 'OrderItem', 'Payout', 'OrderEvent']
+# Tables copied from home to every shard, with the column naming one user's rows
+REFERENCE_TABLES = [('User', 'id'), ('Farmer', 'userId'), ('Buyer', 'userId')]
+# Reference columns maintained by triggers on the farmer's own shard, which a copy must not overwrite
+SHARD_OWNED_COLUMNS = {'Farmer': ('totalSales',)}
+# XA transaction ids of checkout branches are XID_PREFIX + the checkout id
+XID_PREFIX = 'checkout-'
+
+FARMER_SHARD_SQL = "SELECT shardId FROM FarmerShard WHERE farmerId = %s"
+
+_farmer_shards = {}  # farmer id -> shard, filled from the directory
+
+
+def count():
+    return len(database.SHARD_CONFIGS)
+
+
+def enabled():
+    return count() > 1
+
+
+def all_shards():
+    return range(count())
+
+
+def shard_for_id(row_id):
+    """Shard holding the Product, Cart, Review, Order, OrderItem or Payout row with this id.
+
+    Ids from no configured shard are looked up on home, where they don't exist.
+    """
+    shard = int(row_id) >> SHARD_ID_BITS
+    return shard if shard < count() else HOME_SHARD
+
+
+def group_by_shard(rows, id_of):
+    """{shard: rows} for rows whose id_of(row) names their shard, in shard order."""
+    groups = {}
+    for row in rows:
+        groups.setdefault(shard_for_id(id_of(row)), []).append(row)
+    return dict(sorted(groups.items()))
+
+
+# ==================== DIRECTORY ====================
+
+def cached_shard(farmer_id):
+    return _farmer_shards.get(farmer_id)
+
+
+def remember_shard(farmer_id, shard):
+    """Cache a directory lookup; farmers missing from the directory are on home."""
+    shard = HOME_SHARD if shard is None else shard
+    _farmer_shards[farmer_id] = shard
+    return shard
+
+
+def shard_for_farmer(home, farmer_id):
+    if not enabled():
+        return HOME_SHARD
+    shard = _farmer_shards.get(farmer_id)
+    if shard is None:
+        cursor = home.cursor()
+        cursor.execute(FARMER_SHARD_SQL, (farmer_id,))
+        row = cursor.fetchone()
+        cursor.close()
+        shard = remember_shard(farmer_id, row[0] if row else None)
+    return shard
+
+
+def assign_farmer(cursor, farmer_id):
+    """Place a new farmer on the shard with the fewest farmers; call in the registering transaction."""
+    if not enabled():
+        return HOME_SHARD
+    cursor.execute("SELECT shardId, COUNT(*) FROM FarmerShard GROUP BY shardId")
+    farmers = dict(cursor.fetchall())
+    shard = min(all_shards(), key=lambda candidate: farmers.get(candidate, 0))
+    cursor.execute("INSERT INTO FarmerShard (farmerId, shardId) VALUES (%s, %s)", (farmer_id, shard))
+    return shard
+
+
+# ==================== CONNECTIONS ====================
+
+class Connections:
+    """Connections to the shards one request uses, each opened on first use.
+
+    home is the caller's connection to the home shard; the caller closes it,
+    and close() closes the rest.
+    """
+
+    def __init__(self, home):
+        self.home = home
+        self._dbs = {HOME_SHARD: home}
+
+    def get(self, shard):
+        db = self._dbs.get(shard)
+        if db is None:
+            db = self._dbs[shard] = database.get_db(shard)
+        return db
+
+    def for_farmer(self, farmer_id):
+        return self.get(shard_for_farmer(self.home, farmer_id))
+
+    def for_id(self, row_id):
+        return self.get(shard_for_id(row_id))
+
+    def each(self):
+        """(shard, connection) for every shard, for scatter-gather reads and writes."""
+        return [(shard, self.get(shard)) for shard in all_shards()]
+
+    def close(self):
+        dbs = self._dbs
+        self._dbs = {HOME_SHARD: self.home}
+        for shard, db in dbs.items():
+            if shard != HOME_SHARD:
+                db.close()
+
+
+def merge(streams, key, reverse=False):
+    """Merge row streams from several shards, each sorted by key, into one sorted stream."""
+    if len(streams) == 1:
+        return streams[0]
+    return _merged(streams, key, reverse)
+
+
+def _merged(streams, key, reverse):
+    try:
+        yield from heapq.merge(*streams, key=key, reverse=reverse)
+    finally:
+        # Let every stream drain its unread rows while its connection is open
+        for stream in streams:
+            close = getattr(stream, 'close', None)
+            if close is not None:
+                close()
+
+
+# ==================== REFERENCE TABLES ====================
+
+def _upsert(cursor, table, rows):
+    columns = list(rows[0])
+    owned = SHARD_OWNED_COLUMNS.get(table, ())
+    cursor.executemany("INSERT INTO %s (%s) VALUES (%s) ON DUPLICATE KEY UPDATE %s" % (
+        table,
+        ', '.join('`%s`' % column for column in columns),
+        ', '.join(['%s'] * len(columns)),
+        ', '.join('`%s` = VALUES(`%s`)' % (column, column) for column in columns if column not in owned)
+    ), [tuple(row[column] for column in columns) for row in rows])
+
+
+def copy_reference_rows(conns, user_id):
+    """Copy one user's User, Farmer and Buyer rows from home to every other shard.
+
+    Call after committing a change to them on home.
+    """
+    if not enabled():
+        return
+    cursor = conns.home.cursor(dictionary=True)
+    rows = {}
+    for table, column in REFERENCE_TABLES:
+        cursor.execute("SELECT * FROM %s WHERE %s = %%s" % (table, column), (user_id,))
+        rows[table] = cursor.fetchall()
+    cursor.close()
+
+    for shard, db in conns.each():
+        if shard == HOME_SHARD:
+            continue
+        cursor = db.cursor()
+        for table, table_rows in rows.items():
+            if table_rows:
+                _upsert(cursor, table, table_rows)
+        db.commit()
+        cursor.close()
+
+
+def sync_reference(conns, batch_size=1000):
+    """Copy every reference row from home to the other shards, in batches. Returns rows copied."""
+    copied = 0
+    home_cursor = conns.home.cursor(dictionary=True)
+    for table, _ in REFERENCE_TABLES:
+        last_id = 0
+        while True:
+            home_cursor.execute("SELECT * FROM %s WHERE id > %%s ORDER BY id LIMIT %%s" % table,
+                                (last_id, batch_size))
+            rows = home_cursor.fetchall()
+            conns.home.rollback()  # don't hold a snapshot open between batches
+            if not rows:
+                break
+            for shard, db in conns.each():
+                if shard == HOME_SHARD:
+                    continue
+                cursor = db.cursor()
+                _upsert(cursor, table, rows)
+                db.commit()
+                cursor.close()
+            copied += len(rows)
+            last_id = rows[-1]['id']
+    home_cursor.close()
+    return copied
+
+
+# ==================== CROSS-SHARD WRITES ====================
+
+def checkout_xid(checkout_id):
+    return XID_PREFIX + str(checkout_id)
+
+
+class Branch:
+    """One shard's part of a write spanning shards, run as an XA transaction branch.
+
+    start() it, write through its cursor and prepare() it. Once the deciding
+    transaction on home has committed, commit() it; until then rollback()
+    undoes it. If that commit failed without saying whether it took effect,
+    leave_prepared() lets recover() decide from what home actually holds.
+    """
+
+    def __init__(self, db, xid):
+        self.db = db
+        self.xid = xid
+        self.cursor = db.cursor()
+        self.state = None
+
+    def start(self):
+        # Autocommit is off, so earlier reads on this connection (the cart) left
+        # a local transaction open, and MySQL refuses XA START inside one
+        self.db.rollback()
+        self.cursor.execute("XA START %s", (self.xid,))
+        self.state = 'active'
+
+    def prepare(self):
+        self.cursor.execute("XA END %s", (self.xid,))
+        self.state = 'idle'
+        self.cursor.execute("XA PREPARE %s", (self.xid,))
+        self.state = 'prepared'
+
+    def commit(self):
+        try:
+            self.cursor.execute("XA COMMIT %s", (self.xid,))
+            self.state = None
+        except Exception:
+            logger.exception('XA branch %s left prepared; `python shards.py recover` will resolve it', self.xid)
+            self._detach()
+
+    def rollback(self):
+        try:
+            if self.state == 'active':
+                self.cursor.execute("XA END %s", (self.xid,))
+            if self.state is not None:
+                self.cursor.execute("XA ROLLBACK %s", (self.xid,))
+            self.state = None
+        except Exception:
+            logger.exception('XA branch %s could not be rolled back', self.xid)
+            self._detach()
+
+    def leave_prepared(self):
+        """Hand a prepared branch to `shards.py recover`, for when the deciding
+        commit on home was attempted but its outcome is unknown."""
+        if self.state == 'prepared':
+            logger.warning('XA branch %s left prepared; `python shards.py recover` will resolve it', self.xid)
+            self._detach()
+        else:
+            self.rollback()
+
+    def _detach(self):
+        # A new session leaves the branch to recovery instead of blocking the pooled connection
+        try:
+            self.db.reconnect()
+        except Exception:
+            logger.exception('Reconnecting after XA branch %s failed', self.xid)
+        self.state = None
+
+    def close(self):
+        try:
+            self.cursor.close()
+        except Exception:
+            pass
+
+
+def _prepared_xids(db):
+    cursor = db.cursor()
+    cursor.execute("XA RECOVER")
+    xids = set()
+    for _, gtrid_length, _, data in cursor.fetchall():
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        xid = data[:gtrid_length]
+        if xid.startswith(XID_PREFIX):
+            xids.add(xid)
+    cursor.close()
+    return xids
+
+
+def recover(conns, grace=60):
+    """Resolve checkout branches left prepared: commit those whose payment was
+    recorded on home and roll back the rest.
+
+    Only branches still prepared after grace seconds are touched, so
+    checkouts in progress are left alone. Returns (committed, rolled back).
+    """
+    pending = {shard: _prepared_xids(db) for shard, db in conns.each() if shard != HOME_SHARD}
+    if not any(pending.values()):
+        return 0, 0
+    time.sleep(grace)
+
+    committed = rolled_back = 0
+    home_cursor = conns.home.cursor()
+    for shard, xids in pending.items():
+        db = conns.get(shard)
+        db.rollback()  # XA COMMIT/ROLLBACK can't run inside a local transaction
+        cursor = db.cursor()
+        for xid in sorted(xids & _prepared_xids(db)):
+            home_cursor.execute("SELECT 1 FROM Payment WHERE checkoutId = %s AND status = 'completed'",
+                                (int(xid[len(XID_PREFIX):]),))
+            paid = home_cursor.fetchone() is not None
+            conns.home.rollback()
+            if paid:
+                cursor.execute("XA COMMIT %s", (xid,))
+                committed += 1
+            else:
+                cursor.execute("XA ROLLBACK %s", (xid,))
+                rolled_back += 1
+            logger.info('Shard %s: %s %s', shard, 'committed' if paid else 'rolled back', xid)
+        cursor.close()
+    home_cursor.close()
+    return committed, rolled_back
+
+
+def checkouts_in_use(dbs, checkout_ids):
+    """Those of checkout_ids with hot orders or a prepared branch on any of dbs.
+
+    Their Checkout and Payment rows must stay on home: recover() decides
+    branches by the payment, and the orders are archived with a checkout.
+    """
+    if not checkout_ids:
+        return set()
+    checkout_ids = list(checkout_ids)
+    in_use = set()
+    for db in dbs:
+        cursor = db.cursor()
+        cursor.execute("SELECT DISTINCT checkoutId FROM `Order` WHERE checkoutId IN (%s)"
+                       % ', '.join(['%s'] * len(checkout_ids)), checkout_ids)
+        in_use.update(row[0] for row in cursor.fetchall())
+        cursor.close()
+        db.rollback()
+        in_use.update(int(xid[len(XID_PREFIX):]) for xid in _prepared_xids(db))
+    return in_use & set(checkout_ids)
+
+
+# ==================== SETUP ====================
+
+def init_shard(db, shard):
+    """Start a shard's id blocks and drop its Order -> Checkout foreign key,
+    since checkouts stay on home."""
+    block = shard << SHARD_ID_BITS
+    cursor = db.cursor()
+    for table in SHARDED_TABLES:
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM %s" % table)
+        max_id = cursor.fetchone()[0]
+        if max_id and shard_for_id(max_id) != shard:
+            raise RuntimeError(f'Shard {shard}: {table} already has id {max_id} outside its block')
+        if shard != HOME_SHARD and max_id < block:
+            cursor.execute("ALTER TABLE %s AUTO_INCREMENT = %d" % (table, block))
+
+    if shard != HOME_SHARD:
+        cursor.execute("""
+            SELECT CONSTRAINT_NAME FROM information_schema.TABLE_CONSTRAINTS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'Order' AND CONSTRAINT_NAME = 'fk_order_checkout'
+        """)
+        if cursor.fetchall():
+            cursor.execute("ALTER TABLE `Order` DROP FOREIGN KEY fk_order_checkout")
+    cursor.close()
+
+
+def status(conns):
+    """Farmers, products and prepared checkout branches per shard."""
+    cursor = conns.home.cursor()
+    cursor.execute("SELECT shardId, COUNT(*) FROM FarmerShard GROUP BY shardId")
+    farmers = dict(cursor.fetchall())
+    cursor.close()
+
+    rows = []
+    for shard, db in conns.each():
+        cursor = db.cursor()
+        cursor.execute("SELECT COUNT(*) FROM Product")
+        products = cursor.fetchone()[0]
+        cursor.close()
+        rows.append((shard, farmers.get(shard, 0), products, len(_prepared_xids(db))))
+    return rows
+
+
+# ==================== CLI ====================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Set up and maintain the shards listed in SHARD_DSNS.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('init', help='prepare every shard and copy the reference tables to them')
+    sync = sub.add_parser('sync-reference', help='copy User, Farmer and Buyer rows from home to every shard')
+    sync.add_argument('--batch-size', type=int, default=1000)
+    recovery = sub.add_parser('recover', help='resolve checkout branches left prepared by a crash')
+    recovery.add_argument('--grace', type=float, default=60, help='seconds a branch must stay prepared')
+    sub.add_parser('status', help='farmers, products and prepared branches per shard')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if count() > MAX_SHARDS:
+        parser.error(f'At most {MAX_SHARDS} shards are supported')
+
+    from db import get_db
+    home = get_db()
+    conns = Connections(home)
+
+    try:
+        if args.command == 'init':
+            for shard, db in conns.each():
+                init_shard(db, shard)
+            print(f'Prepared {count()} shards')
+            print(f'Copied {sync_reference(conns)} reference rows')
+        elif args.command == 'sync-reference':
+            print(f'Copied {sync_reference(conns, args.batch_size)} reference rows')
+        elif args.command == 'recover':
+            committed, rolled_back = recover(conns, args.grace)
+            print(f'Committed {committed} and rolled back {rolled_back} checkout branches')
+        elif args.command == 'status':
+            print(f'{"shard":>5} {"farmers":>8} {"products":>9} {"prepared":>9}')
+            for shard, farmers, products, prepared in status(conns):
+                print(f'{shard:>5} {farmers:>8} {products:>9} {prepared:>9}')
+    finally:
+        conns.close()
+        home.close()
+
+
+if __name__ == '__main__':
+    main()
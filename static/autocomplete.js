@@ -0,0 +1,46 @@
+// Type-ahead for the product search box.
+// Fills the datalist from /api/suggest as the buyer types and opens the
+// product page when a product suggestion is picked.
+(function () {
+    var input = document.getElementById('product-search');
+    if (!input || !window.fetch) {
+        return;
+    }
+
+    var list = document.getElementById(input.getAttribute('list'));
+    var urls = {};
+    var pending = null;
+
+    input.addEventListener('input', function () {
+        var query = input.value.trim();
+
+        if (urls[query]) {
+            window.location = urls[query];
+            return;
+        }
+        if (pending) {
+            pending.abort();
+        }
+        if (!query) {
+            list.innerHTML = '';
+            return;
+        }
+
+        pending = new AbortController();
+        fetch(input.dataset.suggestUrl + '?q=' + encodeURIComponent(query), {signal: pending.signal})
+            .then(function (response) { return response.json(); })
+            .then(function (data) {
+                list.innerHTML = '';
+                data.suggestions.forEach(function (suggestion) {
+                    var option = document.createElement('option');
+                    option.value = suggestion.text;
+                    option.label = suggestion.type === 'farm' ? 'Farm' : 'Product';
+                    list.appendChild(option);
+                    if (suggestion.url) {
+                        urls[suggestion.text] = suggestion.url;
+                    }
+                });
+            })
+            .catch(function () {});
+    });
+})();
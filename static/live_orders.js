@@ -0,0 +1,35 @@
+// Live order updates over Server-Sent Events.
+// Updates the delivery status of rows already on the page and shows a
+// refresh banner when an order item arrives that the page doesn't have yet.
+// The server sends recent events again after a reconnect; those are dropped
+// by event id.
+(function () {
+    var banner = document.getElementById('live-updates');
+    if (!banner || !window.EventSource) {
+        return;
+    }
+
+    var source = new EventSource(banner.dataset.streamUrl);
+    var seen = {};
+
+    source.addEventListener('order_item', function (event) {
+        var item = JSON.parse(event.data);
+        if (seen[item.event_id]) {
+            return;
+        }
+        seen[item.event_id] = true;
+        var row = document.querySelector('tr[data-order-item-id="' + item.order_item_id + '"]');
+
+        if (!row) {
+            banner.hidden = false;
+            return;
+        }
+
+        if (item.deliveryStatus === 'delivered') {
+            var cell = row.querySelector('.delivery-status');
+            cell.innerHTML = '<span class="badge badge-success">✓ Delivered</span>' +
+                '<div style="font-size: 0.75rem; color: var(--gray-600); margin-top: 0.25rem;"></div>';
+            cell.lastChild.textContent = item.deliveredAt || '';
+        }
+    });
+})();
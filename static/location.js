@@ -0,0 +1,24 @@
+// Fills the latitude/longitude fields of a form from the browser's
+// geolocation when its [data-locate] button is clicked.
+(function () {
+    document.querySelectorAll('[data-locate]').forEach(function (button) {
+        if (!navigator.geolocation) {
+            button.hidden = true;
+            return;
+        }
+
+        button.addEventListener('click', function () {
+            var form = button.closest('form');
+            button.disabled = true;
+
+            navigator.geolocation.getCurrentPosition(function (position) {
+                form.elements.latitude.value = position.coords.latitude.toFixed(6);
+                form.elements.longitude.value = position.coords.longitude.toFixed(6);
+                button.disabled = false;
+            }, function () {
+                button.disabled = false;
+                alert('Could not get your location. Please enter it by hand.');
+            });
+        });
+    });
+})();
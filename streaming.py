@@ -0,0 +1,139 @@
+"""Streamed template rendering and response compression.
+
+stream_page() renders a template incrementally so the first bytes leave
+before the whole catalog or order history has been rendered, and
+compresses the stream on the fly. compress_response() is an after_request
+hook that compresses ordinary responses. Both negotiate brotli (when the
+optional brotli package is installed, see requirements-optional.txt) or
+gzip from Accept-Encoding and leave bodies under MIN_SIZE uncompressed.
+"""
+import zlib
+
+from flask import Response, get_flashed_messages, request, stream_template
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; fall back to gzip
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+MIN_SIZE = 1024
+# Rendered output is sent in pieces of roughly this size
+CHUNK_SIZE = 8192
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json',
+}
+
+
+def negotiate_encoding():
+    """Best Content-Encoding the client accepts, or None."""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+class Compressor:
+    def __init__(self, encoding):
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self.compress = self._compressor.process
+            self.flush = self._compressor.flush
+            self.finish = self._compressor.finish
+        else:
+            # wbits=31 writes a gzip header and trailer
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self.compress = self._compressor.compress
+            self.flush = lambda: self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.finish = self._compressor.flush
+
+
+def _chunked(strings):
+    """Join small template fragments into CHUNK_SIZE byte pieces."""
+    buffer = []
+    size = 0
+    for text in strings:
+        data = text.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _compressed(chunks, encoding):
+    compressor = Compressor(encoding)
+    for chunk in chunks:
+        # Flush every chunk so the browser can start rendering it
+        data = compressor.compress(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def stream_page(template_name, **context):
+    """Streaming equivalent of render_template for large pages.
+
+    Context values may be iterators (e.g. dao row generators); they are
+    consumed while the page is sent.
+    """
+    # Pop flashed messages now; the session is saved before the body streams
+    get_flashed_messages(with_categories=True)
+
+    chunks = _chunked(stream_template(template_name, **context))
+
+    # Read up to MIN_SIZE before choosing headers, so tiny pages skip compression
+    head = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= MIN_SIZE:
+            break
+
+    def body():
+        try:
+            yield from head
+            yield from chunks
+        finally:
+            chunks.close()
+
+    encoding = negotiate_encoding() if size >= MIN_SIZE else None
+    response = Response(_compressed(body(), encoding) if encoding else body(), mimetype='text/html')
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def compress_response(response):
+    """after_request hook compressing buffered responses above MIN_SIZE."""
+    response.vary.add('Accept-Encoding')
+
+    if (response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or not 200 <= response.status_code < 300):
+        return response
+
+    data = response.get_data()
+    if len(data) < MIN_SIZE:
+        return response
+
+    encoding = negotiate_encoding()
+    if not encoding:
+        return response
+
+    compressor = Compressor(encoding)
+    response.set_data(compressor.compress(data) + compressor.finish())
+    response.headers['Content-Encoding'] = encoding
+    return response
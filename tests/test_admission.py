@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+import admission
+from admission import ConcurrencyLimiter, RateLimiter, concurrency_for_pool
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, 'monotonic', clock)
+    return clock
+
+
+def test_rate_limiter_allows_a_burst_then_refills(clock):
+    limiter = RateLimiter(rate=2.0, burst=3)
+    assert [limiter.take('u') for _ in range(3)] == [0, 0, 0]
+    assert limiter.take('u') == pytest.approx(0.5)
+    assert limiter.rejected == 1
+
+    clock.now += 0.5
+    assert limiter.take('u') == 0
+    assert limiter.take('other') == 0
+
+
+def test_rate_limiter_prunes_refilled_buckets(clock, monkeypatch):
+    monkeypatch.setattr(admission, 'MAX_BUCKETS', 2)
+    limiter = RateLimiter(rate=1.0, burst=2)
+    limiter.take('a')
+    clock.now += 1
+    limiter.take('b')
+    clock.now += 1  # a has refilled, b hasn't
+    limiter.take('c')
+    assert len(limiter) == 2
+    assert limiter.take('b') == 0
+
+
+def test_concurrency_limiter_sheds_past_the_queue():
+    limiter = ConcurrencyLimiter(limit=1, max_queue=0, timeout=1)
+    assert limiter.acquire()
+    assert not limiter.acquire()
+    limiter.release()
+    assert limiter.acquire()
+    assert (limiter.admitted, limiter.rejected, limiter.inflight) == (2, 1, 1)
+
+
+def test_concurrency_limiter_times_out_queued_requests():
+    limiter = ConcurrencyLimiter(limit=1, max_queue=1, timeout=0.01)
+    assert limiter.acquire()
+    assert not limiter.acquire()
+    assert limiter.waiting == 0
+    assert limiter.rejected == 1
+
+
+def test_concurrency_limiter_hands_a_released_slot_to_a_waiter():
+    limiter = ConcurrencyLimiter(limit=1, max_queue=1, timeout=5)
+    assert limiter.acquire()
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(limiter.acquire()))
+    waiter.start()
+    while not limiter.waiting:
+        pass
+    limiter.release()
+    waiter.join()
+    assert results == [True]
+    assert limiter.inflight == 1
+
+
+@pytest.mark.parametrize('concurrency, pool_size, expected', [
+    (8, 10, 8),
+    (8, 4, 3),
+    (10, 10, 9),
+    (4, 1, 1),
+])
+def test_concurrency_stays_below_the_pool(concurrency, pool_size, expected):
+    assert concurrency_for_pool(concurrency, pool_size) == expected
+
+
+def test_configure_rebuilds_the_limiter(monkeypatch):
+    for name in ('db_limiter', 'DB_CONCURRENCY', 'DB_QUEUE_DEPTH', 'DB_QUEUE_TIMEOUT'):
+        monkeypatch.setattr(admission, name, getattr(admission, name))
+    admission.configure({'DB_CONCURRENCY': 8, 'DB_POOL_SIZE': 4,
+                         'DB_QUEUE_DEPTH': 5, 'DB_QUEUE_TIMEOUT': 0.5})
+    assert (admission.db_limiter.limit, admission.db_limiter.max_queue, admission.db_limiter.timeout) == (3, 5, 0.5)
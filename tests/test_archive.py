@@ -0,0 +1,87 @@
+from datetime import datetime
+
+import pytest
+
+from archive import PARTITIONED_TABLES, _month_key, _next_month, ensure_partitions, union_archive
+
+
+class FakeDB:
+    """Answers the partition listing with existing month keys and records the ALTERs."""
+
+    def __init__(self, existing=()):
+        self.existing = list(existing)
+        self.statements = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+
+    def execute(self, sql, params=None):
+        if sql.lstrip().startswith('ALTER'):
+            self.db.statements.append(sql)
+
+    def fetchall(self):
+        return [('p%d' % month,) for month in self.db.existing]
+
+    def close(self):
+        pass
+
+
+def test_union_archive_expands_hot_then_archive_tables():
+    sql = union_archive("SELECT id FROM {Payout} JOIN {OrderItem} ON 1 JOIN {Order} o ON 1 WHERE farmerId = %s",
+                        "ORDER BY id")
+    assert sql == (
+        "(SELECT id FROM Payout JOIN OrderItem ON 1 JOIN `Order` o ON 1 WHERE farmerId = %s) UNION ALL "
+        "(SELECT id FROM PayoutArchive JOIN OrderItemArchive ON 1 JOIN OrderArchive o ON 1 WHERE farmerId = %s) "
+        "ORDER BY id"
+    )
+    # Callers pass their params twice, once per half
+    assert sql.count('%s') == 2
+
+
+@pytest.mark.parametrize('value, key', [
+    (datetime(2025, 1, 31), 202501),
+    (datetime(2025, 12, 1), 202512),
+])
+def test_month_key(value, key):
+    assert _month_key(value) == key
+
+
+@pytest.mark.parametrize('month, following', [
+    (202511, 202512),
+    (202512, 202601),
+    (202601, 202602),
+])
+def test_next_month_rolls_over_the_year(month, following):
+    assert _next_month(month) == following
+
+
+def test_ensure_partitions_across_year_end():
+    db = FakeDB()
+    assert ensure_partitions(db, 202511, 202602) == 4 * len(PARTITIONED_TABLES)
+    assert len(db.statements) == len(PARTITIONED_TABLES)
+    statement = db.statements[0]
+    assert statement.startswith('ALTER TABLE OrderArchive REORGANIZE PARTITION p_future INTO (')
+    assert ('PARTITION p202511 VALUES LESS THAN (202512), '
+            'PARTITION p202512 VALUES LESS THAN (202601), '
+            'PARTITION p202601 VALUES LESS THAN (202602), '
+            'PARTITION p202602 VALUES LESS THAN (202603), '
+            'PARTITION p_future VALUES LESS THAN MAXVALUE)') in statement
+
+
+def test_ensure_partitions_continues_after_the_newest():
+    db = FakeDB(existing=[202511, 202512])
+    assert ensure_partitions(db, 202401, 202601) == len(PARTITIONED_TABLES)
+    assert 'PARTITION p202601 VALUES LESS THAN (202602), PARTITION p_future' in db.statements[0]
+    assert 'p2024' not in db.statements[0]
+
+
+def test_ensure_partitions_up_to_date_alters_nothing():
+    db = FakeDB(existing=[202512, 202601])
+    assert ensure_partitions(db, 202512, 202601) == 0
+    assert db.statements == []
+
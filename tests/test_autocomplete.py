@@ -0,0 +1,76 @@
+import pytest
+
+import autocomplete
+from autocomplete import PrefixIndex, index_keys, rank
+
+FARMS = [(1, 'Green Acres', 4.5, 100), (2, 'Sunny Farm', 3.0, 500)]
+PRODUCTS = [
+    (10, 'Cherry Tomatoes', 1, 4.0),
+    (11, 'Tomatoes', 1, 3.5),
+    (12, 'Tomatoes', 2, 4.8),
+    (13, 'Sweet Corn', 2, 4.1),
+]
+
+
+@pytest.fixture
+def index():
+    index = PrefixIndex()
+    index.load(FARMS, PRODUCTS)
+    return index
+
+
+def assert_consistent(index):
+    """_keys, _refs and _ranked describe exactly the entries in _entries."""
+    assert index._keys == sorted(index._keys)
+    assert len(index._keys) == len(index._refs)
+    expected = sorted((key, (entry.kind, entry.id))
+                      for entry in index._entries.values() for key in index_keys(entry))
+    assert list(zip(index._keys, index._refs)) == expected
+    assert index._ranked == sorted(index._entries.values(), key=rank)
+
+
+def names(results):
+    return [(entry.kind, entry.id) for entry in results]
+
+
+def test_matches_any_word_best_ranked_first(index):
+    assert_consistent(index)
+    assert names(index.suggest('tom')) == [('product', 12), ('product', 10)]
+    assert names(index.suggest('  SUN')) == [('farm', 2)]
+    assert index.suggest('omatoes') == []
+
+
+def test_common_prefix_scan_agrees_with_range_lookup(index, monkeypatch):
+    expected = names(index.suggest('t'))
+    monkeypatch.setattr(autocomplete, 'SCAN_LIMIT', 0)
+    index._cache.clear()
+    assert names(index.suggest('t')) == expected
+
+
+def test_update_product_keeps_the_index_in_step(index):
+    assert names(index.suggest('corn')) == [('product', 13)]
+    index.update_product(13, 'Baby Corn Cobs', 2, rating=4.1)
+    assert_consistent(index)
+    assert names(index.suggest('sweet')) == []
+    assert names(index.suggest('cob')) == [('product', 13)]
+
+    index.update_product(13, 'Baby Corn Cobs', 2, available=False)
+    assert_consistent(index)
+    assert index.suggest('corn') == []
+    assert 13 not in index._farmer_products[2]
+
+
+def test_cached_answers_are_invalidated(index):
+    assert names(index.suggest('kale')) == []
+    index.update_product(14, 'Kale', 1, rating=5)
+    assert names(index.suggest('kale')) == [('product', 14)]
+
+
+def test_load_keeps_the_best_ranked_within_bound(monkeypatch):
+    monkeypatch.setattr(autocomplete, 'MAX_ENTRIES', 2)
+    index = PrefixIndex()
+    index.load(FARMS, PRODUCTS)
+    assert_consistent(index)
+    assert sorted(names(index._ranked)) == [('farm', 1), ('product', 12)]
+    index.update_product(20, 'Leeks', 1, rating=5)  # full: not added
+    assert len(index) == 2
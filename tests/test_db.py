@@ -0,0 +1,43 @@
+import pytest
+from mysql.connector import MySQLConnection, pooling
+
+import app as marketplace
+import db as database
+
+
+@pytest.fixture
+def pool():
+    # Never connects: connections are handed in unopened
+    pool = pooling.MySQLConnectionPool(pool_name='test_close', pool_size=1, pool_reset_session=False)
+    pool.set_config(host='127.0.0.1', user='test')
+    return pool
+
+
+def checked_out(pool):
+    return pooling.PooledMySQLConnection(pool, MySQLConnection())
+
+
+def test_closing_a_pooled_connection_twice_overfills_the_pool(pool):
+    db = checked_out(pool)
+    db.close()
+    with pytest.raises(pooling.PoolError):
+        db.close()
+
+
+def test_close_db_is_safe_to_repeat(pool):
+    db = checked_out(pool)
+    database.close_db(db)
+    database.close_db(db)
+    assert pool._cnx_queue.qsize() == 1
+
+
+@pytest.mark.parametrize('view_closes', [False, True])
+def test_teardown_returns_request_connections_once(pool, monkeypatch, view_closes):
+    monkeypatch.setattr(marketplace, 'connect_db', lambda: checked_out(pool))
+    flask_app = marketplace.create_app()
+    with flask_app.test_request_context('/'):
+        db = marketplace.get_db()
+        if view_closes:
+            db.close()
+    assert pool._cnx_queue.qsize() == 1
+    assert marketplace.admission.db_limiter.inflight == 0
@@ -0,0 +1,74 @@
+import math
+
+import pytest
+
+import geo
+
+
+def destination(latitude, longitude, bearing, km):
+    """Point km away from (latitude, longitude) along bearing, in degrees."""
+    angle = km / geo.EARTH_RADIUS_KM
+    phi1, lambda1, theta = map(math.radians, (latitude, longitude, bearing))
+    phi2 = math.asin(math.sin(phi1) * math.cos(angle) + math.cos(phi1) * math.sin(angle) * math.cos(theta))
+    lambda2 = lambda1 + math.atan2(math.sin(theta) * math.sin(angle) * math.cos(phi1),
+                                   math.cos(angle) - math.sin(phi1) * math.sin(phi2))
+    return math.degrees(phi2), (math.degrees(lambda2) + 540) % 360 - 180
+
+
+def assert_covers(latitude, longitude, radius_km):
+    prefixes = geo.covering_prefixes(latitude, longitude, radius_km)
+    assert prefixes is not None
+    assert len(prefixes) <= geo.MAX_CELLS
+    for bearing in range(0, 360, 5):
+        for fraction in (0.25, 0.5, 0.99):
+            point = destination(latitude, longitude, bearing, radius_km * fraction)
+            geohash = geo.encode(*point)
+            assert any(geohash.startswith(prefix) for prefix in prefixes), (point, prefixes)
+    return prefixes
+
+
+def test_encode_matches_the_reference_geohash():
+    assert geo.encode(57.64911, 10.40744, 11) == 'u4pruydqqvj'
+
+
+@pytest.mark.parametrize('latitude, longitude, radius_km', [
+    (51.5, -0.12, 5),
+    (19.07, 72.87, 25),
+    (-33.9, 151.2, 100),
+    (0.0, 0.0, 10),
+])
+def test_covers_the_circle(latitude, longitude, radius_km):
+    assert_covers(latitude, longitude, radius_km)
+
+
+def test_covers_across_the_antimeridian():
+    prefixes = assert_covers(-17.7, 179.95, 30)
+    # Cells on both sides of the line are included
+    assert any(geo.encode(-17.7, -179.9).startswith(prefix) for prefix in prefixes)
+
+
+def test_covers_near_the_poles():
+    assert_covers(89.95, 10.0, 20)
+    assert_covers(-89.9, -120.0, 50)
+
+
+def test_whole_earth_is_not_covered():
+    assert geo.covering_prefixes(0.0, 0.0, 20100) is None
+
+
+def test_distance_matches_known_value():
+    # London to Paris
+    assert geo.distance_km(51.5074, -0.1278, 48.8566, 2.3522) == pytest.approx(343.5, abs=1)
+
+
+def test_fee_for_distances():
+    assert geo.fee_for_distances([], 50) == 0.0
+    assert geo.fee_for_distances([2.0, 10.0], 50) == 2 * geo.DELIVERY_BASE_FEE + 12 * geo.DELIVERY_FEE_PER_KM
+    assert geo.fee_for_distances([2.0, None], 50) == round(50 * geo.FALLBACK_FEE_RATE, 2)
+
+
+@pytest.mark.parametrize('form', [{}, {'latitude': 'x', 'longitude': '1'}, {'latitude': '91', 'longitude': '0'},
+                                  {'latitude': '0', 'longitude': '-181'}])
+def test_parse_location_rejects(form):
+    with pytest.raises(ValueError):
+        geo.parse_location(form)
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+import app as marketplace
+import order_events
+from order_events import RESCAN_SECONDS, advance_position
+
+
+def event(event_id):
+    return {'event_id': event_id, 'eventType': 'created', 'order_item_id': event_id, 'orderId': 1,
+            'quantity': 1, 'price': 1.0, 'deliveryStatus': 'pending', 'deliveredAt': None,
+            'product_name': 'Kale'}
+
+
+def test_advance_position_waits_for_the_rescan_window():
+    sent = {11: 100.0}
+    assert advance_position(9, sent, 100.0 + RESCAN_SECONDS - 1) == 9
+    assert sent == {11: 100.0}
+    assert advance_position(9, sent, 100.0 + RESCAN_SECONDS) == 11
+    assert sent == {}
+
+
+def test_advance_position_forgets_rows_it_moves_past():
+    sent = {11: 100.0, 10: 120.0, 14: 125.0}
+    assert advance_position(9, sent, 100.0 + RESCAN_SECONDS) == 11
+    assert sent == {14: 125.0}
+
+
+def test_stream_sends_rows_committed_out_of_id_order(monkeypatch):
+    # Row 10 is inserted before row 11 but commits after the first poll
+    visible = [[event(11)], [event(10), event(11)]]
+    polls = []
+
+    def fetch_events(shard, column, owner_id, after_id):
+        polls.append(after_id)
+        rows = visible[min(len(polls), len(visible)) - 1]
+        return [dict(row) for row in rows if row['event_id'] > after_id]
+
+    monkeypatch.setattr(order_events, '_fetch_events', fetch_events)
+    monkeypatch.setattr(order_events.time, 'sleep', lambda seconds: None)
+
+    stream = order_events.stream_events('buyerId', 7, {0: 9})
+    next(stream)  # retry: line
+    messages = [next(stream), next(stream)]
+    sent = [json.loads(message.split('data: ')[1])['event_id'] for message in messages]
+    assert sent == [11, 10]
+    assert polls == [9, 9]
+
+
+def test_stream_skips_polls_the_db_limiter_sheds(monkeypatch):
+    def fetch_events(*args):
+        raise AssertionError('polled without a DB slot')
+
+    monkeypatch.setattr(order_events, '_fetch_events', fetch_events)
+    monkeypatch.setattr(order_events.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(order_events.admission, 'db_limiter', order_events.admission.ConcurrencyLimiter(0, 0, 0))
+    shed = order_events.stats['shed']
+
+    stream = order_events.stream_events('farmerId', 3, {0: 0})
+    next(stream)  # retry: line
+    monkeypatch.setattr(order_events, 'HEARTBEAT_INTERVAL', 0)
+    assert next(stream) == ': keep-alive\n\n'
+    assert order_events.stats['shed'] == shed + 1
+
+
+@pytest.mark.parametrize('headers, query', [
+    ({'Last-Event-ID': 'garbage'}, ''),
+    ({}, '?after=0:1,2'),
+    ({'Last-Event-ID': '7:x'}, '?after=5'),
+])
+def test_stream_falls_back_from_a_malformed_position(monkeypatch, headers, query):
+    class Connection:
+        open = True
+
+        def close(self):
+            self.open = False
+
+        def is_connected(self):
+            return self.open
+
+    streamed = []
+    monkeypatch.setattr(marketplace, 'connect_db', Connection)
+    monkeypatch.setattr(marketplace.shards.Connections, 'get', lambda self, shard: self.home)
+    monkeypatch.setattr(order_events, 'latest_positions',
+                        lambda dbs, column, owner_id: {shard: 40 for shard, _ in dbs})
+    monkeypatch.setattr(order_events, 'stream_events',
+                        lambda column, owner_id, positions: streamed.append(positions) or iter(()))
+    client = marketplace.create_app().test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=3, role='BUYER')
+
+    response = client.get('/buyer/orders/stream' + query, headers=headers)
+    assert response.status_code == 200
+    assert streamed == [{0: 40}]
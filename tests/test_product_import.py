@@ -0,0 +1,150 @@
+import io
+
+import pytest
+
+from product_import import import_products, name_key, read_rows, validate_row
+
+HEADER = b'name,description,price,stock,available\n'
+
+
+def rows(data):
+    return list(read_rows(io.BytesIO(data)))
+
+
+class FakeDB:
+    """Records the chunks written; fails on the chunk numbered fail_on.
+
+    existing maps the farmer's product names to ids, matched as the
+    column's collation would.
+    """
+
+    def __init__(self, fail_on=None, existing=None):
+        self.fail_on = fail_on
+        self.existing = existing or {}
+        self.chunks = 0
+        self.names = []
+        self.updated = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+
+    def execute(self, sql, params):
+        self.db.chunks += 1
+        if self.db.chunks == self.db.fail_on:
+            raise RuntimeError('Lost connection to MySQL server')
+        names = params[:len(params) // 2]
+        self.rows = [(product_id, position)
+                     for name, product_id in self.db.existing.items()
+                     for position in [next((i + 1 for i, ours in enumerate(names)
+                                            if name_key(ours) == name_key(name)), 0)]
+                     if position]
+
+    def fetchall(self):
+        return self.rows
+
+    def executemany(self, sql, params):
+        if sql.lstrip().startswith('UPDATE'):
+            self.db.updated += [row[-1] for row in params]
+        else:
+            self.db.names += [row[1] for row in params]
+
+    def close(self):
+        pass
+
+
+def test_validate_row_accepts_a_product():
+    product, error = validate_row({'name': ' Kale ', 'description': 'Curly', 'price': '2.5', 'stock': '4'})
+    assert error is None
+    assert product == ('Kale', 'Curly', 2.5, 4, True)
+
+
+@pytest.mark.parametrize('row, message', [
+    ({'name': '', 'price': '1', 'stock': '1'}, 'Product name is required'),
+    ({'name': 'x' * 256, 'price': '1', 'stock': '1'}, 'longer than 255'),
+    ({'name': 'Kale', 'price': '-1', 'stock': '1'}, 'Invalid price'),
+    ({'name': 'Kale', 'price': None, 'stock': '1'}, 'Invalid price'),
+    ({'name': 'Kale', 'price': '1', 'stock': '1.5'}, 'Invalid stock quantity'),
+    ({'name': 'Kale', 'price': '1', 'stock': '1', 'available': 'maybe'}, 'Invalid available value'),
+])
+def test_validate_row_rejects(row, message):
+    product, error = validate_row(row)
+    assert product is None
+    assert message in error
+
+
+@pytest.mark.parametrize('available, stock, expected', [
+    ('no', '5', False),
+    ('Yes', '5', True),
+    ('1', '0', False),  # nothing to sell
+])
+def test_validate_row_available(available, stock, expected):
+    product, _ = validate_row({'name': 'Kale', 'price': '1', 'stock': stock, 'available': available})
+    assert product[4] is expected
+
+
+def test_read_rows_reports_undecodable_lines_and_continues():
+    result = rows(HEADER + b'Kale,,1,1,yes\nCaf\xe9,,1,1,yes\nLeek,,1,1,yes\n')
+    assert [(line, row and row['name'], error) for line, row, error in result] == [
+        (2, 'Kale', None),
+        (3, None, 'Line is not valid UTF-8'),
+        (4, 'Leek', None),
+    ]
+
+
+def test_read_rows_reports_csv_errors_and_continues():
+    too_long = b'x' * 200000  # past csv.field_size_limit()
+    result = rows(HEADER + b'Kale,,1,1,yes\nBad,' + too_long + b',1,1,yes\nLeek,,1,1,yes\n')
+    assert [row and row['name'] for _, row, _ in result] == ['Kale', None, 'Leek']
+    assert result[1][2].startswith('Could not parse line')
+
+
+def test_read_rows_strips_bom_and_normalises_header():
+    result = rows(b'\xef\xbb\xbfName, Price ,STOCK\nKale,1,1\n')
+    assert result[0][1] == {'name': 'Kale', 'price': '1', 'stock': '1'}
+
+
+def test_read_rows_rejects_missing_columns():
+    with pytest.raises(ValueError, match='price'):
+        rows(b'name,stock\nKale,1\n')
+
+
+def test_import_keeps_last_row_for_repeated_names():
+    db = FakeDB()
+    result = import_products(db, 1, io.BytesIO(HEADER + b'Kale,,1,1,yes\nkale,,2,1,yes\n'))
+    assert result == {'inserted': 1, 'updated': 0, 'errors': [], 'stopped': None}
+    assert db.names == ['kale']
+
+
+def test_import_stops_at_failed_chunk_and_keeps_partial_result():
+    data = HEADER + b''.join(b'P%d,,1,1,yes\n' % i for i in range(5)) + b',,1,1,yes\n'
+    db = FakeDB(fail_on=2)
+    result = import_products(db, 1, io.BytesIO(data), batch_size=2)
+    # Lines 2-3 were written; the chunk starting at line 4 failed
+    assert result['inserted'] == 2
+    assert result['stopped'] == {'line': 4, 'error': 'Lost connection to MySQL server'}
+    assert db.names == ['P0', 'P1']
+
+
+def test_name_key_ignores_case_and_accents():
+    assert name_key('Café Crème') == name_key('CAFE creme')
+    assert name_key('Kale') != name_key('Kales')
+
+
+def test_import_updates_products_matching_under_the_collation():
+    db = FakeDB(existing={'Cafe Beans': 7})
+    data = HEADER + 'Café beans,,1,1,yes\nCAFÉ BEANS,,2,1,yes\nLeeks,,1,1,yes\n'.encode('utf-8')
+    result = import_products(db, 1, io.BytesIO(data))
+    assert (result['inserted'], result['updated']) == (1, 1)
+    assert db.updated == [7]
+    assert db.names == ['Leeks']
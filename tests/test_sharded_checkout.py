@@ -0,0 +1,164 @@
+"""End-to-end checkout across shards, against real MySQL instances.
+
+Skipped unless MARKETPLACE_SHARD_TEST=1. It writes users, products and
+orders, so point DB_* and SHARD_DSNS at disposable databases prepared as in
+the shards.py docstring (steps 1 to 3); the test runs `shards.py init`
+itself:
+
+    MARKETPLACE_SHARD_TEST=1 SHARD_DSNS=127.0.0.1:3307,127.0.0.1:3308 \\
+        python -m pytest tests/test_sharded_checkout.py
+"""
+import os
+import uuid
+
+import mysql.connector
+import pytest
+
+import db as database
+import shards
+from app import create_app
+
+pytestmark = pytest.mark.skipif(
+    os.environ.get('MARKETPLACE_SHARD_TEST') != '1' or not os.environ.get('SHARD_DSNS'),
+    reason='needs MARKETPLACE_SHARD_TEST=1 and SHARD_DSNS pointing at disposable MySQL instances')
+
+
+@pytest.fixture(scope='module')
+def app():
+    app = create_app()
+    app.config['TESTING'] = True
+    shards.main(['init'])
+    shards._farmer_shards.clear()
+    return app
+
+
+@pytest.fixture
+def conns(app):
+    home = database.get_db()
+    conns = shards.Connections(home)
+    yield conns
+    conns.close()
+    home.close()
+
+
+def fetch(db, sql, params=()):
+    cursor = db.cursor()
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    cursor.close()
+    db.rollback()
+    return rows
+
+
+def sign_up(app, role):
+    """Register and log in a new user; returns (test client, email)."""
+    client = app.test_client()
+    email = f'{role.lower()}-{uuid.uuid4().hex[:12]}@example.test'
+    client.post('/register', data={'name': f'Test {role.title()}', 'email': email, 'password': 'pw',
+                                   'location': '1 Test Lane', 'role': role})
+    response = client.post('/login', data={'email': email, 'password': 'pw'})
+    assert response.status_code == 302, 'login failed'
+    return client, email
+
+
+def add_product(client, conns, farmer_id, name):
+    client.post('/farmer/products/add', data={'name': name, 'description': 'test', 'price': '10', 'stock': '5'})
+    rows = fetch(conns.for_farmer(farmer_id), "SELECT id FROM Product WHERE farmerId = %s AND name = %s",
+                 (farmer_id, name))
+    assert rows, f'{name} was not stored on the farmer\'s shard'
+    return rows[0][0]
+
+
+def farmer_id_of(conns, email):
+    return fetch(conns.home, "SELECT f.id FROM Farmer f JOIN User u ON u.id = f.userId WHERE u.email = %s",
+                 (email,))[0][0]
+
+
+def place_farmer(conns, farmer_id, shard):
+    """Move a farmer with no data yet to shard."""
+    cursor = conns.home.cursor()
+    cursor.execute("UPDATE FarmerShard SET shardId = %s WHERE farmerId = %s", (shard, farmer_id))
+    conns.home.commit()
+    cursor.close()
+    shards.remember_shard(farmer_id, shard)
+
+
+def prepare_branch(shard, xid, sql, params):
+    """Leave an XA branch prepared on shard, as a crash after XA PREPARE would."""
+    db = mysql.connector.connect(**database.SHARD_CONFIGS[shard])
+    cursor = db.cursor()
+    cursor.execute("XA START %s", (xid,))
+    cursor.execute(sql, params)
+    cursor.execute("XA END %s", (xid,))
+    cursor.execute("XA PREPARE %s", (xid,))
+    cursor.close()
+    db.close()  # a prepared branch outlives its session
+
+
+def test_mixed_cart_checkout_and_recovery(app, conns):
+    # Two farmers on different shards, one of them not home, so both write paths run
+    farmer_a, email_a = sign_up(app, 'FARMER')
+    farmer_b, email_b = sign_up(app, 'FARMER')
+    id_a = farmer_id_of(conns, email_a)
+    id_b = farmer_id_of(conns, email_b)
+    shard_a = shards.shard_for_farmer(conns.home, id_a)
+    shard_b = shards.HOME_SHARD if shard_a != shards.HOME_SHARD else 1
+    if shards.shard_for_farmer(conns.home, id_b) != shard_b:
+        place_farmer(conns, id_b, shard_b)
+    remote_farmer, remote_shard = (id_a, shard_a) if shard_a != shards.HOME_SHARD else (id_b, shard_b)
+    remote_client = farmer_a if remote_farmer == id_a else farmer_b
+
+    product_a = add_product(farmer_a, conns, id_a, 'Shard Test Kale')
+    product_b = add_product(farmer_b, conns, id_b, 'Shard Test Leeks')
+    spare = add_product(remote_client, conns, remote_farmer, 'Shard Test Spare')
+    assert shards.shard_for_id(product_a) == shard_a
+    assert shards.shard_for_id(product_b) == shard_b
+
+    # A buyer checks out a cart holding both
+    buyer, buyer_email = sign_up(app, 'BUYER')
+    buyer_id = fetch(conns.home, "SELECT id FROM User WHERE email = %s", (buyer_email,))[0][0]
+    for product_id in (product_a, product_b):
+        buyer.post(f'/buyer/cart/add/{product_id}', data={'quantity': '1'})
+    response = buyer.post('/buyer/checkout')
+    assert response.headers['Location'].endswith('/buyer/payment')
+    response = buyer.post('/buyer/payment/process', data={'payment_method': 'upi'})
+    assert response.headers['Location'].endswith('/buyer/payment/success')
+
+    checkout_id = fetch(conns.home, "SELECT id FROM Checkout WHERE customerId = %s ORDER BY id DESC LIMIT 1",
+                        (buyer_id,))[0][0]
+    assert fetch(conns.home, "SELECT status FROM Payment WHERE checkoutId = %s", (checkout_id,)) == [('completed',)]
+    for shard, product_id in ((shard_a, product_a), (shard_b, product_b)):
+        db = conns.get(shard)
+        items = fetch(db, """
+            SELECT oi.id FROM OrderItem oi JOIN `Order` o ON o.id = oi.orderId
+            WHERE o.checkoutId = %s AND oi.productId = %s
+        """, (checkout_id, product_id))
+        assert len(items) == 1, f'no order item on shard {shard}'
+        assert fetch(db, "SELECT COUNT(*) FROM Payout WHERE orderItemId = %s", (items[0][0],)) == [(1,)]
+        assert fetch(db, "SELECT COUNT(*) FROM Cart WHERE userId = %s", (buyer_id,)) == [(0,)]
+        assert shards.checkout_xid(checkout_id) not in shards._prepared_xids(db)
+
+    # Scatter-gather read: the buyer's order history shows both items
+    page = buyer.get('/buyer/orders').get_data(as_text=True)
+    assert 'Shard Test Kale' in page and 'Shard Test Leeks' in page
+
+    # A crash left one branch prepared for the paid checkout and one for an unpaid one
+    cursor = conns.home.cursor()
+    cursor.execute("INSERT INTO Checkout (customerId, grandTotal, deliveryFee) VALUES (%s, 10, 0)", (buyer_id,))
+    unpaid_id = cursor.lastrowid
+    conns.home.commit()
+    cursor.close()
+    prepare_branch(remote_shard, shards.checkout_xid(checkout_id),
+                   "UPDATE Product SET description = 'committed' WHERE id = %s",
+                   (product_a if remote_shard == shard_a else product_b,))
+    prepare_branch(remote_shard, shards.checkout_xid(unpaid_id),
+                   "UPDATE Product SET description = 'rolled back' WHERE id = %s", (spare,))
+
+    committed, rolled_back = shards.recover(conns, grace=0)
+    assert committed >= 1 and rolled_back >= 1
+    remote_db = conns.get(remote_shard)
+    assert not {shards.checkout_xid(checkout_id), shards.checkout_xid(unpaid_id)} & shards._prepared_xids(remote_db)
+    descriptions = dict(fetch(remote_db, "SELECT id, description FROM Product WHERE farmerId = %s",
+                              (remote_farmer,)))
+    assert 'committed' in descriptions.values()
+    assert descriptions[spare] == 'test'
@@ -0,0 +1,163 @@
+from datetime import datetime
+from operator import attrgetter
+
+import pytest
+
+import db as database
+import dao
+import shards
+from db import parse_dsn
+from order_events import format_position, parse_position
+
+DEFAULTS = {'host': '127.0.0.1', 'port': 3306, 'user': 'root', 'password': 'secret', 'database': 'marketplacedb2'}
+
+
+@pytest.fixture
+def three_shards(monkeypatch):
+    monkeypatch.setattr(database, 'SHARD_CONFIGS', [DEFAULTS] * 3)
+
+
+@pytest.mark.parametrize('dsn, expected', [
+    ('db2', {'host': 'db2'}),
+    ('db2:3307', {'host': 'db2', 'port': 3307}),
+    ('127.0.0.1:3308/shard2', {'host': '127.0.0.1', 'port': 3308, 'database': 'shard2'}),
+    ('app@db2', {'host': 'db2', 'user': 'app'}),
+    ('app:p@ss:word@db2:3307/shard', {'host': 'db2', 'port': 3307, 'database': 'shard',
+                                      'user': 'app', 'password': 'p@ss:word'}),
+    ('app:@db2', {'host': 'db2', 'user': 'app', 'password': ''}),
+])
+def test_parse_dsn(dsn, expected):
+    assert parse_dsn(dsn, DEFAULTS) == {**DEFAULTS, **expected}
+
+
+@pytest.mark.parametrize('positions, position', [
+    ({0: 42}, '42'),
+    ({0: 0}, '0'),
+    ({2: 7, 0: 5}, '0:5,2:7'),
+    ({1: 134217730}, '1:134217730'),
+])
+def test_position_round_trip(positions, position):
+    assert format_position(positions) == position
+    assert parse_position(position) == positions
+
+
+@pytest.mark.parametrize('position', ['', 'abc', '0:1,2', '0:1:2', '1:x'])
+def test_parse_position_rejects_malformed(position):
+    with pytest.raises(ValueError):
+        parse_position(position)
+
+
+def test_shard_for_id(three_shards):
+    block = 1 << shards.SHARD_ID_BITS
+    assert shards.shard_for_id(1) == 0
+    assert shards.shard_for_id(block) == 1
+    assert shards.shard_for_id(2 * block + 5) == 2
+    # Blocks of shards that aren't configured fall back to home
+    assert shards.shard_for_id(3 * block) == 0
+
+
+def test_group_by_shard_in_shard_order(three_shards):
+    block = 1 << shards.SHARD_ID_BITS
+    rows = [2 * block + 1, 5, block + 3, 2 * block + 2]
+    assert shards.group_by_shard(rows, lambda row: row) == {0: [5], 1: [block + 3], 2: [2 * block + 1, 2 * block + 2]}
+
+
+def test_single_shard_is_passed_through():
+    stream = iter([3, 1, 2])
+    assert shards.merge([stream], key=lambda row: row) is stream
+
+
+def test_merge_newest_first_and_closes_streams():
+    closed = []
+
+    def stream(name, rows):
+        try:
+            yield from rows
+        finally:
+            closed.append(name)
+
+    Row = dao.CatalogRow
+    row = lambda id, day: Row(id, '', '', 1, 1, 0, '', 0, datetime(2026, 1, day))
+    merged = shards.merge([stream('home', [row(1, 9), row(2, 3)]), stream('shard1', [row(3, 8), row(4, 1)])],
+                          key=attrgetter('createdAt'), reverse=True)
+    assert [r.id for r in merged] == [1, 3, 2, 4]
+    assert sorted(closed) == ['home', 'shard1']
+
+
+def test_buyer_orders_merge_keeps_each_orders_items_together():
+    def item(order_id, day, order_item_id):
+        return dao.BuyerOrderRow(order_id, datetime(2026, 3, day), 10, '', order_item_id, 1, 1,
+                                 'pending', None, 1, '', '')
+
+    # Each shard's rows in BUYER_ORDERS_SQL order: newest order first, its items ascending
+    home = [item(5, 9, 50), item(5, 9, 51), item(2, 1, 20)]
+    shard1 = [item(7, 9, 70), item(7, 9, 72), item(3, 4, 30)]
+    merged = list(shards.merge([iter(home), iter(shard1)], key=dao.buyer_order_key, reverse=True))
+    assert [(row.order_id, row.order_item_id) for row in merged] == [
+        (7, 70), (7, 72), (5, 50), (5, 51), (3, 30), (2, 20),
+    ]
+
+
+class XADB:
+    """Records the XA statements a Branch sends, and reconnects."""
+
+    def __init__(self):
+        self.statements = []
+        self.reconnects = 0
+        db = self
+
+        class Cursor:
+            def execute(self, sql, params=()):
+                db.statements.append(sql.split(' %s')[0])
+
+            def close(self):
+                pass
+
+        self.cursor = lambda: Cursor()
+
+    def rollback(self):
+        pass
+
+    def reconnect(self):
+        self.reconnects += 1
+
+
+def prepared_branch():
+    db = XADB()
+    branch = shards.Branch(db, shards.checkout_xid(7))
+    branch.start()
+    branch.prepare()
+    return db, branch
+
+
+def test_branch_commit_after_prepare():
+    db, branch = prepared_branch()
+    branch.commit()
+    assert db.statements == ['XA START', 'XA END', 'XA PREPARE', 'XA COMMIT']
+    assert branch.state is None
+
+
+def test_branch_rollback_before_prepare_ends_it_first():
+    db = XADB()
+    branch = shards.Branch(db, shards.checkout_xid(7))
+    branch.start()
+    branch.rollback()
+    assert db.statements == ['XA START', 'XA END', 'XA ROLLBACK']
+
+
+def test_branch_left_prepared_when_home_commit_is_ambiguous():
+    db, branch = prepared_branch()
+    branch.leave_prepared()
+    # Neither committed nor rolled back: recover() decides from the payment on home
+    assert db.statements == ['XA START', 'XA END', 'XA PREPARE']
+    assert db.reconnects == 1
+    assert branch.state is None
+
+
+def test_unprepared_branch_is_rolled_back_rather_than_left():
+    db = XADB()
+    branch = shards.Branch(db, shards.checkout_xid(7))
+    branch.start()
+    branch.leave_prepared()
+    assert db.statements == ['XA START', 'XA END', 'XA ROLLBACK']
+    assert db.reconnects == 0
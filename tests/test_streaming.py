@@ -0,0 +1,98 @@
+import gzip
+
+import pytest
+from flask import Flask, jsonify
+from jinja2 import DictLoader
+
+import streaming
+from streaming import CHUNK_SIZE, MIN_SIZE, compress_response, stream_page
+
+TEMPLATES = {'rows.html': '{% for row in rows %}<p>{{ row }}</p>{% endfor %}'}
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.jinja_loader = DictLoader(TEMPLATES)
+    app.after_request(compress_response)
+
+    @app.route('/rows/<int:count>')
+    def rows(count):
+        return stream_page('rows.html', rows=(f'row {i:05d}' for i in range(count)))
+
+    @app.route('/json/<int:size>')
+    def json(size):
+        return jsonify(data='x' * size)
+
+    @app.route('/missing')
+    def missing():
+        return 'x' * MIN_SIZE * 2, 404
+
+    return app.test_client()
+
+
+def rows_html(count):
+    return ''.join(f'<p>row {i:05d}</p>' for i in range(count))
+
+
+def test_stream_is_sent_in_chunk_size_pieces(client):
+    response = client.get('/rows/3000', buffered=False)
+    chunks = [chunk for chunk in response.response if chunk]
+    assert b''.join(chunks).decode() == rows_html(3000)
+    assert len(chunks) > 1
+    # Every piece but the last holds at least CHUNK_SIZE bytes, less than one fragment more
+    assert all(CHUNK_SIZE <= len(chunk) < CHUNK_SIZE + 20 for chunk in chunks[:-1])
+    response.close()
+
+
+def test_small_page_is_not_compressed(client):
+    response = client.get('/rows/3', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data(as_text=True) == rows_html(3)
+    assert 'Accept-Encoding' in response.vary
+
+
+def test_large_page_is_gzipped(client):
+    response = client.get('/rows/3000', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert gzip.decompress(response.get_data()).decode() == rows_html(3000)
+
+
+def test_identity_without_accept_encoding(client):
+    response = client.get('/rows/3000')
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data(as_text=True) == rows_html(3000)
+
+
+def test_gzip_when_brotli_is_not_installed(client, monkeypatch):
+    monkeypatch.setattr(streaming, 'brotli', None)
+    response = client.get('/rows/3000', headers={'Accept-Encoding': 'br, gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+
+def test_brotli_preferred_when_accepted(client):
+    brotli = pytest.importorskip('brotli')
+    response = client.get('/rows/3000', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.get_data()).decode() == rows_html(3000)
+
+
+def test_buffered_response_compressed_above_min_size(client):
+    response = client.get(f'/json/{MIN_SIZE * 4}', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert gzip.decompress(response.get_data()).count(b'x') == MIN_SIZE * 4
+
+
+def test_buffered_response_left_alone_below_min_size(client):
+    response = client.get('/json/10', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.vary
+
+
+def test_error_responses_are_not_compressed(client):
+    response = client.get('/missing', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 404
+    assert 'Content-Encoding' not in response.headers